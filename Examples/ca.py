@@ -1,13 +1,13 @@
 
 from __future__ import annotations
 
-from copy import copy
-from itertools import chain, repeat
 from random import choice
 
 import numpy as np
 
 import core.gui as gui
+from core.ca_history import CA_History, MAX_ROWS, Packed_History
+from core.ca_rules import rule_tables
 from core.gui import HOR_SEP
 from core.on_off import OnOffPatch, OnOffWorld, on_off_left_upper
 from core.sim_engine import SimEngine
@@ -43,13 +43,30 @@ class CA_World(OnOffWorld):
         self.set_switches_from_rule_nbr()
         self.set_binary_nbr_from_rule_nbr()
 
-        # self.ca_lines is a list of lines, each of which is a list or string of 0/1. Each line
-        # representsa state of the CA, i.e., all the symbols in the line. self.ca_list contains
-        # the entire history of the CA.
-        self.lists = None
-        self.padding_element = None
-        self.ca_lines = []
-        SimEngine.gui_set('rows', value=len(self.ca_lines))
+        # self.rule_table[i] is the new value (0 or 1) of a cell whose triple, as a binary number, is i.
+        # It's bit i of self.rule_nbr, i.e., the setting of switch bin_str(i, 3). See set_rule_table.
+        self.rule_table: np.ndarray = None
+        self.set_rule_table()
+
+        # self.ca_history holds the recent lines of the CA, each an np.uint8 array of 0/1. Each line
+        # represents a state of the CA, i.e., all the symbols in the line. Each line also has a left
+        # column. Rather than pad the older lines when a new line is longer, the history keeps track of
+        # where each line starts. See core.ca_history. It retains up to the 'max_rows' most recent lines.
+        self.ca_history = CA_History()
+        SimEngine.gui_set('rows', value=self.ca_history.nbr_lines)
+
+        # If a file name is given in 'record_file' at setup, every line is also appended to a
+        # Packed_History in that file, e.g., to analyze runs far longer than the rows kept.
+        self.recording: Packed_History = None
+
+        # When 'scroll' is checked, the display is self.display_states, an array of the patches' states,
+        # rather than the patches themselves. If the window onto the history starts at the same column
+        # (self.display_left) as before, a step scrolls it up one row and fills in only the new bottom row.
+        # self.rows_to_scroll is the number of such steps since the screen was drawn, or None if the whole
+        # display must be redrawn. See draw_changes.
+        self.display_states: np.ndarray = None
+        self.display_left = None
+        self.rows_to_scroll = None
 
     def build_initial_line(self):
         """
@@ -62,18 +79,16 @@ class CA_World(OnOffWorld):
         How much to put on each end depends on the user-specific initial line and the requested justification.
         """
         if SimEngine.gui_get('Random?'):
-            line = [choice([0, 1]) for _ in range(self.ca_display_size)] if self.lists else \
-                   ''.join([choice(['0', '1']) for _ in range(self.ca_display_size)])
+            line = [choice([0, 1]) for _ in range(self.ca_display_size)]
         else:
-            padding = self.padding_element * (self.ca_display_size)
+            padding = [0] * (self.ca_display_size)
             if SimEngine.gui_get('init_line') == '':
                 line = padding
             else:
                 line_0 = SimEngine.gui_get('init_line')
                 # Convert line_0 to 0's and 1's
                 # Treat '0' and ' ' as "not on".
-                line = [0 if c in ' 0' else 1 for c in line_0] if self.lists else \
-                       ''.join(['0' if c in ' 0' else '1' for c in line_0])
+                line = [0 if c in ' 0' else 1 for c in line_0]
                 if SimEngine.gui_get('000'):
                     justification = SimEngine.gui_get('justification')
                     line_len = len(line)
@@ -81,61 +96,39 @@ class CA_World(OnOffWorld):
                     line = actual_padding + line if justification == 'Right' else \
                            line + actual_padding if justification == 'Left' else \
                            actual_padding[len(actual_padding)//2:] + line + actual_padding[len(actual_padding)//2:]
-        return line
+        return np.array(line, dtype=np.uint8)
 
-    # Used only for the list case
-    @staticmethod
-    def drop_extraneous_0s_from_ends_of_new_line(new_line):
-        """
-        Drop the end cell at each end of new_line if it is 0. Keep it otherwise.
-        Return the result.
-        Args:
-            new_line: ca_state with perhaps extraneous 0 cells at the ends
-
-        Returns: trimmed ca_state without extraneous 0 cells at the ends.
-        """
-        # Drop the 0's at the ends that are 0.
-        if not new_line[0]:
-            new_line.pop(0)
-        if not new_line[-1]:
-            new_line.pop(-1)
-        return new_line
-
-    # Used only for the list case
-    def extend_ca_lines_if_needed(self, new_line):
-        """
-        new_line is one cell longer at each then than ca_lines[-1]. If those extra
-        cells are 0, delete them. If they are 1, insert a 0 cell at the corresponding
-        end of each line in ca_lines
-        """
-        # new_line is longer than the original line by one on each end.
-        # Extend the other lines in self.ca_lines for the ends that are non-zero
-        if new_line[0] or new_line[-1]:
-            for line in self.ca_lines:
-                if new_line[0]:
-                    line.insert(0, 0)
-                if new_line[-1]:
-                    line.append(0)
+    def draw(self):
+        if self.display_states is None:
+            super().draw()
+        else:
+            gui.draw_patch_states(self.display_states, self.palette())
+            self.rows_to_scroll = 0
+
+    def draw_changes(self):
+        """ When scrolling by a single row, scroll the screen and draw only the bottom row. """
+        if self.display_states is None:
+            return super().draw_changes()
+        if self.rows_to_scroll != 1:
+            return [] if self.rows_to_scroll == 0 else None
+        self.rows_to_scroll = 0
+        scrolled_rect = gui.scroll_patch_rows(1)
+        gui.draw_patch_states(self.display_states[-1:], self.palette(), first_row=gui.PATCH_ROWS - 1)
+        return [scrolled_rect]
 
     def generate_new_line_from_current_line(self, prev_line):
         """
-        The argument is (a copy of) the current line. We call it prev_line because that's the role
-        it plays in this method.
+        The argument is the current line, an np.uint8 array of 0's and 1's. We call it prev_line because
+        that's the role it plays in this method.
 
         Generate the new line in these steps.
-        1. Add '00' or (0, 0) to both ends of prev_line. (We do that because we want to allow the
+        1. Add two 0's to both ends of prev_line. (We do that because we want to allow the
         new line to extend the current line on either end. So start with a default extension.
         In addition, we need a triple to generate the symbols at the end of the new line.)
-        Strings are immutable; string concatenation (+) does not change the original strings.
 
         2. Apply the rules (i.e., the switches) to the triples extracted from the line resulting from step 1.
-
-            a. Look up the truth value of each triple. Is its switch on or off?
-            b. Convert that boolean first to an int (0 or 1) and then to a character ('0' or '1').
-            These two steps are done in a single list comprehension. The result is new_line_chars: List[str].
-            Each element of new_line_chars is a string of one character, either '0' or '1'.
-
-            c. Use join to combine that list of characters into a new string.
+        Compute the triple at each position as a number, 4*left + 2*center + right. Rather than look up
+        each triple's switch, look up all the numbers at once in self.rule_table.
 
         This produces a line which is one symbol shorter than the current prev_line on each end.
         That is, it is one symbol longer on each end than the original current line. It may have
@@ -145,24 +138,9 @@ class CA_World(OnOffWorld):
             prev_line: The current state of the CA.
         Returns: The next state of the CA.
         """
-        # Extend the current line two to the left and right.
-        # Want to be able to generate one additional value at each end.
-        if self.lists:
-            prev_line.insert(0, 0)
-            prev_line.insert(0, 0)
-            prev_line.extend([0, 0])
-            triples = [''.join(map(str, prev_line[i:i + 3])) for i in range(len(prev_line) - 2)]
-            new_line = [int(SimEngine.gui_get(triple)) for triple in triples]
-        else:
-            prev_line = '00' + prev_line + '00'
-
-            # For each triple of characters in the prev_line, look up the setting of the corresponding switch.
-            # (SimEngine.gui_get(prev_line[i:i + 3]))
-            # Convert its Truth value (rule is on/off) to an int and then to a one character str.
-            new_line_chars = [str(int(SimEngine.gui_get(prev_line[i:i + 3]))) for i in range(len(prev_line) - 2)]
-
-            # Finally, join those strings together into a new string.
-            new_line = ''.join(new_line_chars)
+        padded = np.pad(prev_line, 2)
+        triples = 4*padded[:-2] + 2*padded[1:-1] + padded[2:]
+        new_line = self.rule_table.take(triples)
         return new_line
 
     def get_rule_nbr_from_switches(self):
@@ -195,6 +173,12 @@ class CA_World(OnOffWorld):
             disabled = SimEngine.gui_get('Random?')
             SimEngine.gui_set('init_line', visible=not disabled, value='1')
 
+        # Switch between displaying the patches and scrolling. Either way, redraw the whole display.
+        # Before the first setup, there is nothing to display.
+        elif event == 'scroll' and self.ca_history.nbr_lines > 0:
+            self.display_left = None
+            self.set_display_from_lines()
+
     def make_switches_and_rule_nbr_consistent(self):
         """
         Make the Slider, the switches, and the bin number consistent: all should contain self.rule_nbr.
@@ -206,6 +190,7 @@ class CA_World(OnOffWorld):
             self.rule_nbr = SimEngine.gui_get('Rule_nbr')
             self.set_switches_from_rule_nbr()
         self.set_binary_nbr_from_rule_nbr()
+        self.set_rule_table()
 
     def set_binary_nbr_from_rule_nbr(self):
         """
@@ -221,23 +206,33 @@ class CA_World(OnOffWorld):
         new_bin_value = binary_rule_nbr + ' (binary)'
         SimEngine.gui_set('bin_string', value=new_bin_value)
 
+    def mouse_click(self, xy):
+        """ When scrolling, the display is self.display_states, not the patches. Toggle the clicked cell there. """
+        if self.display_states is None:
+            super().mouse_click(xy)
+            return
+        patch = self.pixel_tuple_to_patch(xy)
+        self.display_states[patch.row, patch.col] ^= 1
+        self.rows_to_scroll = None
+
     def set_display_from_lines(self):
         """
-        Copy values from self.ca_lines to the patches. There are two issues.
-        1. Is self.ca_lines longer/shorter than the number of Patch rows in the display?
+        Copy values from self.ca_history to the patches. There are two issues.
+        1. Is self.ca_history longer/shorter than the number of Patch rows in the display?
         2. Are there more/fewer symbols-per-line than Patches-per-row?
         What do you do in each case?
 
-        This is the most difficult method. Here is the outline I used.
+        The lines in self.ca_history may start at different columns and have different widths.
+        Justify the columns that include all of them, (ca_left, ca_right), as if every line were padded
+        with 0's to that width. Then take the window of the history to be displayed (see CA_History.window).
         """
         # Get the current setting of 'justification'.
         justification = SimEngine.gui_get('justification')
 
         # Get the two relevant widths.
         display_width = gui.PATCH_COLS
-
-        # All the lines in self.ca_lines are the same length.
-        ca_line_width = len(self.ca_lines[0])
+        (ca_left, ca_right) = self.ca_history.extent()
+        ca_line_width = ca_right - ca_left
 
         # How many blanks must be prepended to a line to be displayed to fill a display row?
         # Will be 0 if the ca_line is at least as long as the display row or the line is left-justified.
@@ -245,63 +240,40 @@ class CA_World(OnOffWorld):
                               (display_width - ca_line_width)//2  if justification == 'Center' else \
                               display_width - ca_line_width     # if justification == 'Right'
 
-        # Use [0]*n to get a list of n 0s to use as left padding.
-        left_padding = self.padding_element * left_padding_needed
-
         # Which symbols of the ca_line are to be displayed?
         # More to the point, what is index of the first symbol of the line to be displayed?
-        # Will be 0 if left_padding is the empty list. Otherwise compute the values for the other cases.
+        # Will be 0 if there is left padding. Otherwise compute the values for the other cases.
         left_ca_line_index = 0 if display_width >= ca_line_width or justification == 'Left' else \
                              (ca_line_width - display_width)//2  if justification == 'Center' else \
                              ca_line_width - display_width     # if justification == 'Right'
 
-        # Reverse both self.ca_lines and CA_World.patches_array.
-        ca_lines_to_display = reversed(self.ca_lines)
-        patch_rows_to_display_on = np.flip(CA_World.patches_array, axis=0)
-
-        # Now we can use zip to match up ca_lines_to_display and patch_rows_to_display on.
-        # In both cases we are starting at the bottom and working our way up.
-        ca_lines_patch_rows = zip(ca_lines_to_display, patch_rows_to_display_on)
-
-        # zip is given two iterables and produces a sequence of pairs of elements, one from each.
-        # An important feature of zip is that it stops whenever either of its arguments ends.
-        # In particular, the two arguments needn't be the same length. Zip simply uses all the elements
-        # of the shorter argument and pairs them with the initial elements of the longer argument.
-
-        # We can now step through the corresponding pairs.
-        for (ca_line, patch_row) in ca_lines_patch_rows:
-            # The values in ca_line are to be displayed on patch_row.
-            # The issue now is how to align them.
-
-            # Which symbols of ca_line should be displayed?
-            # We display all the symbols starting at left_ca_line_index (computed above).
-            # Use a slice to identify these symbols.
-            ca_line_portion = ca_line[left_ca_line_index:]
-
-            # For the complete display line and the desired justification,
-            # we may need to pad ca_line_portion to the left or right (or both).
-            # We need left_padding (computed above) to the left and an arbitrary sequence of 0's to the right.
-            # (Use repeat() from itertools for the padding on the right. It doesn't matter if it's too long!)
-
-            # Put the three pieces together to get the full line.
-            # Use chain() from itertools to combine the three parts of the line:
-            #                   left_padding, ca_line_portion, right_padding.
-            padded_line = chain(left_padding, ca_line_portion, repeat('0'))
-
-            # padded_line has the right number of 0's at the left. It then contains the symbols from ca_line
-            # to be displayed. If we need more symbols to display, padded_line includes an unlimted number of
-            # trailing 0's.
-
-            # Since padded_line will be displayed on patch_row, we can use zip again to pair up the values
-            # from padded_line with the Patches in patch_row. Since padded_line includes an unlimited number
-            # of 0's at the end, zip will stop when it reaches the last Patch in patch_row.
-
-            ca_values_patchs = zip(padded_line, patch_row)
-
-            # Step through these value/patch pairs and put the values into the associated Patches.
-            for (ca_val, patch) in ca_values_patchs:
-                # Use the set_on_off() method of OnOffPatch to set the patch based on ca_val.
-                patch.set_on_off(int(ca_val))
+        # The most recent lines go on the bottom rows of the display.
+        display_left = ca_left + left_ca_line_index - left_padding_needed
+        nbr_rows = min(len(self.ca_history), gui.PATCH_ROWS)
+
+        if SimEngine.gui_get('scroll'):
+            if display_left == self.display_left:
+                # Scroll the display up one row (a memmove) and add the new line at the bottom.
+                self.display_states[:-1] = self.display_states[1:]
+                self.display_states[-1] = self.ca_history.window(len(self.ca_history) - 1, 1,
+                                                                 display_left, display_width)
+                self.rows_to_scroll = None if self.rows_to_scroll is None else self.rows_to_scroll + 1
+            else:
+                self.display_states = np.zeros((gui.PATCH_ROWS, display_width), dtype=np.uint8)
+                self.display_states[gui.PATCH_ROWS - nbr_rows:] = \
+                    self.ca_history.window(len(self.ca_history) - nbr_rows, nbr_rows, display_left, display_width)
+                self.rows_to_scroll = None
+            self.display_left = display_left
+            return
+
+        (self.display_states, self.display_left) = (None, None)
+        window = self.ca_history.window(len(self.ca_history) - nbr_rows, nbr_rows, display_left, display_width)
+        patch_rows = CA_World.patches_array[gui.PATCH_ROWS - nbr_rows:]
+        for (ca_val, patch) in zip(window.flat, patch_rows.flat):
+            patch.set_on_off(ca_val)
+
+    def set_rule_table(self):
+        self.rule_table = rule_tables(self.rule_nbr)[0]
 
     def set_switches_from_rule_nbr(self):
         """
@@ -327,11 +299,8 @@ class CA_World(OnOffWorld):
         use the value derived from the switches as the new value of self.rule_nbr.
 
         Once the slider, the switches, and the bin_string of the rule number are consistent,
-        set self.ca_lines[0] to the line generated by build_initial_line.
+        start self.ca_history with the line generated by build_initial_line.
         """
-        self.lists = SimEngine.gui_get('lists_or_strings') == 'Lists'
-        self.padding_element = [0] if self.lists else '0'
-
         self.make_switches_and_rule_nbr_consistent()
 
         for patch in CA_World.patches:
@@ -339,51 +308,50 @@ class CA_World(OnOffWorld):
 
         initial_line = self.build_initial_line()
 
-        self.ca_lines = [initial_line]
+        max_rows = max(int(SimEngine.gui_get('max_rows') or MAX_ROWS), gui.PATCH_ROWS)
+        self.ca_history = CA_History(max_rows)
+        self.ca_history.append(initial_line, 0)
 
+        if self.recording is not None:
+            self.recording.close()
+        record_file = (SimEngine.gui_get('record_file') or '').strip()
+        self.recording = Packed_History(record_file) if record_file else None
+        if self.recording is not None:
+            self.recording.append(initial_line, 0)
+
+        self.display_left = None
         self.set_display_from_lines()
+        SimEngine.gui_set('rows', value=self.ca_history.nbr_lines)
 
     def step(self):
         """
         Take one step in the simulation.
-        (a) Generate an additional line for the ca. (Use a copy of self.ca_lines[-1].)
-        (b) Extend all lines in ca_lines if the new line is longer (with additional 1's) than its predecessor.
-        (c) Trim the new line and add it to the end of self.ca_lines.
-        (d) Refresh display from values in self.ca_lines.
+        (a) Generate an additional line for the ca from the most recent line in self.ca_history.
+        (b) Trim the new line: drop the cell it added at each end if that cell is 0.
+        (c) Add the trimmed line to self.ca_history. If the new line is longer than its predecessor,
+            it starts one column further to the left, or ends one further to the right, or both.
+            The older lines are not changed.
+        (d) Refresh display from values in self.ca_history.
         """
         # (a)
-        new_line: str = self.generate_new_line_from_current_line(copy(self.ca_lines[-1]))
+        (current_line, current_left) = self.ca_history.line(-1)
+        new_line = self.generate_new_line_from_current_line(current_line)
 
         # (b)
-        # Extend lines in self.ca_lines at each end as needed. (Don't extend for extra 0's at the ends.)
-        if self.lists:
-            self.extend_ca_lines_if_needed(new_line)
-        else:  # Strings
-            line_end = {'1': '0', '0': ''}
-            # If either end is '1', add '0' to that end of all strings.
-            # Can't drop the 0's first because we would lose track of which end was extended.
-            if '1' in (new_line[0], new_line[-1]):
-                # Use the line_end dictionary to look up values for left_end and right_end
-                left_end = line_end[new_line[0]]
-                right_end = line_end[new_line[-1]]
-                self.ca_lines = [left_end + line + right_end for line in self.ca_lines]
+        start = 0 if new_line[0] else 1
+        end = len(new_line) if new_line[-1] else len(new_line) - 1
 
         # (c)
-        if self.lists:
-            trimmed_new_line = self.drop_extraneous_0s_from_ends_of_new_line(new_line)
-        else:  # Strings
-            start = 0 if new_line[0] == '1' else 1
-            end = len(new_line) if new_line[-1] == '1' else len(new_line) - 1
-            trimmed_new_line: str = new_line[start:end]
-
-        # Add trimmed_new_line to the end of self.ca_lines
-        self.ca_lines.append(trimmed_new_line)
+        # new_line starts one column to the left of current_line.
+        self.ca_history.append(new_line[start:end], current_left - 1 + start)
+        if self.recording is not None:
+            self.recording.append(new_line[start:end], current_left - 1 + start)
 
         # (d)
-        # Refresh the display from self.ca_lines
+        # Refresh the display from self.ca_history
         self.set_display_from_lines()
         # Update the 'rows' widget.
-        SimEngine.gui_set('rows', value=len(self.ca_lines))
+        SimEngine.gui_set('rows', value=self.ca_history.nbr_lines)
 
 
 # ############################################## Define GUI ############################################## #
@@ -410,8 +378,18 @@ ca_left_upper = [[sg.Text('Row justification'),
 
                  [sg.Text('Rows:', pad=(None, (10, 0))), sg.Text('     0', key='rows', pad=(None, (10, 0)))],
 
-                 [sg.Text('Lists or Strings', pad=(None, None)),
-                  sg.Combo(values=['Lists', 'Strings'], key='lists_or_strings', default_value='Lists')],
+                 [sg.CB('Scroll?', key='scroll', default=True, enable_events=True,
+                        tooltip='Scroll the display up and draw only the new row when the row width allows')],
+
+                 [sg.Text('Rows kept', pad=(None, None)),
+                  sg.Slider(key='max_rows', range=(CA_World.ca_display_size, 10000), resolution=25,
+                            default_value=MAX_ROWS, orientation='horizontal', size=(10, 20),
+                            tooltip='The number of most recent rows to keep. Used at setup.')],
+
+                 [sg.Text('Record to file'),
+                  sg.Input(default_text='', key='record_file', size=(16, 1),
+                           tooltip='If not empty, the file to which setup starts recording all the rows, '
+                                   'bit-packed. See core.ca_history.Packed_History.')],
 
                  HOR_SEP(30, pad=(None, (0, 10)))
 
@@ -0,0 +1,130 @@
+"""
+Evolve many elementary CA rules from many initial lines at once, without the GUI, and summarize
+each rule's behavior. E.g., python -m Examples.ca_rule_explorer from the PyLogo directory
+prints a table of all 256 rules.
+
+The lines have a fixed width and wrap around at the ends. (CA_World's lines instead grow.)
+The lines of all the rules and seeds are a single (rules x seeds x width) np.uint8 array, which
+is updated in one step by looking up every cell's triple in the table of its rule. See core.ca_rules.
+
+Statistics are accumulated as the CA runs. Only the current lines, and for cycle detection
+one earlier line per rule and seed, are kept.
+    density:    the average fraction of cells that are 1.
+    entropy:    the average Shannon entropy, in bits (0 to 3), of the triples in a line.
+    transient:  the number of steps before a line first repeats.
+    period:     the number of steps between repeats.
+Cycles are found with Brent's algorithm. A second pass, from the initial lines, finds the
+transients. Brent's algorithm may take up to about twice transient + period steps to find a cycle.
+Lines whose cycle isn't found within the number of steps have transient and period -1.
+"""
+from __future__ import annotations
+
+from multiprocessing import Pool
+from typing import Dict, Sequence
+
+import numpy as np
+
+from core.ca_rules import rule_tables
+
+
+def explore_rules(rule_nbrs: Sequence[int] = range(256), nbr_seeds=16, width=128, nbr_steps=1000,
+                  density=0.5, seed=0, processes=1) -> Dict[str, np.ndarray]:
+    """
+    Run each rule in rule_nbrs from the same nbr_seeds random initial lines, with the given density of 1's,
+    for nbr_steps steps. Returns a dict of arrays, each with a row per rule:
+        'rule_nbr', 'density', 'entropy', 'transient', and 'period'. The last two have a column per seed.
+    With processes > 1, the rules are divided among that many processes.
+    """
+    rule_nbrs = np.asarray(rule_nbrs, dtype=np.int64)
+    initial_lines = (np.random.default_rng(seed).random((nbr_seeds, width)) < density).astype(np.uint8)
+    if processes > 1 and len(rule_nbrs) > 1:
+        shards = np.array_split(rule_nbrs, processes)
+        with Pool(processes) as pool:
+            results = pool.starmap(run_rules, [(shard, initial_lines, nbr_steps) for shard in shards])
+        return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+    return run_rules(rule_nbrs, initial_lines, nbr_steps)
+
+
+def next_lines(lines: np.ndarray, tables: np.ndarray, table_offsets: np.ndarray):
+    """
+    lines is (rules x seeds x width). tables is rule_tables(rule_nbrs).ravel(): rule r's table
+    starts at table_offsets[r] = 8*r. Returns the next lines and the triples of the current lines.
+    """
+    triples = 4*np.roll(lines, 1, axis=2) + 2*lines + np.roll(lines, -1, axis=2)
+    return (tables.take(triples + table_offsets), triples)
+
+
+def run_rules(rule_nbrs: np.ndarray, initial_lines: np.ndarray, nbr_steps) -> Dict[str, np.ndarray]:
+    """ The statistics for rule_nbrs, all run from initial_lines. See explore_rules. """
+    (nbr_rules, (nbr_seeds, width)) = (len(rule_nbrs), initial_lines.shape)
+    tables = rule_tables(rule_nbrs).ravel()
+    table_offsets = (8 * np.arange(nbr_rules)).reshape(-1, 1, 1)
+    start_lines = np.broadcast_to(initial_lines, (nbr_rules, nbr_seeds, width))
+
+    density_sum = np.zeros(nbr_rules)
+    entropy_sum = np.zeros(nbr_rules)
+
+    # Brent's cycle detection, for each rule and seed. The current line is compared with saved_lines.
+    # When a line has been saved for saved_for steps, a power of 2, save the current line instead.
+    period = np.full((nbr_rules, nbr_seeds), -1)
+    saved_lines = start_lines.copy()
+    saved_for = np.ones((nbr_rules, nbr_seeds), dtype=np.int64)
+    steps_since_saved = np.zeros((nbr_rules, nbr_seeds), dtype=np.int64)
+
+    lines = start_lines
+    for _ in range(nbr_steps):
+        (lines, triples) = next_lines(lines, tables, table_offsets)
+        density_sum += lines.mean(axis=(1, 2))
+        counts = np.stack([(triples == triple).sum(axis=2) for triple in range(8)], axis=2)
+        probabilities = counts / width
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropies = -np.nansum(probabilities * np.log2(probabilities), axis=2)
+        entropy_sum += entropies.mean(axis=1)
+
+        steps_since_saved += 1
+        repeated = (period < 0) & (lines == saved_lines).all(axis=2)
+        period[repeated] = steps_since_saved[repeated]
+        resave = (period < 0) & (steps_since_saved == saved_for)
+        saved_lines[resave] = lines[resave]
+        saved_for[resave] *= 2
+        steps_since_saved[resave] = 0
+
+    transient = find_transients(start_lines, period, tables, table_offsets, nbr_steps)
+    return {'rule_nbr': rule_nbrs, 'density': density_sum / nbr_steps, 'entropy': entropy_sum / nbr_steps,
+            'transient': transient, 'period': period}
+
+
+def find_transients(start_lines, period, tables, table_offsets, nbr_steps) -> np.ndarray:
+    """
+    The transient of each rule and seed whose period is known: run one copy of the lines from the start
+    and another period steps ahead. The transient is the number of steps until they are the same.
+    """
+    transient = np.full(period.shape, -1)
+    ahead = start_lines.copy()
+    for step in range(period.max(initial=0)):
+        advancing = step < period
+        ahead[advancing] = next_lines(ahead, tables, table_offsets)[0][advancing]
+    lines = start_lines
+    for step in range(nbr_steps + 1):
+        same = (transient < 0) & (period > 0) & (lines == ahead).all(axis=2)
+        transient[same] = step
+        if (transient[period > 0] >= 0).all():
+            break
+        lines = next_lines(lines, tables, table_offsets)[0]
+        ahead = next_lines(ahead, tables, table_offsets)[0]
+    return transient
+
+
+if __name__ == "__main__":
+    from os import cpu_count
+    from time import perf_counter
+
+    start = perf_counter()
+    stats = explore_rules(processes=cpu_count() or 1)
+    print(f'{len(stats["rule_nbr"])} rules in {perf_counter() - start:.1f} seconds.\n')
+    print('rule  density  entropy  transient  period   (medians of the seeds that repeat)')
+    for (rule_nbr, density, entropy, transients, periods) in zip(*stats.values()):
+        repeats = periods > 0
+        (transient, period) = (int(np.median(transients[repeats])), int(np.median(periods[repeats]))) \
+                              if repeats.any() else ('-', '-')
+        print(f'{rule_nbr:4}  {density:7.3f}  {entropy:7.3f}  {transient:>9}  {period:>6}')
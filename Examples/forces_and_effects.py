@@ -9,6 +9,7 @@ from pygame.colordict import THECOLORS
 from pygame.draw import circle
 
 from core.agent import Agent, PYGAME_COLORS
+from core.force_layout import Barnes_Hut_Layout
 import core.gui as gui
 from core.gui import BLOCK_SPACING, HOR_SEP, KNOWN_FIGURES, SCREEN_PIXEL_HEIGHT, SCREEN_PIXEL_WIDTH
 from core.link import Link, link_exists
@@ -47,11 +48,12 @@ class Force_Layout_Node(Agent):
         repulsive_force: Velocity = Velocity((0, 0))
 
         #for all other agents excluding this instance
-        for agent in (World.agents - {self}):
-            #add their respective influence of each other element towards this element, calculate using
-            #this center pixel, elements center pixel and using defined units (optional repulsove flag)
-            repulsive_force += self.force_as_dxdy(self.center_pixel, agent.center_pixel, screen_distance_unit,
-                                                    repulsive=True)
+        for agent in World.agents:
+            if agent is not self:
+                #add their respective influence of each other element towards this element, calculate using
+                #this center pixel, elements center pixel and using defined units (optional repulsove flag)
+                repulsive_force += self.force_as_dxdy(self.center_pixel, agent.center_pixel, screen_distance_unit,
+                                                      repulsive=True)
 
         # Also consider repulsive force from walls.
         repulsive_wall_force: Velocity = Velocity((0, 0))
@@ -68,8 +70,8 @@ class Force_Layout_Node(Agent):
 
         #calculate the attractive force generated by all the nodes connected by a link
         attractive_force: Velocity = Velocity((0, 0))
-        for agent in (World.agents - {self}):
-            if link_exists(self, agent):
+        for agent in World.agents:
+            if agent is not self and link_exists(self, agent):
                 attractive_force += self.force_as_dxdy(self.center_pixel, agent.center_pixel, screen_distance_unit,
                                                          repulsive=False)
 
@@ -135,7 +137,7 @@ class Force_Layout_Node(Agent):
         Ceate links from self to existing nodes.
         """
         # Put agents (nodes) in random order.
-        potential_partners = sample(agents, len(agents))
+        potential_partners = sample(list(agents), len(agents))
         # Build a generator that keeps with probability 0.25 potential partners without links to self
         gen = (agent for agent in potential_partners if uniform(0, 1) < 0.25 and not link_exists(self, agent))
         # Create a link with each of these partners.
@@ -147,6 +149,7 @@ class Force_Layout_World(World):
 
     def __init__(self, patch_class, agent_class):
         self.velocity_adjustment = 1
+        self.layout = Barnes_Hut_Layout()
         super().__init__(patch_class, agent_class)
         self.shortest_path_links = None
         self.selected_nodes = set()
@@ -155,7 +158,7 @@ class Force_Layout_World(World):
     @staticmethod
     def create_link():
         link_created = False
-        agent_set_1 = sample(World.agents, len(World.agents))
+        agent_set_1 = World.agents.sample(len(World.agents))
         while not link_created:
             # pop selects a random element from a set and removes and returns it.
             agent_1 = agent_set_1.pop()
@@ -210,7 +213,7 @@ class Force_Layout_World(World):
         if event == 'Create node':
             self.agent_class()
         elif event == 'Delete random node':
-            agent = sample(self.agents, 1)[0]
+            agent = self.agents.choice()
             agent.delete()
         elif event == 'Create random link':
             self.create_link()
@@ -281,8 +284,25 @@ class Force_Layout_World(World):
         return None
 
     def step(self):
-        for node in self.agents:
-            node.adjust_distances(self.velocity_adjustment)
+        if SimEngine.gui_get('Print force values'):
+            for node in self.agents:
+                node.adjust_distances(self.velocity_adjustment)
+            # The nodes moved without the layout engine.
+            self.layout.forget_graph()
+        else:
+            screen_distance_unit = sqrt(SCREEN_PIXEL_WIDTH()**2 + SCREEN_PIXEL_HEIGHT()**2) / \
+                                   SimEngine.gui_get('dist_unit')
+            self.layout.load(World.agents, World.links)
+            self.layout.set_params(theta=SimEngine.gui_get('theta'), screen_distance_unit=screen_distance_unit,
+                                   rep_coeff=SimEngine.gui_get('rep_coef'),
+                                   rep_exponent=SimEngine.gui_get('rep_exponent'),
+                                   att_coeff=SimEngine.gui_get('att_coef'),
+                                   att_exponent=SimEngine.gui_get('att_exponent'),
+                                   velocity_adjustment=self.velocity_adjustment,
+                                   bounce=bool(SimEngine.gui_get('Bounce?')))
+            # step() does nothing once the layout has settled.
+            if self.layout.step():
+                self.layout.update_nodes()
 
         # Set all the links back to normal.
         for lnk in World.links:
@@ -360,6 +380,14 @@ force_left_upper = [
                                resolution=1, pad=((0, 0), (0, 0)), size=(10, 20),
                                tooltip='The fraction of the screen diagonal used as one unit.')],
 
+                    [sg.Text('Barnes-Hut theta', pad=((0, 10), (20, 0)),
+                             tooltip='Groups of nodes whose size/distance is less than theta repel as one.\n'
+                                     '0 computes every pair exactly. Larger is faster and less exact.'),
+                     sg.Slider((0, 1.5), default_value=0.5, orientation='horizontal', key='theta',
+                               resolution=0.1, pad=((0, 0), (0, 0)), size=(10, 20),
+                               tooltip='Groups of nodes whose size/distance is less than theta repel as one.\n'
+                                       '0 computes every pair exactly. Larger is faster and less exact.')],
+
                     HOR_SEP(pad=((50, 0), (0, 0))),
 
                     [sg.Text('Click "Setup and then "Go" for force computation.', pad=((0, 0), (0, 0)))],
@@ -1,16 +1,24 @@
 
-from random import randint, sample
+from random import randint, randrange, sample
 from typing import List
 
+import numpy as np
 from pygame import Color
 
 from core.agent import Agent
+from core.array_ga import Array_Population
 from core.ga import Chromosome, GA_World, Gene, Individual, gui_left_upper
 from core.link import Link
 from core.sim_engine import SimEngine
 from core.world_patch_block import World
 
 
+# The values of the local_search combo.
+NO_LOCAL_SEARCH = 'none'
+AS_MUTATION = 'as a mutation'
+AS_POLISH = 'polish the best'
+
+
 class Loop_Agent(Agent):
 
     @property
@@ -31,9 +39,13 @@ class Loop_Link(Link):
 
 # noinspection PyTypeChecker
 class Loop_Individual(Individual):
+    """
+    A gene is the index of a Loop_Agent in GA_World.gene_agents. Distances between genes
+    are looked up in GA_World.distance_rows, which GA_World.setup computes once.
+    """
 
     def __str__(self):
-        return f'{self.fitness}: {[str(gene) for gene in self.chromosome]}'
+        return f'{self.fitness}: {[str(GA_World.gene_agents[gene]) for gene in self.chromosome]}'
 
     @staticmethod
     def add_gene_to_chromosome(orig_fitness: float, gene: Gene, chromosome: Chromosome) -> Chromosome:
@@ -47,49 +59,156 @@ class Loop_Individual(Individual):
                 (best_new_chrom, best_new_fitness, best_new_discr) = (new_chrom, new_fitness, new_discr)
         return (best_new_chrom, best_new_fitness, best_new_discr)
 
-    def compute_fitness(self) -> float:
-        return Loop_Individual.compute_chromosome_fitness(self.chromosome)
-
     @staticmethod
     def compute_chromosome_fitness(chromosome) -> float:
-        len_chrom = len(chromosome)
-        # Recall that a chromosome is a tuple of Genes, each of which is a Pixel_xy.
-        # We use mod (%) so that we include the distance from chromosome[len_chrom - 1] to chromosome[0]
-        distances = [chromosome[i].distance_to(chromosome[(i+1) % len_chrom]) for i in range(len_chrom)]
-        fitness = sum(distances)
+        distance_rows = GA_World.distance_rows
+        # Recall that a chromosome is a tuple of Genes, each of which is an index into distance_rows.
+        # Index -1 includes the distance from chromosome[len_chrom - 1] to chromosome[0].
+        fitness = sum(distance_rows[chromosome[i-1]][chromosome[i]] for i in range(len(chromosome)))
         return fitness
 
-    def mate_with(self, other):
-        return self.cx_all_diff(self, other)
+    def local_search(self, max_passes):
+        """
+        Reduce this loop's discrepancy with 2-opt and Or-opt moves. Each pass tries the moves at every
+        position. Stop after max_passes passes or after a pass that improves nothing.
+
+        A 2-opt move reverses a segment. An Or-opt move moves a segment of 1 to 3 genes elsewhere,
+        possibly reversed. Either way, the change in fitness depends only on the few edges cut and added,
+        so it takes constant time to compute. When the loop is too long, candidate moves connect a gene
+        to one of its nearest neighbors (see GA_World.neighbor_lists). When it's too short, to random genes.
+        """
+        loop = list(self.chromosome)
+        len_loop = len(loop)
+        if len_loop < 4:
+            return
+        fitness = self.fitness
+        for _ in range(max_passes):
+            improved = False
+            position = {gene: i for (i, gene) in enumerate(loop)}
+            start = randrange(len_loop)
+            for i in (start + k for k in range(len_loop)):
+                i %= len_loop
+                candidates = self.local_search_candidates(loop[i], fitness, loop, position)
+                move = self.two_opt_move(loop, position, fitness, i, candidates) or \
+                       self.or_opt_move(loop, position, fitness, i, candidates)
+                if move:
+                    (loop, fitness) = move
+                    position = {gene: i for (i, gene) in enumerate(loop)}
+                    improved = True
+            if not improved:
+                break
+        (self.chromosome, self.fitness) = (GA_World.seq_to_chromosome(loop), fitness)
+
+    @staticmethod
+    def local_search_candidates(gene, fitness, loop, position):
+        if fitness > GA_World.fitness_target:
+            candidates = [nbr for nbr in GA_World.neighbor_lists[gene] if nbr in position]
+            if candidates:
+                return candidates
+        return sample(loop, min(len(loop), len(GA_World.neighbor_lists[gene])))
+
+    @staticmethod
+    def improves(fitness, delta) -> bool:
+        target = GA_World.fitness_target
+        return abs(fitness + delta - target) < abs(fitness - target) - 1e-9
 
     def mutate(self) -> Individual:
         if randint(0, 100) <= SimEngine.gui_get('replace_gene'):
             (self.chromosome, self.fitness, _) = self.replace_gene_in_chromosome(self.fitness, self.chromosome)
 
         if randint(0, 100) <= SimEngine.gui_get('reverse_subseq'):
-            self.chromosome = self.reverse_subseq(self.chromosome)
-            self.fitness = self.compute_fitness()
+            # Reversing chromosome[indx_1:indx_2] changes only the edges at its two ends.
+            len_chrom = len(self.chromosome)
+            (indx_1, indx_2) = sorted(sample(range(len_chrom), 2))
+            (a, b, c, d) = [self.chromosome[i % len_chrom] for i in (indx_1 - 1, indx_1, indx_2 - 1, indx_2)]
+            distance_rows = GA_World.distance_rows
+            delta = distance_rows[a][c] + distance_rows[b][d] - distance_rows[a][b] - distance_rows[c][d]
+            fitness = self.fitness
+            chromosome = list(self.chromosome)
+            chromosome[indx_1:indx_2] = reversed(chromosome[indx_1:indx_2])
+            (self.chromosome, self.fitness) = (GA_World.seq_to_chromosome(chromosome), fitness + delta)
+
+        if SimEngine.gui_get('local_search') == AS_MUTATION:
+            self.local_search(max_passes=1)
 
         return self
 
+    @staticmethod
+    def or_opt_move(loop, position, fitness, i, candidates):
+        """
+        Try moving the segment of 1, 2, or 3 genes starting at loop[i] to follow one of the candidates,
+        in either orientation. Returns the first (new_loop, new_fitness) that improves the discrepancy, if any.
+        """
+        distance_rows = GA_World.distance_rows
+        len_loop = len(loop)
+        for seg_len in (1, 2, 3):
+            if i + seg_len > len_loop or seg_len > len_loop - 3:
+                break
+            (first, last) = (loop[i], loop[i + seg_len - 1])
+            (before, after) = (loop[i-1], loop[(i + seg_len) % len_loop])
+            removal_delta = distance_rows[before][after] - distance_rows[before][first] - distance_rows[last][after]
+            for x in candidates:
+                x_pos = position[x]
+                # x may not be in the segment or immediately before it.
+                if i - 1 <= x_pos < i + seg_len or x_pos == len_loop - 1 and i == 0:
+                    continue
+                y = loop[(x_pos + 1) % len_loop]
+                for (start, end) in ((first, last), (last, first)):
+                    delta = removal_delta + distance_rows[x][start] + distance_rows[end][y] - distance_rows[x][y]
+                    if Loop_Individual.improves(fitness, delta):
+                        segment = loop[i:i + seg_len] if start == first else loop[i:i + seg_len][::-1]
+                        rest = loop[:i] + loop[i + seg_len:]
+                        k = rest.index(x) + 1
+                        return (rest[:k] + segment + rest[k:], fitness + delta)
+        return None
+
+    @staticmethod
+    def two_opt_move(loop, position, fitness, i, candidates):
+        """
+        Try cutting the edges (a, b) = (loop[i], loop[i+1]) and (c, d), where c is a candidate and d follows it,
+        and reconnecting as (a, c) and (b, d), i.e., reversing the segment from b to c.
+        Returns the first (new_loop, new_fitness) that improves the discrepancy, if any.
+        """
+        distance_rows = GA_World.distance_rows
+        len_loop = len(loop)
+        (a, b) = (loop[i], loop[(i + 1) % len_loop])
+        for c in candidates:
+            j = position[c]
+            d = loop[(j + 1) % len_loop]
+            if c in (a, b) or d == a:
+                continue
+            delta = distance_rows[a][c] + distance_rows[b][d] - distance_rows[a][b] - distance_rows[c][d]
+            if Loop_Individual.improves(fitness, delta):
+                new_loop = list(loop)
+                # Reversing the complementary segment produces the same loop, traversed the other way.
+                (low, high) = (i + 1, j + 1) if i < j else (j + 1, i + 1)
+                new_loop[low:high] = reversed(new_loop[low:high])
+                return (new_loop, fitness + delta)
+        return None
+
     @staticmethod
     def replace_gene_in_chromosome(original_fitness: float, chromosome: Chromosome) -> Chromosome:
         (best_new_chrom, best_new_fitness, best_new_discr) = (None, None, None)
+        distance_rows = GA_World.distance_rows
         len_chrom = len(chromosome)
-        for i in sample(range(len_chrom), min(3, len_chrom)):
+        positions = sample(range(len_chrom), min(3, len_chrom))
+        # Sample the genes to try at all the positions at once. If there aren't enough for each position
+        # to have its own, each tries a sample of those there are.
+        nbr_to_try = 5 if len_chrom == 2 else 4
+        unused_genes = GA_World.sample_unused_genes(chromosome, nbr_to_try * len(positions))
+        have_enough = len(unused_genes) == nbr_to_try * len(positions)
+        for (n, i) in enumerate(positions):
             gene_before = chromosome[i-1]
             removed_gene = chromosome[i]
             # i_p_1 is: (i+1) mod len_chrom
             i_p_1 = (i+1) % len_chrom
             gene_after = chromosome[i_p_1]
-            fitness_after_removal = original_fitness - gene_before.distance_to(removed_gene) \
-                                                     - removed_gene.distance_to(gene_after)  \
-                                                     + gene_before.distance_to(gene_after)
-            # Make the removed gene not available because we will add it in explicitly 3 lines down.
-            available_genes = GA_World.agents - set(chromosome)
-            sample_size = min(5 if len_chrom == 2 else 4, len(available_genes))
-            # Include the removed gene as one of the ones to try.
-            sampled_available_genes = sample(available_genes, sample_size) + [chromosome[i]]
+            fitness_after_removal = original_fitness - distance_rows[gene_before][removed_gene] \
+                                                     - distance_rows[removed_gene][gene_after]  \
+                                                     + distance_rows[gene_before][gene_after]
+            # The removed gene isn't among the unused genes. Include it as one of the ones to try.
+            sampled_available_genes = (unused_genes[n*nbr_to_try:(n+1)*nbr_to_try] if have_enough else
+                                       sample(unused_genes, min(nbr_to_try, len(unused_genes)))) + [removed_gene]
             # Don't want i_p_1 here since if i is the the last position, i_p_1 is 0,
             # and we would then be adding the entire chromosome back in a second time.
             remaining_genes = chromosome[:i] + chromosome[i+1:]
@@ -113,10 +232,11 @@ class Loop_Individual(Individual):
         # these two positions will be chromosome[0]. In that case also,
         # current_fitness will be 0.
         gene_at_pos_plus_1 = chromosome[(pos+1) % len(chromosome)]
-        new_fitness = current_fitness - gene_at_pos.distance_to(gene_at_pos_plus_1) \
-                                      + gene_at_pos.distance_to(new_gene) \
-                                      + new_gene.distance_to(gene_at_pos_plus_1)
-        new_chrom = chromosome[:pos] + (new_gene, ) + chromosome[pos:]
+        distance_rows = GA_World.distance_rows
+        new_fitness = current_fitness - distance_rows[gene_at_pos][gene_at_pos_plus_1] \
+                                      + distance_rows[gene_at_pos][new_gene] \
+                                      + distance_rows[new_gene][gene_at_pos_plus_1]
+        new_chrom = chromosome[:pos+1] + (new_gene, ) + chromosome[pos+1:]
         new_discr = abs(GA_World.fitness_target - new_fitness)
         return (new_chrom, new_fitness, new_discr)
 
@@ -127,15 +247,32 @@ class Loop_World(GA_World):
         super().__init__(*arga, **kwargs)
         self.cycle_length = SimEngine.gui_get('cycle_length')
 
+    @staticmethod
+    def array_fitness(chromosomes: np.ndarray) -> np.ndarray:
+        """ The vectorized version of Loop_Individual.compute_chromosome_fitness. """
+        next_genes = np.roll(chromosomes, -1, axis=1)
+        return GA_World.distances[chromosomes, next_genes].sum(axis=1, dtype=float)
 
     def gen_individual(self):
-        chromosome_list: List = sample(World.agents, self.cycle_length)
+        chromosome_list: List = sample(range(len(GA_World.gene_agents)), self.cycle_length)
         individual = GA_World.individual_class(GA_World.seq_to_chromosome(chromosome_list))
         return individual
 
+    @staticmethod
+    def gui_cycle_length():
+        """
+        The cycle length in the GUI, but no more than the number of genes, since a cycle doesn't repeat them.
+        If the slider is beyond that, move it back.
+        """
+        cycle_length = int(SimEngine.gui_get('cycle_length'))
+        if GA_World.gene_agents and cycle_length > len(GA_World.gene_agents):
+            cycle_length = len(GA_World.gene_agents)
+            SimEngine.gui_set('cycle_length', value=cycle_length)
+        return cycle_length
+
     def handle_event(self, event):
         if event == 'cycle_length':
-            new_cycle_length = SimEngine.gui_get('cycle_length')
+            new_cycle_length = self.gui_cycle_length()
             if new_cycle_length != self.cycle_length:
                 World.links = set()
                 self.cycle_length = new_cycle_length
@@ -145,15 +282,29 @@ class Loop_World(GA_World):
         super().handle_event(event)
 
     def initial_individuals(self) -> List[Loop_Individual]:
-        self.cycle_length = SimEngine.gui_get('cycle_length')
+        self.cycle_length = self.gui_cycle_length()
         individuals = [self.gen_individual() for _ in range(self.pop_size)]
         Individual.count = self.pop_size
         return individuals
 
+    def initial_population(self) -> Array_Population:
+        self.cycle_length = self.gui_cycle_length()
+        nbr_genes = len(GA_World.gene_agents)
+        chromosomes = Array_Population.random_chromosomes(self.pop_size, self.cycle_length, nbr_genes)
+        return Array_Population(chromosomes, nbr_genes, self.array_fitness, GA_World.fitness_target)
+
     @staticmethod
     def link_best_chromosome(best_chromosome):
-        for i in range(len(best_chromosome)):
-            Loop_Link(best_chromosome[i], best_chromosome[(i+1) % len(best_chromosome)])
+        agents = [GA_World.gene_agents[gene] for gene in best_chromosome]
+        for i in range(len(agents)):
+            Loop_Link(agents[i], agents[(i+1) % len(agents)])
+
+    def polish(self):
+        # Only the list of individuals can be improved in place.
+        if SimEngine.gui_get('local_search') == AS_POLISH and self.individuals is not None:
+            best_index = self.individuals.best_index()
+            self.individuals[best_index].local_search(max_passes=20)
+            self.individuals.update(best_index)
 
     def set_results(self):
         super().set_results()
@@ -165,21 +316,25 @@ class Loop_World(GA_World):
         nbr_points = SimEngine.gui_get('nbr_points')
         self.create_random_agents(nbr_points, color=Color('white'), shape_name='node')
 
-        self.mating_op = Individual.cx_all_diff
+        GA_World.mating_op = Individual.cx_all_diff
         super().setup()
 
     def update_cycle_lengths(self, cycle_length):
+        if self.population is not None or self.islands is not None:
+            # Start the array representation over with chromosomes of the new length.
+            self.set_up_arrays()
+            return
         for ind in self.individuals:
             chromosome = ind.chromosome
             if cycle_length < len(chromosome):
                 ind.chromosome = chromosome[:cycle_length]
                 ind.fitness = ind.compute_fitness()
             else:
-                available_genes = GA_World.agents - set(ind.chromosome)
-                new_genes = sample(available_genes, cycle_length - len(ind.chromosome))
+                new_genes = GA_World.sample_unused_genes(ind.chromosome, cycle_length - len(ind.chromosome))
                 for gene in new_genes:
                     (ind.chromosome, ind.fitness, _) = \
                         Loop_Individual.add_gene_to_chromosome(ind.fitness, gene, ind.chromosome)
+        self.individuals.rerank()
 
 
 # ############################################## Define GUI ############################################## #
@@ -196,16 +351,63 @@ loop_gui_left_upper = gui_left_upper + [
                        ],
 
                       [sg.Text('Cycle length', pad=(None, (20, 0))),
-                       sg.Slider(key='cycle_length', range=(2, 20), default_value=10, pad=((10, 0), (0, 0)),
+                       sg.Slider(key='cycle_length', range=(2, 200), default_value=10, pad=((10, 0), (0, 0)),
                                  orientation='horizontal', size=(10, 20), enable_events=True)
                        ],
 
+                      [sg.Text('Local search', pad=(None, (20, 0)),
+                               tooltip='2-opt and Or-opt moves applied to every child or to the best individual'),
+                       sg.Combo(key='local_search', values=[NO_LOCAL_SEARCH, AS_MUTATION, AS_POLISH],
+                                default_value=NO_LOCAL_SEARCH, pad=((10, 0), (20, 0)))
+                       ],
+
                       [sg.Checkbox('Show pixel positions', key='show_positions', default=False, pad=((0, 0), (10, 0)))]
 
     ]
 
 
 if __name__ == "__main__":
-    from core.agent import PyLogo
-    # gui_left_upper is from core.ga
-    PyLogo(Loop_World, 'Loops', loop_gui_left_upper, agent_class=Loop_Agent)
+    import sys
+
+    if sys.argv[1:] != ['timing']:
+        from core.agent import PyLogo
+        # gui_left_upper is from core.ga
+        PyLogo(Loop_World, 'Loops', loop_gui_left_upper, agent_class=Loop_Agent)
+        sys.exit()
+
+    # python -m Examples.ga_closed_paths timing, from the PyLogo directory, times the replace-gene mutation
+    # without the GUI. Before is how it sampled unused genes before: by building the set of unused genes
+    # separately for each of the (3) positions it tries.
+    from timeit import repeat
+
+    from core.ga import install_gene_distances
+
+    nbr_points = 200
+    GA_World.gene_pool = frozenset(range(nbr_points))
+    install_gene_distances(np.random.default_rng(0).random((nbr_points, nbr_points), dtype=np.float32) * 100)
+    GA_World.fitness_target = 0
+    sample_unused_genes = GA_World.sample_unused_genes
+
+    def set_difference_sample(chromosome, k):
+        available_genes = list(set(range(nbr_points)) - set(chromosome))
+        return sample(available_genes, min(k, len(available_genes)))
+
+    def sample_per_position(chromosome, k):
+        return [gene for _ in range(3) for gene in set_difference_sample(chromosome, k // 3)]
+
+    def microseconds(function, number=1000):
+        return round(1_000_000 * min(repeat(function, number=number, repeat=5)) / number, 1)
+
+    print(f'{nbr_points} points. Microseconds per replace-gene mutation, before -> now')
+    print('              sampling           whole mutation')
+    for len_chrom in (20, 100, 190, 196):
+        chromosome = tuple(sample(range(nbr_points), len_chrom))
+        fitness = Loop_Individual.compute_chromosome_fitness(chromosome)
+        sampling = [microseconds(lambda: sampler(chromosome, 12))
+                    for sampler in (sample_per_position, sample_unused_genes)]
+        mutation = []
+        for sampler in (sample_per_position, sample_unused_genes):
+            GA_World.sample_unused_genes = sampler
+            mutation.append(microseconds(lambda: Loop_Individual.replace_gene_in_chromosome(fitness, chromosome)))
+        GA_World.sample_unused_genes = sample_unused_genes
+        print(f'{len_chrom:4} genes: {sampling[0]:6} -> {sampling[1]:6}   {mutation[0]:6} -> {mutation[1]:6}')
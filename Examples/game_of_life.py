@@ -1,9 +1,28 @@
 
 from random import randint
 
+import numpy as np
+
+import core.gui as gui
 from core.gui import HOR_SEP
+from core.hashlife import Hash_Life
+from core.life_engine import Life_Like, Life_Like_Rule, Packed_Life
 from core.on_off import OnOffPatch, OnOffWorld, on_off_left_upper
 from core.sim_engine import SimEngine
+from core.world_patch_block import World
+
+# The values of the engine combo.
+PATCHES = 'patches'
+SPARSE = 'sparse patches'
+BIT_PACKED = 'bit-packed'
+HASHLIFE = 'hashlife'
+RULE = 'rule'
+
+# The rule of the rule engine if the one in the GUI isn't valid.
+LIFE = 'B3/S23'
+
+# The sparse engine steps all the patches when more than this fraction of them might change.
+SPARSE_FRACTION = 0.25
 
 
 class Life_Patch(OnOffPatch):
@@ -17,12 +36,82 @@ class Life_Patch(OnOffPatch):
 
     def count_live_neighbors(self):
         self.live_neighbors = sum([1 for p in self.neighbors_8() if p.is_alive()])
-        
+
     def set_alive_or_dead(self, alive_or_dead: bool):
         self.set_on_off(alive_or_dead)
 
 
 class Life_World(OnOffWorld):
+    """
+    With the patches engine, each Life_Patch counts its live neighbors. The sparse patches engine
+    does that only for the patches that changed in the previous step and their neighbors, since no
+    others can change. With the bit-packed engine, the board is a Packed_Life, which is drawn
+    directly (see gui.draw_patch_states). The patches are then not kept up to date. They are
+    updated when the engine is switched back to patches.
+
+    With the hashlife engine, the patches are a window onto the center of an unbounded universe,
+    a Hash_Life. Each step advances it by 2**log2_generations generations.
+
+    The rule engine runs any Life-like rule in B/S notation, e.g., B36/S23 or the Generations rule B2/S/C3,
+    with a Life_Like board. The rule may be changed while it runs. Dying cells are drawn in colors that
+    fade from the on color to the off color. When the engine is switched back to patches, they are dead.
+
+    Only the patches that change are set, so only they are redrawn. See OnOffWorld.draw_changes.
+    """
+
+    def __init__(self, *args, **kw_args):
+        super().__init__(*args, **kw_args)
+        self.engine = None
+        # The patches that changed in the last step. None if unknown, e.g., after setup.
+        self.active_patches = None
+
+    def draw(self):
+        if self.engine is None:
+            super().draw()
+        else:
+            nbr_states = self.engine.rule.nbr_states if isinstance(self.engine, Life_Like) else 2
+            gui.draw_patch_states(self.engine.cells, self.palette(nbr_states))
+
+    def draw_changes(self):
+        return super().draw_changes() if self.engine is None else None
+
+    def gui_rule(self) -> Life_Like_Rule:
+        """ The rule in the GUI. If it isn't a valid rule, e.g., while it's being typed, the current rule. """
+        try:
+            return Life_Like_Rule(SimEngine.gui_get('rule'))
+        except ValueError:
+            return self.engine.rule if isinstance(self.engine, Life_Like) else Life_Like_Rule(LIFE)
+
+    def handle_event(self, event):
+        if event == 'engine':
+            self.set_engine()
+            return
+        super().handle_event(event)
+
+    def mouse_click(self, xy):
+        if self.engine is None:
+            super().mouse_click(xy)
+            if self.active_patches is not None:
+                self.active_patches.append(self.pixel_tuple_to_patch(xy))
+        else:
+            patch = self.pixel_tuple_to_patch(xy)
+            self.engine.toggle(patch.row, patch.col)
+
+    def set_engine(self):
+        """ Switch to the engine selected in the GUI, carrying over the current cells. """
+        if self.engine is None:
+            cells = np.array([patch.is_alive() for patch in World.patches]).reshape(World.patches_array.shape)
+        else:
+            # Only state 1 is alive. Dying cells, e.g., of a Generations rule, are dead in the other engines.
+            cells = self.engine.cells == 1
+            for (patch, is_alive) in zip(World.patches, cells.flat):
+                patch.set_alive_or_dead(is_alive)
+        engine = SimEngine.gui_get('engine')
+        self.engine = Packed_Life(cells) if engine == BIT_PACKED else \
+                      Hash_Life(cells) if engine == HASHLIFE else \
+                      Life_Like(cells, self.gui_rule()) if engine == RULE else \
+                      None
+        self.active_patches = None
 
     def setup(self):
         super().setup()
@@ -30,16 +119,38 @@ class Life_World(OnOffWorld):
         for patch in self.patches:
             is_alive = randint(0, 100) < density
             patch.set_alive_or_dead(is_alive)
+        self.engine = None
+        self.set_engine()
 
     def step(self):
+        if isinstance(self.engine, Hash_Life):
+            self.engine.step(2**SimEngine.gui_get('log2_generations'))
+            return
+        if isinstance(self.engine, Life_Like):
+            self.engine.set_rule(self.gui_rule())
+        if self.engine is not None:
+            self.engine.step()
+            return
+
+        patches = self.patches
+        if SimEngine.gui_get('engine') == SPARSE and self.active_patches is not None:
+            candidates = set(self.active_patches)
+            for patch in self.active_patches:
+                candidates.update(patch.neighbors_8())
+            if len(candidates) <= SPARSE_FRACTION * len(self.patches):
+                patches = candidates
+
         # Count the live neighbors in the current state.
-        for patch in self.patches:
+        for patch in patches:
             patch.count_live_neighbors()
 
-        # Determine and set whether each patch is_alive in the next state.
-        for patch in self.patches:
+        # Determine whether each patch is_alive in the next state. Set those that change.
+        self.active_patches = []
+        for patch in patches:
             is_alive = patch.live_neighbors == 3 or patch.is_alive() and patch.live_neighbors == 2
-            patch.set_alive_or_dead(is_alive)
+            if is_alive != patch.is_alive():
+                patch.set_alive_or_dead(is_alive)
+                self.active_patches.append(patch)
 
 
 # ############################################## Define GUI ############################################## #
@@ -49,6 +160,20 @@ gol_left_upper = [[sg.Text('Initial density'),
                    sg.Slider(key='density', range=(0, 80), resolution=5, size=(10, 20),
                              default_value=35, orientation='horizontal', pad=((0, 0), (0, 20)),
                              tooltip='The ratio of alive cells to all cells')],
+                  [sg.Text('Engine'),
+                   sg.Combo(values=[PATCHES, SPARSE, BIT_PACKED, HASHLIFE, RULE], key='engine',
+                            default_value=PATCHES, enable_events=True,
+                            tooltip='Step all the patches, only those near the last changes, '
+                                    'the whole board as a bit-packed array, an unbounded universe, '
+                                    'or the whole board with the rule below')],
+                  [sg.Text('Rule'),
+                   sg.Input(LIFE, key='rule', size=(12, 1),
+                            tooltip='A Life-like rule for the rule engine, e.g., B3/S23 (Life), B36/S23 (HighLife), '
+                                    'B2/S (Seeds), or B2/S/C3 (Brian\'s Brain, with 3 states)')],
+                  [sg.Text('Hashlife generations\nper step: 2 **'),
+                   sg.Slider(key='log2_generations', range=(0, 30), resolution=1, size=(10, 20),
+                             default_value=0, orientation='horizontal', pad=((0, 0), (0, 20)),
+                             tooltip='Each step of the hashlife engine advances this power of 2 generations')],
                   HOR_SEP(pad=((0, 0), (0, 0))),
                   [sg.Text('Cells can be toggled when\nthe system is stopped.')],
                   HOR_SEP(pad=((0, 0), (0, 0))),
@@ -1,73 +1,91 @@
 
 from random import choice, randint, sample
 
+import numpy as np
 from pygame import Color
 
 from core.agent import Agent, PYGAME_COLORS
+from core.indexed_set import Indexed_Set
 from core.sim_engine import SimEngine
 from core.world_patch_block import Patch, World
 
+rng = np.random.default_rng()
+
+# The number of empty patches an unhappy agent considers moving to.
+NBR_SPOTS_TO_SAMPLE = 25
+
+
+class SegregationPatch(Patch):
+
+    def __init__(self, *args, **kw_args):
+        super().__init__(*args, **kw_args)
+        # The number of agents of each color among this patch's 8 neighbors, indexed by color_index.
+        # SegregationWorld.move_agent keeps them up to date.
+        self.neighbor_counts = [0, 0]
+
 
 class SegregationAgent(Agent):
 
     pct_similar_wanted = None
 
-    def __init__(self, color=None):
+    def __init__(self, color=None, color_index=0):
         super().__init__(color=color)
+        # 0 or 1: which of the two colors this agent is.
+        self.color_index = color_index
         self.is_happy = None
         self.pct_similar = None
         # self.pct_similar_wanted = None
 
-    def find_new_spot(self, empty_patches):
+    def find_new_spot(self, empty_patches: Indexed_Set, current_patch):
         """
-        If this agent is happy, do nothing.
-        If it's unhappy move it to an empty patch where it is happy if one can be found.
-        Otherwise, move it to any empty patch.
+        Return an empty patch for this agent, which is on current_patch, to move to:
+        one where it is happy if one can be found. Otherwise, any empty patch.
 
         Keep track of the empty patches instead of wandering around looking for one.
         The original NetLogo code doesn't check to see if the agent would be happy in its new spot.
         (Doing so doesn't guarantee that the formerly happy neighbors in the new spot remain happy!)
         """
-        # Keep track of the current patch. Will add to empty patches after this Agent moves.
-        current_patch = self.current_patch()
         # Find one of the best available patches. The sample size of 25 is arbitrary.
         # It seems like a reasonable compromize between speed and number of steps.
-        nbr_of_patches_to_sample = min(25, len(empty_patches))
-        best_patch = max(sample(empty_patches, nbr_of_patches_to_sample),
-                         key=lambda patch: self.pct_similarity_satisfied_here(patch))
-        empty_patches.remove(best_patch)
-        empty_patches.add(current_patch)
-        self.move_to_patch(best_patch)
-
-    def pct_similar_here(self, patch) -> int:
+        nbr_of_patches_to_sample = min(NBR_SPOTS_TO_SAMPLE, len(empty_patches))
+        best_patch = max(empty_patches.sample(nbr_of_patches_to_sample),
+                         key=lambda patch: self.pct_similarity_satisfied_here(patch, current_patch))
+        return best_patch
+
+    def pct_similar_here(self, patch, current_patch) -> int:
         """
-        Returns an integer between 0 and 100 for the percent similar to neighbors.
-        Returns 100 if no neighbors,
+        Returns an integer between 0 and 100 for the percent similar to neighbors were this agent,
+        now on current_patch, on patch. Returns 100 if no neighbors.
+        Reads the neighbor counts of patch rather than moving there. Since this agent would
+        have left current_patch, it isn't counted if current_patch is a neighbor of patch.
         """
-        self.move_to_patch(patch)
-        agents_nearby_list = [agent for patch in self.current_patch().neighbors_8() for agent in patch.agents]
-        total_nearby_count = len(agents_nearby_list)
-        similar_nearby_count = len([agent for agent in agents_nearby_list if agent.color == self.color])
+        total_nearby_count = sum(patch.neighbor_counts)
+        similar_nearby_count = patch.neighbor_counts[self.color_index]
+        if patch is not current_patch and current_patch in patch.neighbors_8():
+            total_nearby_count -= 1
+            similar_nearby_count -= 1
         # Isolated agents, i.e., with no neighbors, are considered
         # to have 100% similar neighbors, and are counted as happy.
         similar_here_pct = 100 if total_nearby_count == 0 else round(100 * similar_nearby_count / total_nearby_count)
         return similar_here_pct
 
-    def pct_similarity_satisfied_here(self, patch) -> float:
+    def pct_similarity_satisfied_here(self, patch, current_patch) -> float:
         """
         Returns the degree to which the similarity here satisfies pct_similar_wanted.
         Returns a value between 0 and 1. (Never more than 1.)
         Doesn't favor patches with more similar neighbors over patches with just a
         sufficient number of similar neighbors.
         """
-        return min(1.0, self.pct_similar_here(patch)/SegregationAgent.pct_similar_wanted)
-
+        # With pct_similar_wanted 0, every patch satisfies it.
+        if not SegregationAgent.pct_similar_wanted:
+            return 1.0
+        return min(1.0, self.pct_similar_here(patch, current_patch)/SegregationAgent.pct_similar_wanted)
 
-    def update(self):
+    def update(self, current_patch):
         """
-        Determine pct_similar and whether this agent is happy.
+        Determine pct_similar and whether this agent, on current_patch, is happy.
         """
-        self.pct_similar = self.pct_similar_here(self.current_patch())
+        self.pct_similar = self.pct_similar_here(current_patch, current_patch)
         self.is_happy = self.pct_similar >= SegregationAgent.pct_similar_wanted
 
 
@@ -75,19 +93,80 @@ class SegregationWorld(World):
     """
       percent-similar: on the average, what percent of a agent's neighbors are the same color as that agent?
       percent-unhappy: what percent of the agents are unhappy?
+
+    Each SegregationPatch counts the agents of each color around it. When an agent moves, only the
+    counts of the neighbors of the patches it leaves and enters change. So only the agents on those
+    patches, and the agent itself, may become happy or unhappy. See move_agent.
+
+    With 'batch moves', the unhappy agents instead choose their new spots all at once, from arrays.
+    See batch_step.
     """
-    def __init__(self, patch_class=Patch, agent_class=SegregationAgent):
+    def __init__(self, patch_class=SegregationPatch, agent_class=SegregationAgent):
         super().__init__(patch_class=patch_class, agent_class=agent_class)
 
         self.empty_patches = None
         self.percent_similar = None
         self.percent_unhappy = None
+        # The sum of the agents' pct_similar, kept up to date by update_agent.
+        self.total_pct_similar = None
         self.unhappy_agents = None
-        # This is an experimental number.
+        # This is an experimental number. With batch moves, it's the number of agents that choose at once.
         self.max_agents_per_step = None
+        # The color_index of the agent on each patch, or -1 if the patch is empty. A (rows, cols) array.
+        self.colors: np.ndarray = None
         self.patch_color = Color('white')
         self.color_items = None
 
+    def batch_step(self):
+        """
+        Move up to max_agents_per_step unhappy agents at once. The agents are taken in a random order,
+        which is their priority. Each samples NBR_SPOTS_TO_SAMPLE empty patches and picks the one that
+        best satisfies it, as find_new_spot does, but from neighbor counts computed for the whole grid
+        with arrays. All the agents choose before any moves. If several choose the same patch, the one
+        with the highest priority gets it. The others choose again from the rest of their sample.
+        Those with none left stay, still unhappy, and try again next step.
+        """
+        colors = self.colors.ravel()
+        is_color = [(self.colors == color_index).astype(np.int16) for color_index in (0, 1)]
+        counts = np.stack([self.neighbors_8_sum(color_array) for color_array in is_color]).reshape(2, -1)
+        totals = counts.sum(axis=0)
+
+        occupied = np.flatnonzero(colors >= 0)
+        pct_similar = self.pct_similar(counts[colors[occupied], occupied], totals[occupied])
+        unhappy = occupied[pct_similar < SegregationAgent.pct_similar_wanted]
+        empties = np.flatnonzero(colors < 0)
+        if len(unhappy) == 0 or len(empties) == 0:
+            return
+
+        movers = rng.permutation(unhappy)[:self.sample_size(len(unhappy))]
+        spots = empties[rng.integers(len(empties), size=(len(movers), min(NBR_SPOTS_TO_SAMPLE, len(empties))))]
+        similar = counts[colors[movers].reshape(-1, 1), spots]
+        total = totals[spots]
+        # A mover next to a spot would no longer be its neighbor there. See SegregationAgent.pct_similar_here.
+        (rows, cols) = self.colors.shape
+        (row_offsets, col_offsets) = ((spots // cols - movers.reshape(-1, 1) // cols) % rows,
+                                      (spots % cols - movers.reshape(-1, 1) % cols) % cols)
+        adjacent = np.isin(row_offsets, (0, 1, rows - 1)) & np.isin(col_offsets, (0, 1, cols - 1))
+        wanted = SegregationAgent.pct_similar_wanted
+        satisfaction = np.minimum(1.0, self.pct_similar(similar - adjacent, total - adjacent) / wanted) if wanted \
+                       else np.ones(spots.shape)
+        # Each round, the movers without a spot, in priority order, choose from the spots not yet taken.
+        (moves, choosing) = ([], np.arange(len(movers)))
+        while len(choosing) > 0:
+            best = satisfaction[choosing].argmax(axis=1)
+            has_spot = satisfaction[choosing, best] >= 0
+            (choosing, best) = (choosing[has_spot], best[has_spot])
+            # np.unique returns the index of the first, i.e., highest priority, mover for each chosen spot.
+            (destinations, winners) = np.unique(spots[choosing, best], return_index=True)
+            moves.extend(zip(movers[choosing[winners]], destinations))
+            satisfaction[np.isin(spots, destinations)] = -1
+            choosing = np.delete(choosing, winners)
+
+        patches = World.patches_array.ravel()
+        for (source, destination) in moves:
+            (agent, ) = patches[source].agents
+            self.move_agent(agent, patches[destination])
+
     def colors_string(self):
         return f'{self.parse_color(self.color_items[0])} and {self.parse_color(self.color_items[1])}.'
 
@@ -101,15 +180,55 @@ class SegregationWorld(World):
             current_patch.draw()
             current_patch.set_color(self.patch_color)
 
+    @staticmethod
+    def count_agent(agent, patch, change):
+        """ Add change, 1 or -1, to the counts of agent's color around patch. """
+        for neighbor in patch.neighbors_8():
+            neighbor.neighbor_counts[agent.color_index] += change
+
     def final_thoughts(self):
         print(f'\n\t Again, the colors: {self.colors_string()}')
         super().final_thoughts()
 
+    def move_agent(self, agent, patch):
+        """ Move agent to the empty patch and update the counts and agents around its old and new patches. """
+        current_patch = agent.current_patch()
+        self.count_agent(agent, current_patch, -1)
+        agent.move_to_patch(patch)
+        self.count_agent(agent, patch, 1)
+        self.colors[current_patch.row, current_patch.col] = -1
+        self.colors[patch.row, patch.col] = agent.color_index
+        self.empty_patches.remove(patch)
+        self.empty_patches.add(current_patch)
+        self.update_agent(agent, patch)
+        for neighbor in current_patch.neighbors_8() + patch.neighbors_8():
+            for neighbor_agent in neighbor.agents:
+                self.update_agent(neighbor_agent, neighbor)
+
+    @staticmethod
+    def neighbors_8_sum(array) -> np.ndarray:
+        """ The sum of the values of each patch's 8 neighbors, wrapping around, as Patch.neighbors_8 does. """
+        columns = array + np.roll(array, 1, axis=0) + np.roll(array, -1, axis=0)
+        return columns + np.roll(columns, 1, axis=1) + np.roll(columns, -1, axis=1) - array
+
     @staticmethod
     def parse_color(color):
         (color_name, (r, g, b)) = color
         return f'"{color_name}"-(red: {r}, green: {g}, blue: {b})'
 
+    @staticmethod
+    def pct_similar(similar, total) -> np.ndarray:
+        """ SegregationAgent.pct_similar_here for arrays of similar and total neighbor counts. """
+        return np.where(total == 0, 100, np.round(100 * similar / np.maximum(total, 1)))
+
+    def sample_size(self, nbr_unhappy_agents):
+        """
+        The number of unhappy agents to move. If there is a small number of them, move them carefully.
+        Otherwise move the smaller of self.max_agents_per_step and nbr_unhappy_agents.
+        """
+        return max(1, round(nbr_unhappy_agents/2)) if nbr_unhappy_agents <= 4 else \
+               min(self.max_agents_per_step, nbr_unhappy_agents)
+
     @staticmethod
     def select_the_colors():
         """
@@ -141,45 +260,66 @@ class SegregationWorld(World):
         self.color_items = self.select_the_colors()
         (color_a, color_b) = [color_item[1] for color_item in self.color_items]
         print(f'\n\t The colors: {self.colors_string()}')
-        self.empty_patches = set()
-        self.max_agents_per_step = SimEngine.gui_get('max_agent_per_step')
+        self.empty_patches = Indexed_Set()
+        self.max_agents_per_step = int(SimEngine.gui_get('max_agent_per_step'))
+        self.colors = np.full(World.patches_array.shape, -1, dtype=np.int8)
         # print('About to create agents')
         for patch in self.patches:
             patch.set_color(self.patch_color)
             patch.neighbors_8()  # Calling neighbors_8 stores it as a cached value
+            patch.neighbor_counts = [0, 0]
 
+        for patch in self.patches:
             # Create the Agents. The density is approximate.
             if randint(0, 100) <= density:
-                agent = SegregationAgent(color=choice([color_a, color_b]))
+                color_index = choice([0, 1])
+                agent = SegregationAgent(color=(color_a, color_b)[color_index], color_index=color_index)
                 # agent.pct_similar_wanted = pct_similar_wanted
                 agent.move_to_patch(patch)
+                self.count_agent(agent, patch, 1)
+                self.colors[patch.row, patch.col] = color_index
             else:
                 self.empty_patches.add(patch)
         # print('Finished creating agents')
         self.update_all()
 
     def step(self):
-        nbr_unhappy_agents = len(self.unhappy_agents)
-        # If there is a small number of unhappy agents, move them carefully.
-        # Otherwise move the smaller of self.max_agents_per_step and nbr_unhappy_agents
-        sample_size = max(1, round(nbr_unhappy_agents/2)) if nbr_unhappy_agents <= 4 else \
-                      min(self.max_agents_per_step, nbr_unhappy_agents)
-        for agent in sample(self.unhappy_agents, sample_size):
-            agent.find_new_spot(self.empty_patches)
-        self.update_all()
+        if SimEngine.gui_get('batch_moves'):
+            self.batch_step()
+        else:
+            sample_size = self.sample_size(len(self.unhappy_agents))
+            # The sample is a list, so moving the agents may change unhappy_agents.
+            for agent in self.unhappy_agents.sample(sample_size):
+                current_patch = agent.current_patch()
+                self.move_agent(agent, agent.find_new_spot(self.empty_patches, current_patch))
+        self.update_globals()
+
+    def update_agent(self, agent, current_patch):
+        """ Update agent, which is on current_patch, total_pct_similar, and unhappy_agents. """
+        self.total_pct_similar -= agent.pct_similar
+        agent.update(current_patch)
+        self.total_pct_similar += agent.pct_similar
+        if agent.is_happy:
+            self.unhappy_agents.discard(agent)
+        else:
+            self.unhappy_agents.add(agent)
 
     def update_all(self):
         # Update Agents
+        self.unhappy_agents = Indexed_Set()
         for agent in World.agents:
-            agent.update()
-
-        # Update Globals
-        percent_similar = round(sum(agent.pct_similar for agent in World.agents)/len(World.agents))
+            agent.update(agent.current_patch())
+            if not agent.is_happy:
+                self.unhappy_agents.add(agent)
+        self.total_pct_similar = sum(agent.pct_similar for agent in World.agents)
+        self.update_globals()
+
+    def update_globals(self):
+        percent_similar = round(self.total_pct_similar/len(World.agents))
         if World.ticks == 0:
             print()
         print(f'\t{World.ticks:2}. agents: {len(World.agents)};  %-similar: {percent_similar}%;  ', end='')
 
-        self.unhappy_agents = [agent for agent in World.agents if not agent.is_happy]
         unhappy_count = len(self.unhappy_agents)
         percent_unhappy = round(100 * unhappy_count / len(World.agents), 2)
         print(f'nbr-unhappy: {unhappy_count:3};  %-unhappy: {percent_unhappy}.')
@@ -205,8 +345,13 @@ gui_left_upper = [[sg.Text('density'),
                    sg.Slider(key='max_agent_per_step', range=(10, 1000), resolution=10, size=(10, 20),
                              default_value=100, orientation='horizontal', pad=((0, 0), (0, 20)),
                              tooltip='Maximium number of unhappy agents to move each step.')],
+
+                  [sg.CB('Batch moves?', key='batch_moves', default=False,
+                         tooltip='Let up to max agents per step choose new spots at once, from arrays. '
+                                 'Agents that choose the same spot as one that goes first try again next step.')],
                   ]
 
 if __name__ == "__main__":
     from core.agent import PyLogo
-    PyLogo(SegregationWorld, "Schelling's segregation model", gui_left_upper)
+    PyLogo(SegregationWorld, "Schelling's segregation model", gui_left_upper,
+           patch_class=SegregationPatch, agent_class=SegregationAgent)
@@ -1,7 +1,6 @@
 
 from math import sqrt
 from random import choice, randint
-from statistics import mean
 
 import pygame as pg
 import pygame.transform as pgt
@@ -9,11 +8,12 @@ from pygame import Surface
 from pygame.color import Color
 from pygame.colordict import THECOLORS
 
+import core.geometry as geometry
 import core.gui as gui
 import core.pairs as pairs
 import core.utils as utils
 from core.gui import HALF_PATCH_SIZE, PATCH_SIZE, SHAPES
-from core.pairs import Pixel_xy, RowCol, Velocity, XY, heading_and_speed_to_velocity
+from core.pairs import Pixel_xy, Velocity, XY, heading_and_speed_to_velocity
 from core.world_patch_block import Block, Patch, World
 
 
@@ -87,8 +87,12 @@ class Agent(Block):
         return f'{class_name}-{self.id}{tuple(self.center_pixel.round())}'
 
     def agents_in_radius(self, distance):
+        # Look up the world's topology once rather than once per agent.
+        wrap = geometry.wraps()
+        (x, y) = self.center_pixel
         qualifying_agents = [agent for agent in World.agents
-                             if agent is not self and self.distance_to(agent) < distance]
+                             if agent is not self and
+                             geometry.distance(x, y, *agent.center_pixel, wrap) < distance]
         return qualifying_agents
 
     def all_links(self):
@@ -101,8 +105,10 @@ class Agent(Block):
         agent_set may not be all the agents. So it must be passed as an argument.
         """
         # dx and dy are the x and y components of traveling one unit in the heading direction.
-        dx = mean([utils.dx(fn(agent)) for agent in agent_set])
-        dy = mean([utils.dy(fn(agent)) for agent in agent_set])
+        # The sums point in the same direction as the means.
+        headings = [fn(agent) for agent in agent_set]
+        dx = sum(utils.dx(heading) for heading in headings)
+        dy = sum(utils.dy(heading) for heading in headings)
         return utils.dxdy_to_heading(dx, dy, default_heading=self.heading)
 
     def bounce_off_screen_edge(self, dxdy):
@@ -110,16 +116,18 @@ class Agent(Block):
        Bounce agent off the screen edges. dxdv is the current agent velocity.
        If the agent should bounce, change it as needed.
        """
-        # The center pixel of this agent.
-        current_center_pixel = self.center_pixel
-        # Where the agent will be it if moves by dxdy.
-        next_center_pixel = current_center_pixel + dxdy
-        # The patch's row_col or next_center_pixel. Is that off the screen? If so, the agent should bounce.
-        next_row_col = next_center_pixel.pixel_to_row_col()
-        if next_row_col.row < 0 or gui.PATCH_ROWS <= next_row_col.row:
-            dxdy = Velocity((dxdy.dx, dxdy.dy*(-1)))
-        if next_row_col.col < 0 or gui.PATCH_COLS <= next_row_col.col:
-            dxdy = Velocity((dxdy.dx*(-1), dxdy.dy))
+        # The center pixel of this agent and its velocity as plain numbers.
+        (x, y) = self.center_pixel
+        (dx, dy) = dxdy
+        # The patch row and col of where the agent will be if it moves by dxdy.
+        # Is that off the screen? If so, the agent should bounce.
+        block_spacing = gui.BLOCK_SPACING()
+        next_row = (y + dy) // block_spacing
+        next_col = (x + dx) // block_spacing
+        bounce_row = next_row < 0 or gui.PATCH_ROWS <= next_row
+        bounce_col = next_col < 0 or gui.PATCH_COLS <= next_col
+        if bounce_row or bounce_col:
+            dxdy = Velocity((-dx if bounce_col else dx, -dy if bounce_row else dy))
 
         return dxdy
 
@@ -149,19 +157,17 @@ class Agent(Block):
         return blank_base_image
 
     def current_patch(self) -> Patch:
-        row_col: RowCol = (self.center_pixel).pixel_to_row_col()
-        patch = World.patches_array[row_col.row, row_col.col]
-        return patch
+        # Pixel_xy.pixel_to_row_col on plain numbers, without building a RowCol.
+        block_spacing = gui.BLOCK_SPACING()
+        (x, y) = self.center_pixel
+        return World.patches_array[int(y // block_spacing), int(x // block_spacing)]
 
-    def distance_to(self, other):
-        dist = self.distance_to_pixel(other.center_pixel)
-        # wrap = not SimEngine.gui_get('Bounce?')
-        # dist = (self.center_pixel).distance_to(other.center_pixel, wrap)
-        return dist
+    def distance_to(self, other, wrap=None):
+        return self.distance_to_pixel(other.center_pixel, wrap)
 
-    def distance_to_pixel(self, pxl):
-        dist = (self.center_pixel).distance_to(pxl)
-        return dist
+    def distance_to_pixel(self, pxl, wrap=None):
+        (x, y) = self.center_pixel
+        return geometry.distance(x, y, pxl[0], pxl[1], wrap)
 
     def draw(self, shape_name=None):
         # No point in rotating circles or nodes. Only rotate SHAPES.
@@ -176,7 +182,12 @@ class Agent(Block):
 
     def forward(self, speed=1):
         velocity = heading_and_speed_to_velocity(self.heading, speed)
-        self.set_velocity(velocity)
+        if speed > 0:
+            # Moving forward leaves the heading as it is. No need for set_velocity to recompute it.
+            self.velocity = velocity
+        else:
+            # Moving backward (or not at all) turns the agent around (or to heading 0).
+            self.set_velocity(velocity)
         self.move_by_velocity()
 
     def heading_toward(self, target):
@@ -203,11 +214,8 @@ class Agent(Block):
         """
         Move to self.center_pixel + (dx, dy)
         """
-        # noinspection PyTypeChecker
-        new_center_pixel_unwrapped: Pixel_xy = self.center_pixel + dxdy
-        # Wrap around the grid of pixels.
-        new_center_pixel_wrapped = new_center_pixel_unwrapped.wrap()
-        self.move_to_xy(new_center_pixel_wrapped)
+        # set_center_pixel wraps around the grid of pixels.
+        self.move_to_xy(self.center_pixel.add_xy(dxdy[0], dxdy[1]))
 
     def move_by_velocity(self):
         if SimEngine.gui_get('Bounce?'):
@@ -233,11 +241,17 @@ class Agent(Block):
         Move this agent to its new patch with center_pixel xy.
         Add this agent to the list of agents in its new patch.
         """
-        current_patch: Patch = self.current_patch()
-        current_patch.remove_agent(self)
+        # current_patch before and after the move, on plain numbers.
+        block_spacing = gui.BLOCK_SPACING()
+        (x, y) = self.center_pixel
+        (row, col) = (int(y // block_spacing), int(x // block_spacing))
         self.set_center_pixel(xy)
-        new_patch = self.current_patch()
-        new_patch.add_agent(self)
+        (x, y) = self.center_pixel
+        (new_row, new_col) = (int(y // block_spacing), int(x // block_spacing))
+        # Most moves stay within a patch.
+        if new_row != row or new_col != col:
+            World.patches_array[row, col].remove_agent(self)
+            World.patches_array[new_row, new_col].add_agent(self)
 
     def out_links(self):
         return [lnk for lnk in World.links if lnk.directed and lnk.agent_1 is self]
@@ -254,7 +268,9 @@ class Agent(Block):
     def set_center_pixel(self, xy: Pixel_xy):
         self.center_pixel: Pixel_xy = xy.wrap()
         # Set the center point of this agent's rectangle.
-        self.rect.center = (self.center_pixel - Agent.half_patch_pixel).round()
+        (x, y) = self.center_pixel
+        (half_x, half_y) = Agent.half_patch_pixel
+        self.rect.center = (round(x - half_x), round(y - half_y))
 
     def set_color(self, color):
         self.color = color
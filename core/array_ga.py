@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+from multiprocessing import Pipe, Process
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# The random number generator for the array operators.
+rng = np.random.default_rng()
+
+# Island_Model topologies.
+RING = 'ring'
+FULLY_CONNECTED = 'fully connected'
+
+# The fraction of each island's population that migrates (at least one individual).
+MIGRANT_FRACTION = 0.02
+
+
+class Array_Population:
+    """
+    A GA population held in arrays rather than in Individual objects. An optional GA_World backend
+    for large populations and long chromosomes. See GA_World.initial_population.
+
+    chromosomes is a (pop_size, chromosome_len) int array. Each row is a chromosome: a sequence of
+    all-different genes from range(nbr_genes). fitnesses is the parallel vector of their fitnesses.
+    fitness_fn maps a 2-D array of chromosomes to the vector of their fitnesses.
+
+    All the operators work on a whole generation at once.
+    """
+
+    def __init__(self, chromosomes: np.ndarray, nbr_genes: int, fitness_fn: Callable[[np.ndarray], np.ndarray],
+                 fitness_target):
+        self.chromosomes = chromosomes
+        self.nbr_genes = nbr_genes
+        self.fitness_fn = fitness_fn
+        self.fitness_target = fitness_target
+        self.fitnesses: np.ndarray = fitness_fn(chromosomes)
+
+    @property
+    def chromosome_len(self):
+        return self.chromosomes.shape[1]
+
+    @property
+    def pop_size(self):
+        return self.chromosomes.shape[0]
+
+    def best(self, nbr_best) -> Tuple[np.ndarray, np.ndarray]:
+        """ The chromosomes and fitnesses of the nbr_best best members, best first. """
+        indices = np.argsort(self.discrepancies(self.fitnesses))[:nbr_best]
+        return (self.chromosomes[indices], self.fitnesses[indices])
+
+    def best_index(self) -> int:
+        return int(np.argmin(self.discrepancies(self.fitnesses)))
+
+    def crossover(self, parents_1: np.ndarray, parents_2: np.ndarray) -> np.ndarray:
+        """
+        The vectorized version of Individual.cx_all_diff_chromosome. Rotate both parents by random amounts.
+        Each child is a random-length prefix of its first parent followed by the genes of its second parent
+        that are not in that prefix, in order. So the genes in each child are all different.
+        """
+        (nbr_children, chromosome_len) = parents_1.shape
+        if chromosome_len < 2:
+            return parents_1.copy()
+        rows = np.arange(nbr_children)[:, None]
+        parents_1 = self.rotate(parents_1, rng.integers(0, chromosome_len, nbr_children))
+        parents_2 = self.rotate(parents_2, rng.integers(0, chromosome_len, nbr_children))
+        positions = np.arange(chromosome_len)
+        in_prefix_positions = positions < rng.integers(1, chromosome_len, nbr_children)[:, None]
+
+        # in_prefix[i, gene] is True if gene is in child i's prefix from parents_1.
+        in_prefix = np.zeros((nbr_children, self.nbr_genes), dtype=bool)
+        in_prefix[rows, parents_1] = in_prefix_positions
+        # A stable sort moves the genes of parents_2 that are not in the prefix to the front, in order.
+        # There are always enough of them to fill the rest of the child.
+        fill = np.take_along_axis(parents_2, np.argsort(in_prefix[rows, parents_2], axis=1, kind='stable'), axis=1)
+        prefix_lens = in_prefix_positions.sum(axis=1, keepdims=True)
+        fill_positions = np.maximum(positions - prefix_lens, 0)
+        return np.where(in_prefix_positions, parents_1, np.take_along_axis(fill, fill_positions, axis=1))
+
+    def discrepancies(self, fitnesses: np.ndarray) -> np.ndarray:
+        return np.abs(fitnesses - self.fitness_target)
+
+    @staticmethod
+    def invert(chromosomes: np.ndarray, prob: float) -> np.ndarray:
+        """
+        The vectorized version of Individual.reverse_subseq. With probability prob,
+        reverse a random segment of each chromosome.
+        """
+        (nbr_chromosomes, chromosome_len) = chromosomes.shape
+        mutating = rng.random(nbr_chromosomes) < prob
+        segments = np.sort(rng.integers(0, chromosome_len + 1, (nbr_chromosomes, 2)), axis=1)
+        (starts, ends) = (segments[:, :1], segments[:, 1:])
+        positions = np.arange(chromosome_len)
+        in_segment = (starts <= positions) & (positions < ends) & mutating[:, None]
+        return np.take_along_axis(chromosomes, np.where(in_segment, starts + ends - 1 - positions, positions), axis=1)
+
+    @staticmethod
+    def random_chromosomes(nbr_chromosomes, chromosome_len, nbr_genes) -> np.ndarray:
+        # Sorting random keys produces random permutations of range(nbr_genes).
+        return np.argsort(rng.random((nbr_chromosomes, nbr_genes)), axis=1)[:, :chromosome_len]
+
+    def replace_genes(self, chromosomes: np.ndarray, prob: float) -> np.ndarray:
+        """
+        With probability prob, replace a random gene in each chromosome with a random gene not already in it.
+        Nothing to do if the chromosomes include all the genes.
+        """
+        (nbr_chromosomes, chromosome_len) = chromosomes.shape
+        mutating = np.flatnonzero(rng.random(nbr_chromosomes) < prob)
+        if chromosome_len >= self.nbr_genes or not mutating.size:
+            return chromosomes
+        chromosomes = chromosomes.copy()
+        rows = np.arange(mutating.size)[:, None]
+        # Random keys, with infinite keys for genes already present. The smallest key selects the new gene.
+        keys = rng.random((mutating.size, self.nbr_genes))
+        keys[rows, chromosomes[mutating]] = np.inf
+        positions = rng.integers(0, chromosome_len, mutating.size)
+        chromosomes[mutating, positions] = np.argmin(keys, axis=1)
+        return chromosomes
+
+    def replace_worst(self, children: np.ndarray, child_fitnesses: np.ndarray):
+        """
+        Pair the worst members of the population with the best children: worst with best, second worst
+        with second best, etc. A child replaces the member it is paired with if the child is better.
+        """
+        nbr_children = min(len(children), self.pop_size)
+        worst = np.argsort(self.discrepancies(self.fitnesses))[::-1][:nbr_children]
+        best_children = np.argsort(self.discrepancies(child_fitnesses))[:nbr_children]
+        better = self.discrepancies(child_fitnesses[best_children]) < self.discrepancies(self.fitnesses[worst])
+        self.chromosomes[worst[better]] = children[best_children[better]]
+        self.fitnesses[worst[better]] = child_fitnesses[best_children[better]]
+
+    @staticmethod
+    def rotate(chromosomes: np.ndarray, amts: np.ndarray) -> np.ndarray:
+        """ The vectorized version of Individual.rotate_by. Rotate chromosomes[i] by amts[i]. """
+        chromosome_len = chromosomes.shape[1]
+        return np.take_along_axis(chromosomes, (np.arange(chromosome_len) + amts[:, None]) % chromosome_len, axis=1)
+
+    def step(self, tournament_size, prob_random_parent, prob_invert, prob_replace_gene):
+        """
+        Produce a generation of pop_size children and replace the worst of the population with them.
+        Probabilities are between 0 and 1.
+        """
+        pop_size = self.pop_size
+        parents_1 = self.chromosomes[self.tournament(pop_size, tournament_size)]
+        random_parents = rng.random(pop_size) < prob_random_parent
+        parents_1[random_parents] = self.random_chromosomes(np.count_nonzero(random_parents),
+                                                            self.chromosome_len, self.nbr_genes)
+        parents_2 = self.chromosomes[self.tournament(pop_size, tournament_size)]
+
+        children = self.crossover(parents_1, parents_2)
+        children = self.invert(children, prob_invert)
+        children = self.replace_genes(children, prob_replace_gene)
+        self.replace_worst(children, self.fitness_fn(children))
+
+    def tournament(self, nbr_winners, tournament_size) -> np.ndarray:
+        """ The indices of the winners (the best of tournament_size random members) of nbr_winners tournaments. """
+        candidates = rng.integers(0, self.pop_size, (nbr_winners, min(tournament_size, self.pop_size)))
+        winners = np.argmin(self.discrepancies(self.fitnesses)[candidates], axis=1)
+        return candidates[np.arange(nbr_winners), winners]
+
+
+def run_island(connection, population: Array_Population, seed: np.random.SeedSequence,
+               initializer: Optional[Callable], initargs: Tuple):
+    """
+    The main loop of an island process. See Island_Model. Each message is either None, which means stop,
+    or (nbr_generations, step_args, fitness_target, immigrants, nbr_emigrants). immigrants is None or
+    (chromosomes, fitnesses). The reply is the island's nbr_emigrants best (chromosomes, fitnesses).
+
+    A forked process inherits the state of rng. So each island seeds its own, from seed, or all the
+    islands would make the same random choices.
+    """
+    global rng
+    rng = np.random.default_rng(seed)
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        (nbr_generations, step_args, fitness_target, immigrants, nbr_emigrants) = message
+        population.fitness_target = fitness_target
+        if immigrants is not None:
+            population.replace_worst(*immigrants)
+        for _ in range(nbr_generations):
+            population.step(*step_args)
+        connection.send(population.best(nbr_emigrants))
+    connection.close()
+
+
+class Island_Model:
+    """
+    An island-model GA. Each of the Array_Populations evolves independently in its own process.
+    After each epoch, i.e., call to epoch(), the best individuals of each island migrate over pipes.
+    In a RING, island i sends its emigrants to island i+1. If FULLY_CONNECTED, every island sends its
+    emigrants to every other island. Immigrants replace the worst members of their new island
+    (see Array_Population.replace_worst) before the next epoch starts.
+
+    initializer(*initargs) runs at the start of each island process, e.g., to install data the
+    fitness function needs.
+    """
+
+    def __init__(self, populations: Sequence[Array_Population], topology=RING,
+                 initializer: Optional[Callable] = None, initargs: Tuple = ()):
+        self.topology = topology
+        self.nbr_migrants = max(1, round(MIGRANT_FRACTION * populations[0].pop_size))
+        (best_chromosomes, best_fitnesses) = zip(*[population.best(1) for population in populations])
+        self.record_best(populations[0].fitness_target,
+                         np.concatenate(best_chromosomes), np.concatenate(best_fitnesses))
+
+        self.connections = []
+        self.processes: List[Process] = []
+        seeds = np.random.SeedSequence().spawn(len(populations))
+        for (population, seed) in zip(populations, seeds):
+            (connection, island_connection) = Pipe()
+            process = Process(target=run_island,
+                              args=(island_connection, population, seed, initializer, initargs), daemon=True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.immigrants = [None] * len(populations)
+
+    def epoch(self, nbr_generations, step_args, fitness_target):
+        """ Evolve every island (in parallel) for nbr_generations generations. Then migrate. """
+        for (connection, immigrants) in zip(self.connections, self.immigrants):
+            connection.send((nbr_generations, step_args, fitness_target, immigrants, self.nbr_migrants))
+        emigrants = [connection.recv() for connection in self.connections]
+
+        nbr_islands = len(emigrants)
+        if self.topology == RING:
+            self.immigrants = [emigrants[i-1] for i in range(nbr_islands)]
+        else:
+            self.immigrants = [tuple(np.concatenate([emigrants[j][k] for j in range(nbr_islands) if j != i])
+                                     for k in range(2))
+                               for i in range(nbr_islands)] if nbr_islands > 1 else [None]
+        # Each island's emigrants are its best, so the global best is among them.
+        self.record_best(fitness_target,
+                         np.concatenate([chromosomes for (chromosomes, _) in emigrants]),
+                         np.concatenate([fitnesses for (_, fitnesses) in emigrants]))
+
+    def record_best(self, fitness_target, chromosomes, fitnesses):
+        best = int(np.argmin(np.abs(fitnesses - fitness_target)))
+        (self.best_chromosome, self.best_fitness) = (chromosomes[best], float(fitnesses[best]))
+
+    def shut_down(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        (self.connections, self.processes) = ([], [])
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import os
+from typing import Tuple
+
+import numpy as np
+
+# The default number of lines a CA_History retains.
+MAX_ROWS = 1000
+
+# A Packed_History's index is in a file named like its data file, with this suffix.
+INDEX_SUFFIX = '.index'
+
+# An entry of a Packed_History's index: where a line's packed cells start in the data file,
+# the column of its first cell, and its number of cells.
+INDEX_ENTRY = np.dtype([('offset', '<i8'), ('left', '<i8'), ('width', '<i8')])
+
+
+class CA_History:
+    """
+    The most recent max_rows lines of a 1-D cellular automaton, in a 2-D np.uint8 ring buffer.
+
+    Lines may have different widths and start at different columns. Rather than pad every line
+    to the width of the widest, each row of the buffer holds a line's cells at its start and
+    records where the line starts (lefts) and its width (widths). Columns are absolute. E.g., a
+    line that grew one cell to the left of a line at column 0 starts at column -1.
+
+    So appending a line takes time proportional to its width, however long the history. The buffer
+    doubles its width when a line doesn't fit, which happens only a logarithmic number of times.
+    """
+
+    def __init__(self, max_rows=MAX_ROWS, width=256):
+        self.max_rows = max_rows
+        self.cells = np.zeros((max_rows, width), dtype=np.uint8)
+        self.lefts = np.zeros(max_rows, dtype=np.int64)
+        self.widths = np.zeros(max_rows, dtype=np.int64)
+        # The number of lines ever appended. The history retains the last len(self) of them.
+        self.nbr_lines = 0
+
+    def __len__(self):
+        return min(self.nbr_lines, self.max_rows)
+
+    def append(self, cells: np.ndarray, left: int):
+        """ Append a line whose first cell is at column left. """
+        width = len(cells)
+        if width > self.cells.shape[1]:
+            wider = np.zeros((self.max_rows, max(width, 2*self.cells.shape[1])), dtype=np.uint8)
+            wider[:, :self.cells.shape[1]] = self.cells
+            self.cells = wider
+        slot = self.nbr_lines % self.max_rows
+        self.cells[slot, :width] = cells
+        (self.lefts[slot], self.widths[slot]) = (left, width)
+        self.nbr_lines += 1
+
+    def extent(self) -> Tuple[int, int]:
+        """ The (left, right) columns that include all retained lines. right is exclusive. """
+        retained = slice(None) if self.nbr_lines >= self.max_rows else slice(0, self.nbr_lines)
+        (lefts, widths) = (self.lefts[retained], self.widths[retained])
+        return (int(lefts.min()), int((lefts + widths).max()))
+
+    def line(self, index) -> Tuple[np.ndarray, int]:
+        """
+        The cells of retained line index, oldest first (negative indices count from the most recent),
+        and its left column. The cells are a view into the buffer.
+        """
+        retained = len(self)
+        if not -retained <= index < retained:
+            raise IndexError(f'CA_History line {index} is not retained')
+        slot = (self.nbr_lines - retained + index % retained) % self.max_rows
+        return (self.cells[slot, :self.widths[slot]], int(self.lefts[slot]))
+
+    def window(self, first, nbr_rows, left, width) -> np.ndarray:
+        """
+        Retained lines first through first + nbr_rows - 1 between columns left and left + width,
+        as an (nbr_rows, width) array. Columns outside a line are 0.
+        """
+        window = np.zeros((nbr_rows, width), dtype=np.uint8)
+        for row in range(nbr_rows):
+            (cells, line_left) = self.line(first + row)
+            start = max(left, line_left)
+            end = min(left + width, line_left + len(cells))
+            if start < end:
+                window[row, start - left:end - left] = cells[start - line_left:end - line_left]
+        return window
+
+
+class Packed_History:
+    """
+    All the lines of a 1-D cellular automaton, in a file, 8 cells to a byte (see np.packbits).
+    A generation of Life can be kept as a line too, e.g., history.append(cells.ravel()).
+
+    Lines are only appended. Each is written to the end of the data file at path. Its entry in the
+    index, (offset, left, width) as in INDEX_ENTRY, is written to the end of the file path + INDEX_SUFFIX.
+    Reads use memory maps of the two files, so only the pages that are read are in memory. A million
+    lines of 10,000 cells take 1.25 GB of data and 24 MB of index, but reading line k touches only its own.
+
+    Like CA_History, lines may have different widths and start at different columns.
+    mode 'w' starts a new history at path, 'a' appends to an existing one, and 'r' only reads it.
+    A reader ('r') re-reads the size of the files whenever its length is taken, so it sees the lines
+    another Packed_History on the same files has appended once they are flushed.
+    """
+
+    def __init__(self, path, mode='w'):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        if mode == 'w':
+            for file_path in (self.path, self.index_path):
+                open(file_path, 'wb').close()
+        (self.data_file, self.index_file) = (None, None) if mode == 'r' else \
+                                            (open(self.path, 'ab'), open(self.index_path, 'ab'))
+        self.nbr_lines = os.path.getsize(self.index_path) // INDEX_ENTRY.itemsize
+        self.data_size = os.path.getsize(self.path)
+        # Memory maps of the files. They are remapped when lines have been appended since they were mapped.
+        self.data: np.ndarray = None
+        self.index: np.ndarray = None
+        self.mapped_lines = 0
+
+    def __len__(self):
+        if self.index_file is None:
+            # Read only. Another Packed_History may have appended lines since.
+            self.nbr_lines = os.path.getsize(self.index_path) // INDEX_ENTRY.itemsize
+            self.data_size = os.path.getsize(self.path)
+        return self.nbr_lines
+
+    def append(self, cells: np.ndarray, left=0):
+        """ Append a line whose first cell is at column left. """
+        packed = np.packbits(np.asarray(cells, dtype=bool))
+        self.data_file.write(packed.tobytes())
+        self.index_file.write(np.array((self.data_size, left, len(cells)), dtype=INDEX_ENTRY).tobytes())
+        self.data_size += len(packed)
+        self.nbr_lines += 1
+
+    def close(self):
+        for file in (self.data_file, self.index_file):
+            if file is not None:
+                file.close()
+        (self.data_file, self.index_file, self.data, self.index) = (None, None, None, None)
+        self.mapped_lines = 0
+
+    def extent(self) -> Tuple[int, int]:
+        """ The (left, right) columns that include all lines. right is exclusive. (0, 0) if there are none. """
+        if len(self) == 0:
+            return (0, 0)
+        self.map_files()
+        return (int(self.index['left'].min()), int((self.index['left'] + self.index['width']).max()))
+
+    def flush(self):
+        """ Write the appended lines to the files, e.g., for another Packed_History to read them. """
+        for file in (self.data_file, self.index_file):
+            if file is not None:
+                file.flush()
+
+    def line(self, index) -> Tuple[np.ndarray, int]:
+        """
+        The cells of line index, oldest first (negative indices count from the most recent), as an
+        np.uint8 array, and its left column.
+        """
+        nbr_lines = len(self)
+        if not -nbr_lines <= index < nbr_lines:
+            raise IndexError(f'Packed_History line {index} does not exist')
+        self.map_files()
+        (offset, left, width) = self.index[index % nbr_lines].tolist()
+        cells = np.unpackbits(np.asarray(self.data[offset:offset + -(-width // 8)]), count=width)
+        return (cells, left)
+
+    def map_files(self):
+        if self.mapped_lines == self.nbr_lines:
+            return
+        self.flush()
+        # An empty file can't be mapped, e.g., when all the lines appended so far are empty.
+        self.data = np.memmap(self.path, dtype=np.uint8, mode='r') if self.data_size else np.zeros(0, np.uint8)
+        self.index = np.memmap(self.index_path, dtype=INDEX_ENTRY, mode='r')
+        self.mapped_lines = self.nbr_lines
+
+    # Retained lines first through first + nbr_rows - 1 between columns left and left + width.
+    # It reads the lines with self.line, so it works for either kind of history.
+    window = CA_History.window
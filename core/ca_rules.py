@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+import numpy as np
+
+
+# Elementary (1-D, 2-state, 3-neighbor) CA rules as lookup tables. This module doesn't import the GUI,
+# so processes that only run rules, e.g., Examples/ca_rule_explorer's workers, can use it.
+
+
+def rule_tables(rule_nbrs) -> np.ndarray:
+    """
+    The lookup tables of elementary CA rules, one row of 8 per rule number. Entry i of a row is the
+    new value (0 or 1) of a cell whose triple, as a binary number, is i. It's bit i of the rule number.
+    """
+    rule_nbrs = np.asarray(rule_nbrs, dtype=np.int64).reshape(-1, 1)
+    return ((rule_nbrs >> np.arange(8)) & 1).astype(np.uint8)
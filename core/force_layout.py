@@ -0,0 +1,394 @@
+from __future__ import annotations
+
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import core.geometry as geometry
+import core.gui as gui
+from core.pairs import Pixel_xy
+
+
+class Barnes_Hut_Layout:
+    """
+    A force-directed layout engine that keeps the node positions in NumPy arrays.
+
+    The forces are the ones computed node-by-node in Graph_Node.compute_velocity:
+        - repulsion between every pair of nodes: direction * (10**rep_coeff)/10 * dist**rep_exponent
+        - repulsion from the four walls (same formula)
+        - attraction along each undirected link:  direction * dist**att_exponent * 10**(att_coeff-1),
+          which becomes a push when the link is shorter than the screen distance unit.
+    As in normalize_dxdy, a direction is (dx, dy) divided by max(abs(dx), abs(dy)).
+
+    Node-node repulsion is approximated with a Barnes-Hut quadtree. A cell whose side is less than
+    theta times its distance from a node acts on that node as a single node of its combined mass
+    located at its center of mass. theta == 0 gives the exact O(N**2) sum.
+
+    If the world wraps around (Bounce? is unchecked), the magnitudes of the forces use the wrapped
+    distances, as Pixel_xy.distance_to does for compute_velocity. As there, the directions do not wrap:
+    they point along the straight line on the screen. The quadtree doesn't wrap either, so theta
+    decides which cells act as one mass from their unwrapped distances.
+
+    The quadtree is built and traversed level by level with array operations rather than node by node.
+    Each node is given a Morton (z-order) code. The cells at level l are the distinct values of
+    code >> 2*(max_depth - l). The traversal keeps a frontier of (node, cell) pairs. Each pair is either
+    accepted (the cell acts as one mass) or replaced by the (node, child-cell) pairs.
+
+    The layout is settled when no node has drifted more than settle_distance pixels over the last
+    settle_steps steps. (Nodes move a fixed distance each step, so a settled layout jitters in place
+    rather than coming to rest.) step() does nothing while the layout is settled. Loading a changed
+    graph or changing a force parameter unsettles it.
+    """
+
+    def __init__(self, theta=0.5, max_depth=12, settle_steps=20, settle_distance=3):
+        self.theta = theta
+        # Morton codes use 2 bits per level. 16 levels would fill 32 bits.
+        self.max_depth = min(max_depth, 16)
+
+        self.settle_distance = settle_distance
+        self.history = deque(maxlen=settle_steps + 1)
+
+        self.graph = None
+        self.params = None
+        # Whether the world wraps around. Set by move() from its bounce parameter.
+        self.wrap = False
+
+        self.nodes: List = []
+        self.index: Dict = {}
+        self.positions: np.ndarray = np.zeros((0, 2))
+        self.headings: np.ndarray = np.zeros(0)
+        self.edges: np.ndarray = np.zeros((0, 2), dtype=np.int64)
+
+    @staticmethod
+    def graph_key(nodes, links):
+        return (frozenset(nodes), frozenset(links))
+
+    def forget_graph(self):
+        """ The nodes have been moved by something else. Re-read them at the next load(). """
+        self.graph = None
+
+    def load(self, nodes, links):
+        """ Load the graph if it has changed. """
+        graph = self.graph_key(nodes, links)
+        if graph != self.graph:
+            self.install(self.read_graph(nodes, links, graph))
+
+    @staticmethod
+    def read_graph(nodes, links, graph) -> Tuple:
+        """
+        Copy the node positions and headings and the undirected links into arrays.
+        (link_exists, which compute_velocity uses, only finds undirected links.)
+        The result is handed to install(). The two are separate so that the Agents are read
+        on the thread that owns them.
+        """
+        nodes = list(nodes)
+        index = {node: i for (i, node) in enumerate(nodes)}
+        positions = np.array([node.center_pixel.as_tuple() for node in nodes], dtype=float).reshape(-1, 2)
+        headings = np.array([node.heading for node in nodes], dtype=float)
+        edges = [(index[lnk.agent_1], index[lnk.agent_2]) for lnk in links
+                 if not lnk.directed and lnk.agent_1 in index and lnk.agent_2 in index]
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+        return (nodes, index, positions, headings, edges, graph)
+
+    def install(self, graph_arrays):
+        (self.nodes, self.index, self.positions, self.headings, self.edges, self.graph) = graph_arrays
+        self.unsettle()
+
+    def set_params(self, theta, **params):
+        """
+        theta is the Barnes-Hut parameter. The keyword arguments are the force parameters:
+        screen_distance_unit, rep_coeff, rep_exponent, att_coeff, att_exponent, velocity_adjustment,
+        speed, and bounce.
+        """
+        if (theta, params) != (self.theta, self.params):
+            (self.theta, self.params) = (theta, params)
+            self.unsettle()
+
+    @property
+    def settled(self) -> bool:
+        if len(self.history) < self.history.maxlen:
+            return False
+        drift = self.positions - self.history[0]
+        return bool(np.hypot(drift[:, 0], drift[:, 1]).max(initial=0) <= self.settle_distance)
+
+    def unsettle(self):
+        self.history.clear()
+
+    # ###################################### Forces ###################################### #
+
+    @staticmethod
+    def directions(dxdy):
+        """ The vectorized version of normalize_dxdy: divide each (dx, dy) by max(abs(dx), abs(dy)). """
+        mx = np.abs(dxdy).max(axis=-1, keepdims=True)
+        return np.divide(dxdy, mx, out=np.zeros_like(dxdy), where=mx != 0)
+
+    @staticmethod
+    def repulsion_magnitudes(d, screen_distance_unit, rep_coeff, rep_exponent):
+        dist = np.maximum(1, d / screen_distance_unit)
+        return (10**rep_coeff)/10 * dist**rep_exponent
+
+    def attractive_forces(self, screen_distance_unit, att_coeff, att_exponent):
+        forces = np.zeros_like(self.positions)
+        if not len(self.edges):
+            return forces
+        (i, j) = (self.edges[:, 0], self.edges[:, 1])
+        delta = self.positions[j] - self.positions[i]
+        d = np.maximum(1, self.distances(delta))
+        dist = np.maximum(1, np.maximum(d, screen_distance_unit) / screen_distance_unit)
+        magnitude = dist**att_exponent * 10**(att_coeff-1)
+        # If the link is too short, push away instead of attracting.
+        magnitude = np.where(d < screen_distance_unit, -magnitude, magnitude)
+        force_on_i = self.directions(delta) * magnitude[:, None]
+        n = len(self.positions)
+        for axis in (0, 1):
+            forces[:, axis] += np.bincount(i, weights=force_on_i[:, axis], minlength=n)
+            forces[:, axis] -= np.bincount(j, weights=force_on_i[:, axis], minlength=n)
+        return forces
+
+    def repulsive_forces(self, screen_distance_unit, rep_coeff, rep_exponent):
+        n = len(self.positions)
+        forces = np.zeros_like(self.positions)
+        if n < 2:
+            return forces
+
+        levels = self.build_quadtree()
+        (x, y) = (self.positions[:, 0], self.positions[:, 1])
+        all_bodies = np.arange(n)
+        # The frontier holds (node, cell) pairs in which the cell does not contain the node. The cell that
+        # contains a node is always opened: all its children except the one containing the node join the
+        # frontier at the next level. At the root, the frontier is empty.
+        bodies = cells = np.zeros(0, dtype=np.int64)
+        theta_2 = self.theta**2
+        for (depth, level) in enumerate(levels):
+            (counts, sums, own_cells, child_starts, child_ends, cell_size) = level
+            com = sums[cells] / counts[cells, None]
+            dx = x[bodies] - com[:, 0]
+            dy = y[bodies] - com[:, 1]
+            d_2 = dx*dx + dy*dy
+            last_level = depth == len(levels) - 1
+            # A cell holding a single node is exact. Otherwise a far enough cell acts as a single mass.
+            accept = last_level | (counts[cells] == 1) | (cell_size**2 < theta_2 * d_2)
+            self.add_repulsion(forces, bodies[accept], dx[accept], dy[accept],
+                               counts[cells[accept]], screen_distance_unit, rep_coeff, rep_exponent)
+            if last_level:
+                # Nodes that are still together are (almost) on top of each other. Each is repelled
+                # by the center of mass of the others.
+                own_counts = counts[own_cells]
+                shared = own_counts > 1
+                (own_sums, own_counts) = (sums[own_cells[shared]], own_counts[shared] - 1)
+                dx = x[shared] - (own_sums[:, 0] - x[shared]) / own_counts
+                dy = y[shared] - (own_sums[:, 1] - y[shared]) / own_counts
+                self.add_repulsion(forces, all_bodies[shared], dx, dy, own_counts,
+                                   screen_distance_unit, rep_coeff, rep_exponent)
+                break
+
+            # Replace each opened (node, cell) pair with a (node, child) pair for each child of the cell.
+            opened = ~accept
+            (bodies, cells) = self.children(bodies[opened], cells[opened], child_starts, child_ends)
+            # Open the cells that contain the nodes, but skip the child that contains the node.
+            (own_bodies, own_children) = self.children(all_bodies, own_cells, child_starts, child_ends)
+            others = own_children != levels[depth + 1][2][own_bodies]
+            bodies = np.concatenate([bodies, own_bodies[others]])
+            cells = np.concatenate([cells, own_children[others]])
+        return forces
+
+    def add_repulsion(self, forces, bodies, dx, dy, masses, screen_distance_unit, rep_coeff, rep_exponent):
+        d = self.distances(np.stack((dx, dy), axis=-1))
+        magnitude = masses * self.repulsion_magnitudes(d, screen_distance_unit, rep_coeff, rep_exponent)
+        # Divide by max(abs(dx), abs(dy)) as normalize_dxdy does. Nodes at the same place don't interact.
+        max_dxdy = np.maximum(np.abs(dx), np.abs(dy))
+        scale = np.where(max_dxdy > 1e-9, magnitude / np.maximum(max_dxdy, 1e-9), 0)
+        n = len(forces)
+        forces[:, 0] += np.bincount(bodies, weights=dx*scale, minlength=n)
+        forces[:, 1] += np.bincount(bodies, weights=dy*scale, minlength=n)
+
+    @staticmethod
+    def children(bodies, cells, child_starts, child_ends):
+        """ Pair each body with each child of its cell. """
+        nbr_children = child_ends[cells] - child_starts[cells]
+        child_bodies = np.repeat(bodies, nbr_children)
+        offsets = np.arange(len(child_bodies)) - np.repeat(np.cumsum(nbr_children) - nbr_children, nbr_children)
+        child_cells = np.repeat(child_starts[cells], nbr_children) + offsets
+        return (child_bodies, child_cells)
+
+    def distances(self, dxdy):
+        """ The lengths of the (dx, dy)'s, wrapped if the world wraps. See geometry.distances. """
+        return geometry.distances(dxdy, (0, 0), self.wrap)
+
+    def wall_forces(self, screen_distance_unit, rep_coeff, rep_exponent):
+        """
+        Repulsion from the left/right and top/bottom walls. Each wall acts only along its own axis.
+        (If the world wraps, each node is equally far from the two walls on an axis, so their forces cancel.)
+        """
+        walls = np.array([gui.SCREEN_PIXEL_WIDTH(), gui.SCREEN_PIXEL_HEIGHT()], dtype=float)
+        forces = np.zeros_like(self.positions)
+        for wall in (np.zeros(2), walls):
+            delta = self.positions - wall
+            distances = np.abs(delta)
+            if self.wrap:
+                distances = np.minimum(distances, walls - distances)
+            magnitude = self.repulsion_magnitudes(distances, screen_distance_unit, rep_coeff, rep_exponent)
+            forces += np.sign(delta) * magnitude
+        return forces
+
+    def net_forces(self, screen_distance_unit, rep_coeff, rep_exponent, att_coeff, att_exponent):
+        return self.repulsive_forces(screen_distance_unit, rep_coeff, rep_exponent) + \
+               self.wall_forces(screen_distance_unit, rep_coeff, rep_exponent) + \
+               self.attractive_forces(screen_distance_unit, att_coeff, att_exponent)
+
+    # ###################################### Quadtree ###################################### #
+
+    @staticmethod
+    def spread_bits(v):
+        """ Insert a 0 bit between each of the low 16 bits of v. """
+        v = v.astype(np.uint64) & np.uint64(0x0000FFFF)
+        for (shift, mask) in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+            v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+        return v
+
+    def build_quadtree(self) -> List[Tuple]:
+        """
+        Returns, for each level from the root down, a tuple:
+            (counts, position_sums, own_cells, child_starts, child_ends, cell_size)
+        The cells of a level are the occupied ones, in Morton order. own_cells[i] is the cell containing
+        node i. The children of cell k are the cells child_starts[k]:child_ends[k] of the next level.
+        """
+        lo = self.positions.min(axis=0)
+        side = max(float((self.positions.max(axis=0) - lo).max()), 1.0) * (1 + 1e-9)
+        cells_per_side = 1 << self.max_depth
+        grid = np.minimum(((self.positions - lo) / side * cells_per_side).astype(np.int64), cells_per_side - 1)
+        codes = (self.spread_bits(grid[:, 0]) | (self.spread_bits(grid[:, 1]) << np.uint64(1))).astype(np.int64)
+
+        (levels, all_keys) = ([], [])
+        for depth in range(self.max_depth + 1):
+            (keys, inverse, counts) = np.unique(codes >> 2*(self.max_depth - depth),
+                                                return_inverse=True, return_counts=True)
+            sums = np.stack([np.bincount(inverse, weights=self.positions[:, axis], minlength=len(keys))
+                             for axis in (0, 1)], axis=1)
+            levels.append([counts, sums, inverse, None, None, side / (1 << depth)])
+            all_keys.append(keys)
+
+        for (parent, keys, child_keys) in zip(levels, all_keys, all_keys[1:]):
+            parents_of_children = child_keys >> 2
+            parent[3] = np.searchsorted(parents_of_children, keys, side='left')
+            parent[4] = np.searchsorted(parents_of_children, keys, side='right')
+        return [tuple(level) for level in levels]
+
+    # ###################################### Motion ###################################### #
+
+    def step(self) -> bool:
+        """
+        Unless the layout is settled, move every node speed pixels in the direction of the net force on it,
+        as Graph_Node.adjust_distances does. Returns whether the nodes moved.
+        """
+        if self.settled or not len(self.positions):
+            return False
+        self.move(**self.params)
+        self.history.append(self.positions)
+        return True
+
+    def move(self, screen_distance_unit, rep_coeff, rep_exponent, att_coeff, att_exponent,
+             velocity_adjustment=1, speed=1, bounce=True):
+        self.wrap = not bounce
+        net = self.net_forces(screen_distance_unit, rep_coeff, rep_exponent, att_coeff, att_exponent)
+        # Same normalization as compute_velocity. It scales but does not change the direction.
+        scale = np.maximum(np.maximum(net[:, 0], net[:, 1]), velocity_adjustment)
+        velocity = net / scale[:, None] * 10
+        length = np.hypot(velocity[:, 0], velocity[:, 1])
+        velocity = np.divide(velocity * speed, length[:, None], out=np.zeros_like(velocity),
+                             where=length[:, None] != 0)
+
+        # These are the limits used by Agent.bounce_off_screen_edge and Pixel_xy.wrap.
+        limits = np.array([gui.PATCH_COLS, gui.PATCH_ROWS]) * gui.BLOCK_SPACING()
+        if bounce:
+            next_positions = self.positions + velocity
+            velocity = np.where((next_positions < 0) | (next_positions >= limits), -velocity, velocity)
+        self.positions = (self.positions + velocity) % limits
+        self.headings = np.where(length != 0, np.degrees(np.arctan2(velocity[:, 0], -velocity[:, 1])) % 360,
+                                 self.headings)
+
+    def snapshot(self) -> Tuple:
+        return (self.nodes, self.positions.copy(), self.headings.copy())
+
+    def update_nodes(self, snapshot=None):
+        """ Copy the array positions back to the nodes (Agents) so that they are drawn there. """
+        (nodes, positions, headings) = snapshot if snapshot else (self.nodes, self.positions, self.headings)
+        for (node, (x, y), heading) in zip(nodes, positions.tolist(), headings.tolist()):
+            node.set_heading(heading)
+            node.move_to_xy(Pixel_xy((x, y)))
+
+
+class Layout_Thread(Thread):
+    """
+    Steps a Barnes_Hut_Layout on a worker thread so that the GUI doesn't wait for it.
+
+    The worker computes one step and publishes a snapshot of the positions. The model's step()
+    calls sync(), which copies the latest snapshot to the nodes and lets the worker compute the next
+    step while the world is drawn. The worker never touches the Agents: sync() reads the graph on
+    the caller's thread and hands it over with the force parameters. When the layout settles, the
+    worker sleeps until the graph or a parameter changes.
+
+    Each graph handed over is numbered, and each snapshot carries the number of the graph it was
+    computed from. The worker may finish a step of the old graph after sync() has handed over a new
+    one. sync() drops such a snapshot rather than moving nodes that may have been deleted.
+    """
+
+    def __init__(self, layout: Barnes_Hut_Layout):
+        super().__init__(daemon=True)
+        self.layout = layout
+        self.lock = Lock()
+        self.wake = Event()
+        self.sent_graph = None
+        # The number of the last graph handed to the worker.
+        self.graph_nbr = 0
+        self.pending_graph: Optional[Tuple] = None
+        self.pending_params: Optional[Dict] = None
+        self.latest_snapshot: Optional[Tuple] = None
+        self.start()
+
+    def run(self):
+        graph_nbr = 0
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            with self.lock:
+                (graph, params) = (self.pending_graph, self.pending_params)
+                (self.pending_graph, self.pending_params) = (None, None)
+            if graph:
+                (graph_nbr, graph) = graph
+                self.layout.install(graph)
+            if params:
+                self.layout.set_params(**params)
+            if self.layout.params and self.layout.step():
+                with self.lock:
+                    self.latest_snapshot = (graph_nbr, self.layout.snapshot())
+
+    def forget_graph(self):
+        """ The nodes have been moved by something else. Send them again at the next sync(). """
+        self.sent_graph = None
+
+    def sync(self, nodes, links, **params) -> bool:
+        """
+        Called on the model's thread. Hand over the graph if it changed and the current parameters,
+        and copy the latest snapshot (if any) to the nodes. Returns whether the nodes moved.
+        """
+        graph_key = self.layout.graph_key(nodes, links)
+        graph = None
+        if graph_key != self.sent_graph:
+            self.sent_graph = graph_key
+            graph = self.layout.read_graph(nodes, links, graph_key)
+        with self.lock:
+            if graph:
+                self.graph_nbr += 1
+                self.pending_graph = (self.graph_nbr, graph)
+            self.pending_params = params
+            (snapshot, self.latest_snapshot) = (self.latest_snapshot, None)
+        # A snapshot of an earlier graph is out of date.
+        moved = snapshot is not None and snapshot[0] == self.graph_nbr
+        if moved:
+            self.layout.update_nodes(snapshot[1])
+        self.wake.set()
+        return moved
+
@@ -1,10 +1,18 @@
 
 from __future__ import annotations
 
-from random import choice, randint, sample
-from typing import Any, NewType, Optional, Sequence, Tuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from heapq import heapify, heappop, heappush
+from os import cpu_count
+from random import choice, randint, random, randrange, sample, shuffle
+from typing import Any, Callable, List, NewType, Optional, Sequence, Tuple
 
+import numpy as np
+
+import core.geometry as geometry
 import core.gui as gui
+from core.array_ga import Array_Population, FULLY_CONNECTED, Island_Model, RING, rng
 from core.gui import GO_ONCE, GOSTOP
 from core.sim_engine import SimEngine
 from core.world_patch_block import World
@@ -12,6 +20,40 @@ from core.world_patch_block import World
 Gene = NewType('Gene', Any)
 Chromosome = NewType('Chromosome', Tuple[Gene])
 
+# A picklable (function, args) pair. function(*args) is an individual's fitness.
+Fitness_Job = NewType('Fitness_Job', Tuple[Callable[..., float], Tuple])
+
+# The values of the 'evaluation', 'pool', and 'representation' combos.
+STEADY_STATE = 'steady-state'
+GENERATIONAL = 'generational'
+PROCESSES = 'processes'
+THREADS = 'threads'
+INDIVIDUALS = 'individuals'
+ARRAYS = 'arrays'
+
+
+# The number of chromosome fitnesses GA_World.chromosome_fitness remembers.
+FITNESS_CACHE_SIZE = 2**16
+
+# The number of nearest genes in each of GA_World.neighbor_lists.
+NEIGHBOR_LIST_SIZE = 10
+
+# Tournaments at least this large are run with NumPy. See Ranked_Population.select_index.
+VECTORIZED_TOURNAMENT_SIZE = 32
+
+
+def install_gene_distances(distances: np.ndarray):
+    """ Also the pool initializer. Gives pool worker processes the distance matrix. """
+    GA_World.distances = distances
+    # Indexing lists of Python floats is much faster than indexing an np.ndarray one element at a time.
+    GA_World.distance_rows = distances.tolist()
+
+
+def run_fitness_job(job: Fitness_Job) -> float:
+    """ Runs in a pool worker. Must be at the top level of the module so that it can be pickled. """
+    (function, args) = job
+    return function(*args)
+
 
 class Individual:
     """
@@ -27,20 +69,51 @@ class Individual:
     def __init__(self, chromosome: Sequence[Gene]):
         self.chromosome: Chromosome = chromosome if isinstance(chromosome, tuple) else \
                                       GA_World.seq_to_chromosome(chromosome)
-        # No need to compute fitness multiple times. Cache it here.
-        self.fitness = self.compute_fitness()
+        # No need to compute fitness multiple times. Cache it here. It is computed when first
+        # needed (see the fitness property) or, in generational mode, by GA_World.evaluate.
+        self._fitness = None
+        # The discrepancy is cached too, along with the fitness_target it was computed for.
+        self._discrepancy = None
+        self._discrepancy_target = None
 
     def compute_fitness(self):
+        return GA_World.chromosome_fitness(self.chromosome)
+
+    @staticmethod
+    def compute_chromosome_fitness(chromosome: Chromosome) -> float:
+        """ Must not rely on the GUI. See fitness_job. """
         pass
 
+    @property
+    def fitness(self):
+        if self._fitness is None:
+            self._fitness = self.compute_fitness()
+        return self._fitness
+
+    @fitness.setter
+    def fitness(self, fitness):
+        """ Setting fitness to None means that it must be recomputed. """
+        self._fitness = fitness
+        self._discrepancy = None
+
+    @property
+    def fitness_known(self) -> bool:
+        return self._fitness is not None
+
+    def fitness_job(self) -> Optional[Fitness_Job]:
+        """
+        A picklable job that computes this individual's fitness in a pool worker. See run_fitness_job.
+        The default runs compute_chromosome_fitness. Subclasses that override compute_fitness instead
+        should return None, which means that fitness is computed by compute_fitness in the main process.
+        """
+        return Fitness_Job((type(self).compute_chromosome_fitness, (self.chromosome, )))
+
     @staticmethod
     def cx_all_diff(ind_1, ind_2) -> Tuple[Individual, Individual]:
         """
         Perform crossover between self and other while preserving all_different.
         """
-        child_1 = GA_World.individual_class(Individual.cx_all_diff_chromosome(ind_1.chromosome, ind_2.chromosome))
-        child_2 = GA_World.individual_class(Individual.cx_all_diff_chromosome(ind_2.chromosome, ind_1.chromosome))
-        return (child_1, child_2)
+        return Individual.cx_two_children(Individual.cx_all_diff_chromosome, ind_1, ind_2)
 
     @staticmethod
     def cx_all_diff_chromosome(chromosome_1: Chromosome, chromosome_2: Chromosome) -> Chromosome:
@@ -56,19 +129,151 @@ class Individual:
         indx = choice(inner_indices)
 
         child_chromosome_start: Chromosome = chromosome_1_rotated[:indx]
+        # A set makes the membership test constant time.
+        start_genes = set(child_chromosome_start)
         child_chromosome_end: Chromosome = GA_World.seq_to_chromosome([gene for gene in chromosome_2_rotated
-                                                                        if gene not in child_chromosome_start])
+                                                                        if gene not in start_genes])
 
         child_chromosome: Chromosome = Chromosome(child_chromosome_start + child_chromosome_end)
         return child_chromosome[:len(chromosome_1)]
 
+    # The following crossover operators all preserve all_different and run in linear time. Each has a
+    # version that produces two children from two individuals (a mating_op) and one that produces a
+    # child chromosome from two parent chromosomes. The parents are the same length.
+    #
+    # Order (OX) and edge recombination (ERX) crossover work even if the parents have different genes.
+    # Partially mapped (PMX) and cycle (CX) crossover require that the parents have the same genes,
+    # i.e., that they are permutations of each other. If not, they fall back to OX.
+
+    @staticmethod
+    def cx_cycle(ind_1, ind_2) -> Tuple[Individual, Individual]:
+        return Individual.cx_two_children(Individual.cx_cycle_chromosome, ind_1, ind_2)
+
+    @staticmethod
+    def cx_cycle_chromosome(chromosome_1: Chromosome, chromosome_2: Chromosome) -> Chromosome:
+        """
+        Cycle crossover (CX). Every gene stays at the position it has in one of the parents. Split the
+        positions into cycles: from position i go to the position in chromosome_1 of chromosome_2[i].
+        Take the genes in alternate cycles from alternate parents.
+        """
+        if set(chromosome_1) != set(chromosome_2):
+            return Individual.cx_ordered_chromosome(chromosome_1, chromosome_2)
+        position_in_1 = {gene: i for (i, gene) in enumerate(chromosome_1)}
+        child = [None] * len(chromosome_1)
+        parent = chromosome_1
+        for start in range(len(chromosome_1)):
+            if child[start] is not None:
+                continue
+            i = start
+            while child[i] is None:
+                child[i] = parent[i]
+                i = position_in_1[chromosome_2[i]]
+            parent = chromosome_2 if parent is chromosome_1 else chromosome_1
+        return GA_World.seq_to_chromosome(child)
+
+    @staticmethod
+    def cx_edge_recombination(ind_1, ind_2) -> Tuple[Individual, Individual]:
+        return Individual.cx_two_children(Individual.cx_edge_recombination_chromosome, ind_1, ind_2)
+
+    @staticmethod
+    def cx_edge_recombination_chromosome(chromosome_1: Chromosome, chromosome_2: Chromosome) -> Chromosome:
+        """
+        Edge recombination crossover (ERX). Chromosomes are treated as closed loops. Start with the first
+        gene of chromosome_1. Then repeatedly move to the unused neighbor (in either parent) of the current
+        gene that has the fewest unused neighbors of its own. At a dead end, jump to a random unused gene.
+        """
+        len_chrom = len(chromosome_1)
+        neighbors = {}
+        for chromosome in (chromosome_1, chromosome_2):
+            for (i, gene) in enumerate(chromosome):
+                neighbors.setdefault(gene, set()).update((chromosome[i-1], chromosome[(i+1) % len_chrom]))
+        # For random jumps. Used genes are skipped.
+        unused_genes = list(neighbors)
+        shuffle(unused_genes)
+
+        gene = chromosome_1[0]
+        child = [gene]
+        used = {gene}
+        while len(child) < len_chrom:
+            # A gene's neighbor set holds only unused genes.
+            for neighbor in neighbors[gene]:
+                neighbors[neighbor].discard(gene)
+            if neighbors[gene]:
+                # Break ties randomly.
+                gene = min(neighbors[gene], key=lambda nbr: (len(neighbors[nbr]), random()))
+            else:
+                while unused_genes[-1] in used:
+                    unused_genes.pop()
+                gene = unused_genes.pop()
+            child.append(gene)
+            used.add(gene)
+        return GA_World.seq_to_chromosome(child)
+
+    @staticmethod
+    def cx_ordered(ind_1, ind_2) -> Tuple[Individual, Individual]:
+        return Individual.cx_two_children(Individual.cx_ordered_chromosome, ind_1, ind_2)
+
+    @staticmethod
+    def cx_ordered_chromosome(chromosome_1: Chromosome, chromosome_2: Chromosome) -> Chromosome:
+        """
+        Order crossover (OX). Copy a random segment of chromosome_1 to the child. Fill the rest of the child,
+        starting after the segment and wrapping around, with the genes of chromosome_2 not in the segment,
+        in the order they appear in chromosome_2 starting after the segment.
+        """
+        len_chrom = len(chromosome_1)
+        (start, end) = sorted(sample(range(len_chrom + 1), 2))
+        segment = chromosome_1[start:end]
+        segment_genes = set(segment)
+        # There are always at least enough genes to fill the child.
+        fill = [gene for gene in chromosome_2[end:] + chromosome_2[:end]
+                if gene not in segment_genes][:len_chrom - len(segment)]
+        after_segment = len_chrom - end
+        return GA_World.seq_to_chromosome(fill[after_segment:] + list(segment) + fill[:after_segment])
+
+    @staticmethod
+    def cx_partially_mapped(ind_1, ind_2) -> Tuple[Individual, Individual]:
+        return Individual.cx_two_children(Individual.cx_partially_mapped_chromosome, ind_1, ind_2)
+
+    @staticmethod
+    def cx_partially_mapped_chromosome(chromosome_1: Chromosome, chromosome_2: Chromosome) -> Chromosome:
+        """
+        Partially mapped crossover (PMX). Start with a copy of chromosome_2 and copy a random segment of
+        chromosome_1 into it. A gene of chromosome_2 displaced from the segment goes where the mapping
+        chromosome_1[i] -> (position of chromosome_1[i] in chromosome_2) first leads outside the segment.
+        """
+        if set(chromosome_1) != set(chromosome_2):
+            return Individual.cx_ordered_chromosome(chromosome_1, chromosome_2)
+        (start, end) = sorted(sample(range(len(chromosome_1) + 1), 2))
+        position_in_2 = {gene: i for (i, gene) in enumerate(chromosome_2)}
+        child = list(chromosome_2)
+        child[start:end] = chromosome_1[start:end]
+        segment_genes = set(chromosome_1[start:end])
+        for i in range(start, end):
+            displaced_gene = chromosome_2[i]
+            if displaced_gene in segment_genes:
+                continue
+            j = position_in_2[chromosome_1[i]]
+            while start <= j < end:
+                j = position_in_2[chromosome_1[j]]
+            child[j] = displaced_gene
+        return GA_World.seq_to_chromosome(child)
+
+    @staticmethod
+    def cx_two_children(cx_chromosome, ind_1, ind_2) -> Tuple[Individual, Individual]:
+        """ Apply cx_chromosome, a chromosome crossover operator, in both directions. """
+        child_1 = GA_World.individual_class(cx_chromosome(ind_1.chromosome, ind_2.chromosome))
+        child_2 = GA_World.individual_class(cx_chromosome(ind_2.chromosome, ind_1.chromosome))
+        return (child_1, child_2)
+
     @property
     def discrepancy(self):
-        discr = abs(self.fitness - GA_World.fitness_target)
-        return discr
+        if self._discrepancy is None or self._discrepancy_target != GA_World.fitness_target:
+            self._discrepancy_target = GA_World.fitness_target
+            self._discrepancy = abs(self.fitness - GA_World.fitness_target)
+        return self._discrepancy
 
     def mate_with(self, other) -> Tuple[Individual, Individual]:
-        pass
+        return GA_World.mating_op(self, other)
 
     def mutate(self) -> Individual:
         pass
@@ -89,24 +294,135 @@ class Individual:
         return chromosome[amt:] + chromosome[:amt]
 
 
+class Ranked_Population:
+    """
+    The list of Individuals in a GA_World, indexed by discrepancy.
+
+    The discrepancies are also kept in an np.ndarray, for vectorized tournaments, and in a min-heap and
+    a max-heap of (discrepancy, index) pairs, for the best and worst individuals. Replacing an individual
+    pushes a new pair onto each heap. Pairs whose discrepancy is no longer that of their index are
+    discarded when they reach the top. So replacement is O(log n), and best_index and worst_index are
+    O(1) amortized. The heaps are rebuilt when they fill up with discarded pairs.
+
+    An individual whose fitness is changed in place, e.g., by local search, must be re-ranked: see
+    update. When fitness_target changes, all must be: see rerank.
+    """
+
+    def __init__(self, individuals: Sequence[Individual]):
+        self.individuals: List[Individual] = list(individuals)
+        self.discrepancies: np.ndarray = None
+        self.min_heap = None
+        self.max_heap = None
+        self.rerank()
+
+    def __getitem__(self, index) -> Individual:
+        return self.individuals[index]
+
+    def __iter__(self):
+        return iter(self.individuals)
+
+    def __len__(self):
+        return len(self.individuals)
+
+    def __setitem__(self, index, individual: Individual):
+        self.individuals[index] = individual
+        self.update(index)
+
+    def best_index(self) -> int:
+        return self.top_index(self.min_heap, 1)
+
+    def rerank(self):
+        """ Recompute every discrepancy and rebuild the heaps. """
+        discrepancies = [ind.discrepancy for ind in self.individuals]
+        self.discrepancies = np.array(discrepancies, dtype=np.float64)
+        self.min_heap = [(discr, index) for (index, discr) in enumerate(discrepancies)]
+        self.max_heap = [(-discr, index) for (index, discr) in enumerate(discrepancies)]
+        heapify(self.min_heap)
+        heapify(self.max_heap)
+
+    def select_index(self, best_or_worst, tournament_size) -> int:
+        """
+        The index of the best or worst of tournament_size randomly selected individuals. A tournament that
+        includes everyone is a heap lookup. Large tournaments compare the discrepancies with NumPy.
+        """
+        pop_size = len(self.individuals)
+        if tournament_size >= pop_size:
+            return self.best_index() if best_or_worst == GA_World.BEST else self.worst_index()
+        if tournament_size >= VECTORIZED_TOURNAMENT_SIZE:
+            candidate_indices = rng.choice(pop_size, tournament_size, replace=False)
+            candidate_discrs = self.discrepancies[candidate_indices]
+            arg_min_or_max = np.argmin if best_or_worst == GA_World.BEST else np.argmax
+            return int(candidate_indices[arg_min_or_max(candidate_discrs)])
+        min_or_max = min if best_or_worst == GA_World.BEST else max
+        candidate_indices = sample(range(pop_size), tournament_size)
+        return min_or_max(candidate_indices, key=lambda i: self.individuals[i].discrepancy)
+
+    def top_index(self, heap, sign) -> int:
+        """ Discard outdated pairs from the top of heap. sign is -1 for the max-heap. """
+        while True:
+            (signed_discr, index) = heap[0]
+            if sign * signed_discr == self.discrepancies[index]:
+                return index
+            heappop(heap)
+
+    def update(self, index):
+        """ Re-rank the individual at index, e.g., after its fitness has changed. """
+        discr = self.individuals[index].discrepancy
+        self.discrepancies[index] = discr
+        if len(self.min_heap) > 4 * len(self.individuals):
+            self.rerank()
+            return
+        heappush(self.min_heap, (discr, index))
+        heappush(self.max_heap, (-discr, index))
+
+    def worst_index(self) -> int:
+        return self.top_index(self.max_heap, -1)
+
+
 class GA_World(World):
     """
     The Population holds the collection of Individuals that will undergo evolution.
+
+    If there are agents, genes are their indices in GA_World.gene_agents. The (float32) distance
+    between the agents at gene indices i and j is GA_World.distances[i, j]. The same distances
+    are in GA_World.distance_rows[i][j] as Python floats. All are set by setup.
     """
     fitness_target = None
     individual_class = None
+    # A crossover operator, e.g., Individual.cx_all_diff. The GUI's crossover combo may override it.
+    mating_op = None
+
+    gene_agents = None
+    distances: np.ndarray = None
+    distance_rows = None
+    # All the genes. See sample_unused_genes.
+    gene_pool: frozenset = None
+    # neighbor_lists[i] is a list of the (up to) NEIGHBOR_LIST_SIZE genes nearest to gene i, nearest first.
+    # For restricting local search to promising moves.
+    neighbor_lists = None
+
+    # individual_class.compute_chromosome_fitness wrapped in an lru_cache. Set by setup.
+    chromosome_fitness = None
+
+    BEST = 'best'
+    WORST = 'worst'
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.best_ind: Optional[Individual] = None
         self.generations = None
-        self.mating_op = None
         self.pop_size = None
         self.tournament_size = None
 
-        self.BEST = 'best'
-        self.WORST = 'worst'
+        # The fitness evaluation pool, if any, and its (kind, nbr_workers). See evaluate.
+        self.pool: Optional[Executor] = None
+        self.pool_spec = None
+
+        # The array representation of the population, if used. Otherwise, self.individuals.
+        # With more than one island, self.islands instead. See set_up_arrays.
+        self.population: Optional[Array_Population] = None
+        self.islands: Optional[Island_Model] = None
 
     def generate_2_children(self):
         parent_1 = self.get_parent()
@@ -115,22 +431,93 @@ class GA_World(World):
         child_1_mutated: Individual = child_1.mutate()
         child_2_mutated: Individual = child_2.mutate()
 
-        child_1_mutated.compute_fitness()
-        child_2_mutated.compute_fitness()
-
         dest_1_indx = self.select_gene_index(self.WORST, self.tournament_size)
         dest_2_indx = self.select_gene_index(self.WORST, self.tournament_size)
         self.individuals[dest_1_indx] = min([child_1, child_1_mutated], key=lambda c: c.discrepancy)
         self.individuals[dest_2_indx] = min([child_2, child_2_mutated], key=lambda c: c.discrepancy)
 
+    def array_fitness(self, chromosomes: np.ndarray) -> np.ndarray:
+        """ The vectorized fitness function for the array representation. See initial_population. """
+        pass
+
+    def array_step_args(self):
+        """ The arguments of Array_Population.step. The GUI's probabilities are percentages. """
+        return (self.tournament_size, SimEngine.gui_get('prob_random_parent')/100,
+                SimEngine.gui_get('reverse_subseq')/100, (SimEngine.gui_get('replace_gene') or 0)/100)
+
+    def evaluate(self, individuals: Sequence[Individual]):
+        """
+        Compute the fitness of those individuals whose fitness isn't known. If the GUI asks for more
+        than one worker and the individuals provide fitness jobs, they run in a process or thread pool.
+        A thread pool helps only if the fitness function releases the GIL, e.g., NumPy code.
+        """
+        unevaluated = [ind for ind in individuals if not ind.fitness_known]
+        jobs = [ind.fitness_job() for ind in unevaluated]
+        pool = self.get_pool() if unevaluated and None not in jobs else None
+        if pool is None:
+            for ind in unevaluated:
+                ind.fitness = ind.compute_fitness()
+            return
+
+        chunksize = max(1, len(jobs) // (4 * self.pool_spec[1]))
+        for (ind, fitness) in zip(unevaluated, pool.map(run_fitness_job, jobs, chunksize=chunksize)):
+            ind.fitness = fitness
+
+    def final_thoughts(self):
+        self.shut_down_pool()
+        self.shut_down_islands()
+        super().final_thoughts()
+
     def gen_individual(self):
         pass
 
+    def generate_generation(self):
+        """
+        The generational alternative to calling generate_2_children pop_size/2 times.
+        All parents are selected from the current population. All the children are created, evaluated
+        together (see evaluate), mutated, and evaluated again. Then each replaces the worst member of a
+        tournament, as in generate_2_children.
+        """
+        children = []
+        for _ in range(self.pop_size//2):
+            parent_1 = self.get_parent()
+            parent_2 = self.get_parent()
+            children.extend(parent_1.mate_with(parent_2))
+        # Mutation may depend on fitness, e.g., to compute a mutant's fitness incrementally.
+        self.evaluate(children)
+        mutants = [child.mutate() for child in children]
+        self.evaluate(mutants)
+
+        for mutant in mutants:
+            dest_indx = self.select_gene_index(self.WORST, self.tournament_size)
+            self.individuals[dest_indx] = mutant
+
     def get_best_individual(self):
-        best_index = self.select_gene_index(self.BEST, len(self.individuals))
-        best_individual = self.individuals[best_index]
+        if self.islands is not None:
+            best_individual = GA_World.individual_class(tuple(self.islands.best_chromosome.tolist()))
+            best_individual.fitness = self.islands.best_fitness
+            return best_individual
+        if self.population is not None:
+            best_index = self.population.best_index()
+            best_individual = GA_World.individual_class(tuple(self.population.chromosomes[best_index].tolist()))
+            best_individual.fitness = float(self.population.fitnesses[best_index])
+            return best_individual
+        best_individual = self.individuals[self.individuals.best_index()]
         return best_individual
 
+    def get_pool(self) -> Optional[Executor]:
+        """ The evaluation pool the GUI asks for, or None for a single worker. """
+        pool_spec = (SimEngine.gui_get('pool'), int(SimEngine.gui_get('workers')))
+        if pool_spec != self.pool_spec:
+            self.shut_down_pool()
+            (kind, nbr_workers) = self.pool_spec = pool_spec
+            if nbr_workers > 1:
+                # Threads share GA_World's distances. Worker processes get their own copies.
+                self.pool = ThreadPoolExecutor(nbr_workers) if kind == THREADS else \
+                            ProcessPoolExecutor(nbr_workers, initializer=install_gene_distances,
+                                                initargs=(GA_World.distances, ))
+        return self.pool
+
     def get_parent(self):
         if randint(0, 99) < SimEngine.gui_get('prob_random_parent'):
             parent = self.gen_individual()
@@ -142,13 +529,31 @@ class GA_World(World):
     def handle_event(self, event):
         if event == 'fitness_target':
             GA_World.fitness_target = SimEngine.gui_get('fitness_target')
+            if self.population is not None:
+                self.population.fitness_target = GA_World.fitness_target
+            if self.individuals is not None:
+                self.individuals.rerank()
             self.resume_ga()
             return
+        if event == 'crossover':
+            self.set_mating_op()
+            return
         super().handle_event(event)
 
     def initial_individuals(self):
         pass
 
+    def initial_population(self) -> Optional[Array_Population]:
+        """
+        The initial population in the array representation, for worlds that support it.
+        Such worlds also define array_fitness. None means use individuals.
+        """
+        pass
+
+    def polish(self):
+        """ Called by step just before set_results. E.g., to improve the best individuals by local search. """
+        pass
+
     def resume_ga(self):
         if self.done:
             self.done = False
@@ -160,16 +565,46 @@ class GA_World(World):
             go_stop_button.click()
         self.set_results()
 
+    @staticmethod
+    def sample_unused_genes(chromosome: Chromosome, k) -> List[Gene]:
+        """
+        Up to k different random genes that are not in chromosome, in random order.
+
+        If the chromosome and the sample together use at most half the genes, draw random genes and reject
+        the used ones. Each draw then succeeds at least half the time, so this takes time O(len(chromosome) + k),
+        however many genes there are. Otherwise, sample the set of unused genes.
+        """
+        nbr_genes = len(GA_World.gene_pool)
+        used = set(chromosome)
+        k = min(k, nbr_genes - len(used))
+        if 2*(len(used) + k) > nbr_genes:
+            return sample(list(GA_World.gene_pool.difference(used)), k)
+        genes = []
+        while len(genes) < k:
+            gene = randrange(nbr_genes)
+            if gene not in used:
+                used.add(gene)
+                genes.append(gene)
+        return genes
+
     def select_gene_index(self, best_or_worst, tournament_size) -> int:
-        min_or_max = min if best_or_worst == self.BEST else max
-        candidate_indices = sample(range(self.pop_size), min(tournament_size, self.pop_size))
-        selected_index = min_or_max(candidate_indices, key=lambda i: self.individuals[i].discrepancy)
+        selected_index = self.individuals.select_index(best_or_worst, min(tournament_size, self.pop_size))
         return selected_index
 
     @staticmethod
     def seq_to_chromosome(lst: Sequence[Gene]) -> Chromosome:
         return Chromosome(tuple(lst))
 
+    def shut_down_islands(self):
+        if self.islands is not None:
+            self.islands.shut_down()
+        self.islands = None
+
+    def shut_down_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        (self.pool, self.pool_spec) = (None, None)
+
     def set_results(self):
         current_best_ind = self.get_best_individual()
         if self.best_ind is None or current_best_ind.discrepancy < self.best_ind.discrepancy:
@@ -178,14 +613,60 @@ class GA_World(World):
         SimEngine.gui_set('discrepancy', value=round(self.best_ind.discrepancy, 1))
         SimEngine.gui_set('generations', value=self.generations)
 
+    @staticmethod
+    def set_mating_op():
+        crossover = SimEngine.gui_get('crossover')
+        if crossover in CROSSOVER_OPS:
+            GA_World.mating_op = CROSSOVER_OPS[crossover]
+
+    def set_up_arrays(self):
+        """
+        Set up the array representation: a single Array_Population or, if the GUI asks for more than one
+        island, an Island_Model with an initial population per island.
+        """
+        self.shut_down_islands()
+        self.population = None
+        nbr_islands = int(SimEngine.gui_get('islands'))
+        if nbr_islands > 1:
+            populations = [self.initial_population() for _ in range(nbr_islands)]
+            if None not in populations:
+                self.islands = Island_Model(populations, SimEngine.gui_get('topology'),
+                                            initializer=install_gene_distances, initargs=(GA_World.distances, ))
+            return
+        self.population = self.initial_population()
+
+    @staticmethod
+    def set_gene_agents():
+        """ Number the agents, which serve as genes, and compute the distances between them. """
+        GA_World.gene_agents = sorted(World.agents, key=lambda agent: agent.id)
+        GA_World.gene_pool = frozenset(range(len(GA_World.gene_agents)))
+        centers = [agent.center_pixel for agent in GA_World.gene_agents]
+        install_gene_distances(geometry.pairwise_distances(centers).astype(np.float32))
+        # Column 0 of each sorted row is the gene itself, at distance 0.
+        nearest_genes = np.argsort(GA_World.distances, axis=1, kind='stable')[:, 1:NEIGHBOR_LIST_SIZE+1]
+        GA_World.neighbor_lists = nearest_genes.tolist()
+
     # noinspection PyAttributeOutsideInit
     def setup(self):
+        # Distances and fitnesses from an earlier run no longer apply. Pool workers have old distances.
+        self.shut_down_pool()
+        if World.agents:
+            self.set_gene_agents()
+        GA_World.chromosome_fitness = \
+            lru_cache(maxsize=FITNESS_CACHE_SIZE)(GA_World.individual_class.compute_chromosome_fitness)
+        self.set_mating_op()
+
         # Create a list of Individuals as the initial population.
         # self.pop_size must be even since we generate children two at a time.
-        self.pop_size = (SimEngine.gui_get('pop_size')//2)*2
+        self.pop_size = (int(SimEngine.gui_get('pop_size'))//2)*2
         self.tournament_size = SimEngine.gui_get('tourn_size')
         GA_World.fitness_target = SimEngine.gui_get('fitness_target')
-        self.individuals = self.initial_individuals()
+        self.shut_down_islands()
+        self.population = None
+        if SimEngine.gui_get('representation') == ARRAYS:
+            self.set_up_arrays()
+        using_arrays = self.population is not None or self.islands is not None
+        self.individuals = None if using_arrays else Ranked_Population(self.initial_individuals())
         self.best_ind = None
         self.generations = 0
         self.set_results()
@@ -195,13 +676,34 @@ class GA_World(World):
             self.done = True
             return
 
-        for i in range(self.pop_size//2):
-            self.generate_2_children()
-
-        self.generations += 1
+        if self.islands is not None:
+            # A step is a migration epoch: every island evolves for migration_interval generations.
+            migration_interval = int(SimEngine.gui_get('migration_interval'))
+            self.islands.epoch(migration_interval, self.array_step_args(), GA_World.fitness_target)
+            self.generations += migration_interval
+        else:
+            if self.population is not None:
+                # The array representation is always generational. Its fitness function is vectorized.
+                self.population.step(*self.array_step_args())
+            elif SimEngine.gui_get('evaluation') == GENERATIONAL:
+                self.generate_generation()
+            else:
+                for i in range(self.pop_size//2):
+                    self.generate_2_children()
+            self.generations += 1
+
+        self.polish()
         self.set_results()
 
 
+# The choices in the crossover combo.
+CROSSOVER_OPS = {'all different': Individual.cx_all_diff,
+                 'order (OX)': Individual.cx_ordered,
+                 'partially mapped (PMX)': Individual.cx_partially_mapped,
+                 'cycle (CX)': Individual.cx_cycle,
+                 'edge recombination (ERX)': Individual.cx_edge_recombination}
+
+
 # ############################################## Define GUI ############################################## #
 import PySimpleGUI as sg
 gui_left_upper = [
@@ -216,8 +718,8 @@ gui_left_upper = [
                     ],
 
                    [sg.Text('Population size\n(must be even)', pad=((0, 5), (20, 0))),
-                    sg.Slider(key='pop_size', range=(4, 100), resolution=2, default_value=50,
-                              orientation='horizontal', size=(10, 20))
+                    sg.Combo(key='pop_size', values=[4, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000],
+                             default_value=50, pad=((0, 0), (20, 0)), readonly=True)
                     ],
 
                    [sg.Text('Nbr points', pad=((0, 5), (10, 0))),
@@ -235,9 +737,53 @@ gui_left_upper = [
                               orientation='horizontal', size=(10, 20))
                     ],
 
+                   [sg.Text('Crossover', pad=((0, 5), (20, 0))),
+                    sg.Combo(key='crossover', values=list(CROSSOVER_OPS), default_value='all different',
+                             pad=((0, 0), (20, 0)), enable_events=True,
+                             tooltip='OX and ERX work on any chromosomes. PMX and CX need permutations '
+                                     'of the same genes and otherwise use OX.')
+                    ],
+
                    [sg.Text('Prob random parent', pad=((0, 5), (20, 0))),
                     sg.Slider(key='prob_random_parent', range=(0, 100), default_value=35,
                               orientation='horizontal', size=(10, 20))
                     ],
 
+                   [sg.Text('Representation', pad=((0, 5), (20, 0)),
+                            tooltip='individuals: a list of Individual objects.\n'
+                                    'arrays: arrays of genes and fitnesses. For large populations.'),
+                    sg.Combo(key='representation', values=[INDIVIDUALS, ARRAYS], default_value=INDIVIDUALS,
+                             pad=((0, 0), (20, 0)))
+                    ],
+
+                   [sg.Text('Islands', pad=((0, 5), (10, 0)),
+                            tooltip='With arrays, the number of populations evolving in separate processes'),
+                    sg.Slider(key='islands', range=(1, cpu_count() or 1), default_value=1,
+                              orientation='horizontal', size=(10, 20)),
+                    sg.Combo(key='topology', values=[RING, FULLY_CONNECTED], default_value=RING,
+                             pad=((5, 0), (10, 0)), tooltip='Where the best individuals of each island migrate')
+                    ],
+
+                   [sg.Text('Migrate every', pad=((0, 5), (10, 0)),
+                            tooltip='Generations between migrations. Each step is one such epoch.'),
+                    sg.Slider(key='migration_interval', range=(1, 50), default_value=10,
+                              orientation='horizontal', size=(10, 20))
+                    ],
+
+                   [sg.Text('Evaluation', pad=((0, 5), (10, 0)),
+                            tooltip='steady-state: replace two individuals at a time.\n'
+                                    'generational: create and evaluate a whole generation at a time.'),
+                    sg.Combo(key='evaluation', values=[STEADY_STATE, GENERATIONAL], default_value=STEADY_STATE,
+                             pad=((0, 0), (10, 0)))
+                    ],
+
+                   [sg.Text('Workers', pad=((0, 5), (10, 0)),
+                            tooltip='Fitness evaluation workers in generational mode'),
+                    sg.Slider(key='workers', range=(1, cpu_count() or 1), default_value=1,
+                              orientation='horizontal', size=(10, 20)),
+                    sg.Combo(key='pool', values=[PROCESSES, THREADS], default_value=PROCESSES,
+                             pad=((5, 0), (10, 0)),
+                             tooltip='Threads help only for fitness functions that release the GIL')
+                    ],
+
                    ]
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from math import hypot
+
+import numpy as np
+
+import core.gui as gui
+from core.sim_engine import SimEngine
+
+
+# Distances in the world's topology. If the GUI has an unchecked 'Bounce?' box, the world is a torus:
+# agents that leave one edge of the screen reappear at the other. The distance between two points is
+# then the length of the shortest of the (possibly wrapped) ways to get from one to the other.
+# This is the minimum-image distance: on each axis, a difference larger than half the screen
+# is replaced by the difference going the other way around.
+
+
+def wraps() -> bool:
+    """ The world wraps around unless there is no 'Bounce?' box or it is checked. """
+    bounce = SimEngine.gui_get('Bounce?')
+    return bounce is not None and not bounce
+
+
+def distance(x_1, y_1, x_2, y_2, wrap=None) -> float:
+    """
+    The distance from (x_1, y_1) to (x_2, y_2). If wrap is None, the world's topology decides.
+    Points are expected to be on the screen.
+    """
+    dx = abs(x_1 - x_2)
+    dy = abs(y_1 - y_2)
+    if wraps() if wrap is None else wrap:
+        width = gui.SCREEN_PIXEL_WIDTH()
+        if dx > width/2:
+            dx = width - dx
+        height = gui.SCREEN_PIXEL_HEIGHT()
+        if dy > height/2:
+            dy = height - dy
+    return hypot(dx, dy)
+
+
+def distances(xy_a, xy_b, wrap=None) -> np.ndarray:
+    """
+    The vectorized version of distance(). xy_a and xy_b are arrays of (x, y) pairs, i.e., with
+    shape (..., 2). They are broadcast against each other.
+    """
+    delta = np.abs(np.asarray(xy_a, dtype=float) - np.asarray(xy_b, dtype=float))
+    if wraps() if wrap is None else wrap:
+        size = np.array([gui.SCREEN_PIXEL_WIDTH(), gui.SCREEN_PIXEL_HEIGHT()], dtype=float)
+        delta = np.minimum(delta, size - delta)
+    return np.hypot(delta[..., 0], delta[..., 1])
+
+
+def pairwise_distances(xy_a, xy_b=None, wrap=None) -> np.ndarray:
+    """
+    The (len(xy_a), len(xy_b)) matrix of distances between the points in xy_a and those in xy_b.
+    If xy_b is None, the (square) matrix of distances among the points of xy_a.
+    """
+    xy_a = np.asarray(xy_a, dtype=float).reshape(-1, 2)
+    xy_b = xy_a if xy_b is None else np.asarray(xy_b, dtype=float).reshape(-1, 2)
+    return distances(xy_a[:, None, :], xy_b[None, :, :], wrap)
@@ -8,6 +8,7 @@ from pygame.draw import circle
 
 import core.gui as gui
 from core.agent import Agent, PYGAME_COLORS
+from core.force_layout import Barnes_Hut_Layout, Layout_Thread
 from core.gui import (BLOCK_SPACING, CIRCLE, HOR_SEP, KNOWN_FIGURES, NETLOGO_FIGURE, SCREEN_PIXEL_HEIGHT,
                       SCREEN_PIXEL_WIDTH, STAR)
 from core.link import Link, link_exists
@@ -43,9 +44,10 @@ class Graph_Node(Agent):
     def compute_velocity(self, screen_distance_unit, velocity_adjustment):
         repulsive_force: Velocity = Velocity((0, 0))
 
-        for node in (World.agents - {self}):
-            repulsive_force += self.force_as_dxdy(self.center_pixel, node.center_pixel, screen_distance_unit,
-                                                  repulsive=True)
+        for node in World.agents:
+            if node is not self:
+                repulsive_force += self.force_as_dxdy(self.center_pixel, node.center_pixel, screen_distance_unit,
+                                                      repulsive=True)
 
         # Also consider repulsive force from walls.
         repulsive_wall_force: Velocity = Velocity((0, 0))
@@ -61,8 +63,8 @@ class Graph_Node(Agent):
             repulsive_wall_force += self.force_as_dxdy(y_pixel, v_wall_pixel, screen_distance_unit, repulsive=True)
 
         attractive_force: Velocity = Velocity((0, 0))
-        for node in (World.agents - {self}):
-            if link_exists(self, node):
+        for node in World.agents:
+            if node is not self and link_exists(self, node):
                 attractive_force += self.force_as_dxdy(self.center_pixel, node.center_pixel, screen_distance_unit,
                                                        repulsive=False)
 
@@ -120,6 +122,10 @@ class Graph_World(World):
 
     def __init__(self, patch_class, agent_class):
         self.velocity_adjustment = 1
+        self.layout = Barnes_Hut_Layout()
+        self.layout_thread = None
+        # Which of PRINT_FORCE_VALUES, BACKGROUND_LAYOUT, or None (the foreground engine) moved the nodes last.
+        self.layout_mover = None
         super().__init__(patch_class, agent_class)
         self.shortest_path_links = None
         self.selected_nodes = set()
@@ -185,15 +191,12 @@ class Graph_World(World):
         are already linked, do nothing.
         """
         link_created = False
-        # sample() both copies and shuffles elements from its first argument.
-        # Can't use choice with World.agents because world.agents is a set and 
-        # can't be accessed through an index, which is what choice uses.
-        node_set_1 = sample(World.agents, len(World.agents))
+        # sample() both copies and shuffles the elements.
+        node_set_1 = World.agents.sample(len(World.agents))
         while not link_created:
             node_1 = node_set_1.pop()
             # Since node_1 has been popped from node_set_1,
             # node_set_2 does not contain node_1.
-            # Can't use choice with a set.
             node_set_2 = sample(node_set_1, len(node_set_1))
             while node_set_2:
                 node_2 = node_set_2.pop()
@@ -259,6 +262,42 @@ class Graph_World(World):
         """
         pass
 
+    def force_directed_step(self, dist_unit):
+        """
+        Move all the nodes one step with the array-based Barnes-Hut layout engine, either here or,
+        if BACKGROUND_LAYOUT is checked, on a worker thread. Either way, nothing moves once the layout
+        has settled until the graph or a force parameter changes.
+        The node-by-node computation in Graph_Node.adjust_distances is used only to print the force values.
+        """
+        mover = PRINT_FORCE_VALUES if SimEngine.gui_get(PRINT_FORCE_VALUES) else \
+                BACKGROUND_LAYOUT if SimEngine.gui_get(BACKGROUND_LAYOUT) else \
+                None
+        if mover != self.layout_mover:
+            # Another engine has moved the nodes. Both engines must re-read them.
+            self.layout.forget_graph()
+            if self.layout_thread:
+                self.layout_thread.forget_graph()
+            self.layout_mover = mover
+
+        if mover == PRINT_FORCE_VALUES:
+            for node in World.agents:
+                node.adjust_distances(dist_unit, self.velocity_adjustment)
+            return
+
+        params = dict(theta=SimEngine.gui_get(THETA), screen_distance_unit=dist_unit,
+                      rep_coeff=SimEngine.gui_get(REP_COEFF), rep_exponent=SimEngine.gui_get(REP_EXPONENT),
+                      att_coeff=SimEngine.gui_get(ATT_COEFF), att_exponent=SimEngine.gui_get(ATT_EXPONENT),
+                      velocity_adjustment=self.velocity_adjustment, bounce=bool(SimEngine.gui_get('Bounce?')))
+        if mover == BACKGROUND_LAYOUT:
+            if self.layout_thread is None:
+                self.layout_thread = Layout_Thread(Barnes_Hut_Layout())
+            self.layout_thread.sync(World.agents, World.links, **params)
+        else:
+            self.layout.load(World.agents, World.links)
+            self.layout.set_params(**params)
+            if self.layout.step():
+                self.layout.update_nodes()
+
     def handle_event(self, event):
         """
         This is called when a GUI widget is changed and the change isn't handled by the system.
@@ -271,8 +310,7 @@ class Graph_World(World):
         if event == CREATE_NODE:
             self.agent_class()
         elif event == DELETE_RANDOM_NODE:
-            # Can't use choice with a set.
-            node = sample(World.agents, 1)[0]
+            node = World.agents.choice()
             node.delete()
         elif event == CREATE_RANDOM_LINK:
             self.create_random_link()
@@ -285,7 +323,7 @@ class Graph_World(World):
         """ Select closest node. """
         patch = self.pixel_tuple_to_patch(xy)
         if len(patch.agents) == 1:
-            node = sample(patch.agents, 1)[0]
+            node = next(iter(patch.agents))
         else:
             patches = patch.neighbors_24()
             nodes = {node for patch in patches for node in patch.agents}
@@ -362,8 +400,7 @@ class Graph_World(World):
     def step(self):
         dist_unit = Graph_World.screen_distance_unit()
         if SimEngine.gui_get(LAYOUT) == FORCE_DIRECTED:
-            for node in World.agents:
-                node.adjust_distances(dist_unit, self.velocity_adjustment)
+            self.force_directed_step(dist_unit)
 
         self.compute_metrics()
 
@@ -402,6 +439,8 @@ REP_EXPONENT = 'rep_exponent'
 ATT_COEFF = 'att_coeff'
 ATT_EXPONENT = 'att_exponent'
 DIST_UNIT = 'dist_unit'
+THETA = 'theta'
+BACKGROUND_LAYOUT = 'Background layout'
 SHOW_NODE_IDS = "Show node id's"
 PRINT_FORCE_VALUES = 'Print force values'
 
@@ -491,11 +530,24 @@ graph_left_upper = [
                                resolution=1, pad=((0, 0), (0, 0)), size=(10, 20),
                                tooltip='The fraction of the screen diagonal used as one unit.')],
 
+                    [sg.Text('Barnes-Hut theta', pad=((0, 10), (20, 0)),
+                             tooltip='Groups of nodes whose size/distance is less than theta repel as one.\n'
+                                     '0 computes every pair exactly. Larger is faster and less exact.'),
+                     sg.Slider((0, 1.5), default_value=0.5, orientation='horizontal', key=THETA,
+                               resolution=0.1, pad=((0, 0), (0, 0)), size=(10, 20),
+                               tooltip='Groups of nodes whose size/distance is less than theta repel as one.\n'
+                                       '0 computes every pair exactly. Larger is faster and less exact.')],
+
                     [
                      sg.Checkbox("Show node id's", key=SHOW_NODE_IDS, default=False, pad=((20, 0), (20, 0))),
                      sg.Checkbox('Print force values', key=PRINT_FORCE_VALUES, default=False, pad=((20, 0), (20, 0)))
                      ],
 
+                    [sg.Checkbox('Lay out in the background', key=BACKGROUND_LAYOUT, default=False,
+                                 pad=((20, 0), (10, 0)),
+                                 tooltip='Compute the force-directed layout on a worker thread.\n'
+                                         'Either way, the layout stops when it settles.')],
+
                    ]
 
 
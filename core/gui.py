@@ -1,6 +1,8 @@
 import os
+from functools import lru_cache
 from typing import Tuple, Union
 
+import numpy as np
 import PySimpleGUI as sg
 import pygame as pg
 from pygame.color import Color
@@ -146,6 +148,56 @@ def draw_line(start_pixel, end_pixel, line_color: Color = Color('white'), width=
     line(gui.SCREEN, line_color, start_pixel, end_pixel, width)
 
 
+def draw_patch_states(states: np.ndarray, palette: np.ndarray, first_row=0) -> Rect:
+    """
+    Draw all the patches at once from a (PATCH_ROWS, PATCH_COLS) array of their states, e.g., bools.
+    A patch in state s is drawn in color palette[s], an rgb triple. Faster than drawing each patch's image.
+    To draw only some rows of patches, pass just their states and the number of the first one.
+    Returns the rect drawn.
+    """
+    (rows, cols) = states.shape
+    (pixel_rows, pixel_cols) = patch_pixel_maps(rows, cols, PATCH_SIZE)
+    # A final row and column of states, of the extra color at the end of the palette, are for the
+    # pixels between the patches.
+    extended_states = np.full((cols + 1, rows + 1), len(palette), dtype=np.intp)
+    extended_states[:cols, :rows] = states.T
+    extended_palette = np.vstack([palette, Color(SCREEN_COLOR)[:3]]).astype(np.uint8)
+    # pygame.surfarray indexes pixels by (x, y).
+    pixels = extended_palette[extended_states[np.ix_(pixel_cols, pixel_rows)]]
+    rect = Rect((0, first_row * BLOCK_SPACING()), pixels.shape[:2])
+    if rect.size == gui.SCREEN.get_size():
+        pg.surfarray.blit_array(gui.SCREEN, pixels)
+    else:
+        screen_pixels = pg.surfarray.pixels3d(gui.SCREEN)
+        screen_pixels[rect.left:rect.right, rect.top:rect.bottom] = pixels
+        # The screen is locked as long as screen_pixels exists.
+        del screen_pixels
+    return rect
+
+
+def scroll_patch_rows(nbr_rows) -> Rect:
+    """ Scroll the screen up by nbr_rows rows of patches. Returns the rect that changed. """
+    gui.SCREEN.scroll(0, -nbr_rows * BLOCK_SPACING())
+    return gui.SCREEN.get_rect()
+
+
+@lru_cache(maxsize=4)
+def patch_pixel_maps(rows, cols, patch_size) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The row of the patch at each pixel y and the column of the patch at each pixel x.
+    Pixels between patches map to row number rows and column number cols.
+    """
+    block_spacing = patch_size + 1
+
+    def patch_indices(nbr_patches):
+        pixels = np.arange(nbr_patches * block_spacing + 1) - 1
+        indices = pixels // block_spacing
+        indices[(pixels < 0) | (pixels % block_spacing == patch_size)] = nbr_patches
+        return indices
+
+    return (patch_indices(rows), patch_indices(cols))
+
+
 class SimpleGUI:
 
     def __init__(self, gui_left_upper, gui_right_upper=None, caption="Basic Model",
@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# The default number of quadtree nodes a Hash_Life keeps before it collects garbage.
+MAX_NODES = 2**21
+
+
+class Node:
+    """
+    A square quadtree node of side 2**level. A node of level 0 is a single cell. Otherwise, a node is
+    made of four nodes of the next level down: nw, ne, sw, and se. Nodes are canonical: Hash_Life.join
+    never makes two nodes with the same quadrants. So equal squares are the same Node.
+    """
+    __slots__ = ('level', 'nw', 'ne', 'sw', 'se', 'population')
+
+    def __init__(self, level, nw=None, ne=None, sw=None, se=None, population=0):
+        self.level = level
+        (self.nw, self.ne, self.sw, self.se) = (nw, ne, sw, se)
+        self.population = population
+
+    def __repr__(self):
+        return f'Node(level={self.level}, population={self.population})'
+
+
+class Hash_Life:
+    """
+    Gosper's HashLife for the Game of Life (B3/S23) on an unbounded plane.
+
+    The universe is a quadtree of canonical Nodes, centered on the origin. The cell at (row, col) of
+    an array of cells, e.g., the patches, is at (row - rows//2, col - cols//2). successor computes the
+    center of a node 2**j generations later and memoizes the result. Since patterns repeat, both in space
+    and in time, that lets step advance by huge numbers of generations.
+
+    The node table and the successor cache can fill memory. When the table has more than max_nodes nodes
+    after a step, collect discards the cache and all nodes no longer part of the universe.
+
+    Like Packed_Life, the engine is independent of the GUI. cells is a window of shape view_shape onto
+    the universe, e.g., to draw on the patches. Unlike Packed_Life, the universe doesn't wrap around.
+    """
+
+    def __init__(self, cells: np.ndarray, max_nodes=MAX_NODES):
+        self.max_nodes = max_nodes
+        self.table: Dict[Tuple[Node, Node, Node, Node], Node] = {}
+        self.successors: Dict[Tuple[Node, int], Node] = {}
+        self.leaves = (Node(0, population=0), Node(0, population=1))
+        self.empties: List[Node] = [self.leaves[0]]
+        self.view_shape = cells.shape
+        self.generation = 0
+        self.root: Node = None
+        self.set_cells(cells)
+
+    def build(self, cells: np.ndarray) -> Node:
+        """ The node for a square array of cells whose side is a power of 2. """
+        side = len(cells)
+        if side == 1:
+            return self.leaves[int(cells[0, 0])]
+        if not cells.any():
+            return self.empty(side.bit_length() - 1)
+        half = side // 2
+        return self.join(self.build(cells[:half, :half]), self.build(cells[:half, half:]),
+                         self.build(cells[half:, :half]), self.build(cells[half:, half:]))
+
+    @property
+    def cells(self) -> np.ndarray:
+        """ The view_shape window onto the universe, centered on the origin, as an array of bool. """
+        (rows, cols) = self.view_shape
+        window = np.zeros(self.view_shape, dtype=bool)
+        half_side = 2**(self.root.level - 1)
+        self.fill_window(window, self.root, -half_side + rows//2, -half_side + cols//2)
+        return window
+
+    def center(self, node) -> Node:
+        """ The node at the center of node, one level down. """
+        return self.join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+
+    def collect(self):
+        """ Forget the successor cache and the nodes no longer reachable from the root. """
+        self.successors.clear()
+        reachable = set()
+        unvisited = [self.root] + self.empties
+        while unvisited:
+            node = unvisited.pop()
+            if node.level > 0 and node not in reachable:
+                reachable.add(node)
+                unvisited.extend((node.nw, node.ne, node.sw, node.se))
+        self.table = {(node.nw, node.ne, node.sw, node.se): node for node in reachable}
+
+    def empty(self, level) -> Node:
+        while len(self.empties) <= level:
+            empty = self.empties[-1]
+            self.empties.append(self.join(empty, empty, empty, empty))
+        return self.empties[level]
+
+    def fill_window(self, window, node, top, left):
+        """ Set the live cells of node, whose upper left cell is at (top, left) in window. """
+        side = 2**node.level
+        (rows, cols) = window.shape
+        if node.population == 0 or top >= rows or left >= cols or top + side <= 0 or left + side <= 0:
+            return
+        if node.level == 0:
+            window[top, left] = True
+            return
+        half = side // 2
+        self.fill_window(window, node.nw, top, left)
+        self.fill_window(window, node.ne, top, left + half)
+        self.fill_window(window, node.sw, top + half, left)
+        self.fill_window(window, node.se, top + half, left + half)
+
+    def get_cell(self, row, col) -> bool:
+        """ Whether the cell at (row, col) of the view is alive. """
+        (y, x) = self.view_to_universe(row, col)
+        node = self.root
+        half_side = 2**(node.level - 1)
+        if not (-half_side <= y < half_side and -half_side <= x < half_side):
+            return False
+        (top, left) = (-half_side, -half_side)
+        while node.level > 0:
+            half = 2**(node.level - 1)
+            (south, east) = (y >= top + half, x >= left + half)
+            node = (node.se if east else node.sw) if south else (node.ne if east else node.nw)
+            (top, left) = (top + half*south, left + half*east)
+        return node.population == 1
+
+    def join(self, nw, ne, sw, se) -> Node:
+        """ The canonical node with these quadrants. """
+        key = (nw, ne, sw, se)
+        node = self.table.get(key)
+        if node is None:
+            node = Node(nw.level + 1, nw, ne, sw, se,
+                        nw.population + ne.population + sw.population + se.population)
+            self.table[key] = node
+        return node
+
+    def life_4x4(self, node) -> Node:
+        """ The center 2x2 cells of a 4x4 node one generation later. """
+        (nw, ne, sw, se) = (node.nw, node.ne, node.sw, node.se)
+        grid = [[cell.population for cell in row] for row in ((nw.nw, nw.ne, ne.nw, ne.ne),
+                                                              (nw.sw, nw.se, ne.sw, ne.se),
+                                                              (sw.nw, sw.ne, se.nw, se.ne),
+                                                              (sw.sw, sw.se, se.sw, se.se))]
+        next_cells = []
+        for (row, col) in ((1, 1), (1, 2), (2, 1), (2, 2)):
+            live_neighbors = sum(grid[r][c] for r in (row - 1, row, row + 1) for c in (col - 1, col, col + 1)) \
+                             - grid[row][col]
+            is_alive = live_neighbors == 3 or grid[row][col] and live_neighbors == 2
+            next_cells.append(self.leaves[int(is_alive)])
+        return self.join(*next_cells)
+
+    def pad(self, node) -> Node:
+        """ The node one level up with node at its center and empty space around it. """
+        empty = self.empty(node.level - 1)
+        return self.join(self.join(empty, empty, empty, node.nw), self.join(empty, empty, node.ne, empty),
+                         self.join(empty, node.sw, empty, empty), self.join(node.se, empty, empty, empty))
+
+    @property
+    def population(self) -> int:
+        return self.root.population
+
+    def set_cell(self, row, col, is_alive):
+        """ Set the cell at (row, col) of the view. """
+        (y, x) = self.view_to_universe(row, col)
+        while not (-2**(self.root.level - 1) <= min(y, x) and max(y, x) < 2**(self.root.level - 1)):
+            self.root = self.pad(self.root)
+
+        def set_in(node, top, left):
+            if node.level == 0:
+                return self.leaves[int(is_alive)]
+            half = 2**(node.level - 1)
+            (south, east) = (y >= top + half, x >= left + half)
+            quadrants = [node.nw, node.ne, node.sw, node.se]
+            quadrant = 2*south + east
+            quadrants[quadrant] = set_in(quadrants[quadrant], top + half*south, left + half*east)
+            return self.join(*quadrants)
+
+        half_side = 2**(self.root.level - 1)
+        self.root = set_in(self.root, -half_side, -half_side)
+
+    def set_cells(self, cells: np.ndarray):
+        """ Make cells, centered on the origin, the whole universe. """
+        (rows, cols) = cells.shape
+        # A square with a side that is a power of 2, with the origin at its center. At least 8x8.
+        half_side = 2**max(2, max(rows, cols).bit_length())
+        square = np.zeros((2*half_side, 2*half_side), dtype=bool)
+        (top, left) = (half_side - rows//2, half_side - cols//2)
+        square[top:top + rows, left:left + cols] = cells
+        self.root = self.build(square)
+
+    def step(self, generations=1):
+        """ Advance the universe by generations, a power of 2 at a time. """
+        for j in range(generations.bit_length()):
+            if generations >> j & 1:
+                self.step_power_of_2(j)
+
+    def step_power_of_2(self, j):
+        """ Advance the universe by 2**j generations. """
+        # The successor of a node of level k is correct for up to 2**(k-2) generations. Since a pattern
+        # grows at most one cell per generation, it will fit in the successor (of level k-1) as long as
+        # it is within the center quarter of the root and 2**j <= 2**(k-3).
+        root = self.root
+        while root.level < j + 3 or self.center(self.center(root)).population != root.population:
+            root = self.pad(root)
+        self.root = self.successor(root, j)
+        self.generation += 2**j
+        if len(self.table) > self.max_nodes:
+            self.collect()
+
+    def successor(self, node, j) -> Node:
+        """ The center of node, one level down, 2**j generations later. j must be at most node.level - 2. """
+        if node.population == 0:
+            return self.empty(node.level - 1)
+        key = (node, j)
+        result = self.successors.get(key)
+        if result is not None:
+            return result
+
+        if node.level == 2:
+            result = self.life_4x4(node)
+        else:
+            join = self.join
+            (nw, ne, sw, se) = (node.nw, node.ne, node.sw, node.se)
+            # The nine overlapping nodes, one level down, that tile node.
+            nine = [nw, join(nw.ne, ne.nw, nw.se, ne.sw), ne,
+                    join(nw.sw, nw.se, sw.nw, sw.ne), join(nw.se, ne.sw, sw.ne, se.nw),
+                    join(ne.sw, ne.se, se.nw, se.ne),
+                    sw, join(sw.ne, se.nw, sw.se, se.sw), se]
+            full_step = j == node.level - 2
+            # For a full step, advance twice by half as much. Otherwise, advance once and take centers.
+            nine = [self.successor(n, j - 1 if full_step else j) for n in nine]
+            quads = [(nine[i], nine[i+1], nine[i+3], nine[i+4]) for i in (0, 1, 3, 4)]
+            if full_step:
+                result = join(*[self.successor(join(*quad), j - 1) for quad in quads])
+            else:
+                result = join(*[join(q_nw.se, q_ne.sw, q_sw.ne, q_se.nw) for (q_nw, q_ne, q_sw, q_se) in quads])
+
+        self.successors[key] = result
+        return result
+
+    def toggle(self, row, col):
+        self.set_cell(row, col, not self.get_cell(row, col))
+
+    def view_to_universe(self, row, col) -> Tuple[int, int]:
+        (rows, cols) = self.view_shape
+        return (row - rows//2, col - cols//2)
+
+
+if __name__ == "__main__":
+    # Run python -m core.hashlife from the PyLogo directory. No GUI is needed.
+    from time import perf_counter
+
+    from core.life_engine import Packed_Life
+
+    # The R-pentomino. Compare with Packed_Life on a torus large enough not to wrap.
+    r_pentomino = np.zeros((5, 5), dtype=bool)
+    for (row, col) in ((1, 2), (1, 3), (2, 1), (2, 2), (3, 2)):
+        r_pentomino[row, col] = True
+    (rows, cols) = (401, 401)
+    board = np.zeros((rows, cols), dtype=bool)
+    board[rows//2 - 2:rows//2 + 3, cols//2 - 2:cols//2 + 3] = r_pentomino
+    packed = Packed_Life(board)
+    hash_life = Hash_Life(board)
+    for generations in (1, 2, 5, 16, 100):
+        packed.step(generations)
+        hash_life.step(generations)
+        assert np.array_equal(packed.cells, hash_life.cells), hash_life.generation
+
+    hash_life = Hash_Life(r_pentomino)
+    start = perf_counter()
+    hash_life.step(2**20)
+    print(f'R-pentomino after {hash_life.generation} generations: population {hash_life.population}. '
+          f'{perf_counter() - start:.2f} seconds. {len(hash_life.table)} nodes.')
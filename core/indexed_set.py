@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from collections.abc import MutableSet
+from random import randrange
+from typing import Iterable, List
+
+
+class Indexed_Set(MutableSet):
+    """
+    A set that supports uniform random choice and sampling in time independent of its size.
+
+    The elements are kept in a list. A dict maps each element to its index in the list. To remove an
+    element, move the last element of the list into its slot (swap-remove). So add, discard, remove,
+    membership, choice, and pop are all O(1), and sample(k) is O(k). The order of the elements is arbitrary.
+
+    As with a list, don't add or remove elements while iterating over an Indexed_Set. Iterate over
+    a copy, e.g., list(an_indexed_set), instead.
+    """
+
+    def __init__(self, elements: Iterable = ()):
+        self.elements: List = []
+        self.indices = {}
+        for element in elements:
+            self.add(element)
+
+    def __contains__(self, element):
+        return element in self.indices
+
+    def __iter__(self):
+        return iter(self.elements)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __repr__(self):
+        return f'Indexed_Set({self.elements})'
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        """
+        The result of a set operator, e.g., World.agents - {agent}. A plain set, which is built in C,
+        rather than an Indexed_Set built one add at a time.
+        """
+        return set(iterable)
+
+    def add(self, element):
+        if element not in self.indices:
+            self.indices[element] = len(self.elements)
+            self.elements.append(element)
+
+    def choice(self):
+        """ A random element. Raises IndexError if empty, like random.choice. """
+        return self.elements[randrange(len(self.elements))]
+
+    def clear(self):
+        self.elements = []
+        self.indices = {}
+
+    def discard(self, element):
+        index = self.indices.pop(element, None)
+        if index is None:
+            return
+        last = self.elements.pop()
+        if index < len(self.elements):
+            self.elements[index] = last
+            self.indices[last] = index
+
+    def pop(self):
+        """ Remove and return an arbitrary element: the last one. """
+        if not self.elements:
+            raise KeyError('pop from an empty Indexed_Set')
+        element = self.elements.pop()
+        del self.indices[element]
+        return element
+
+    def sample(self, k) -> List:
+        """
+        k different random elements, as random.sample would select them. A partial Fisher-Yates shuffle
+        moves them to the end of the list, which doesn't change the set.
+        """
+        (elements, indices) = (self.elements, self.indices)
+        len_elements = len(elements)
+        if not 0 <= k <= len_elements:
+            raise ValueError('Sample larger than population or is negative')
+        for i in range(len_elements - 1, len_elements - 1 - k, -1):
+            j = randrange(i + 1)
+            (elements[i], elements[j]) = (elements[j], elements[i])
+            indices[elements[i]] = i
+            indices[elements[j]] = j
+        return elements[len_elements - k:]
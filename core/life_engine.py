@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+from typing import Tuple
+
+import numpy as np
+
+# The number of cells in a word of a Packed_Life board.
+WORD_BITS = 64
+
+ONE = np.uint64(1)
+
+
+class Life_Like:
+    """
+    A board of a Life-like cellular automaton, on a torus, run with a Life_Like_Rule. Each cell has a state,
+    an np.uint8. 0 is dead and 1 is alive. With a Generations rule, 2 and up are dying.
+
+    A step counts every cell's live neighbors with rolls of the board, as Packed_Life does, but a cell per
+    byte instead of per bit. The next states are then looked up in the rule's table all at once.
+
+    Like Packed_Life, the board is independent of the GUI. See Life_World for how it's displayed.
+    """
+
+    def __init__(self, cells: np.ndarray, rule: Life_Like_Rule):
+        self.rule = rule
+        self.states: np.ndarray = None
+        self.set_cells(cells)
+
+    @property
+    def cells(self) -> np.ndarray:
+        """ The states of the cells, a (rows, cols) array of np.uint8. """
+        return self.states
+
+    def live_neighbors(self) -> np.ndarray:
+        alive = (self.states == 1).astype(np.uint8)
+        # The live cells in each cell's column of three, and then in its block of nine.
+        columns = alive + np.roll(alive, 1, axis=0) + np.roll(alive, -1, axis=0)
+        return columns + np.roll(columns, 1, axis=1) + np.roll(columns, -1, axis=1) - alive
+
+    def population(self) -> int:
+        return int(np.count_nonzero(self.states == 1))
+
+    def set_cells(self, cells: np.ndarray):
+        """ Set the states of the cells. States the rule doesn't have become dead. """
+        self.states = np.asarray(cells, dtype=np.uint8).copy()
+        self.states[self.states >= self.rule.nbr_states] = 0
+
+    def set_rule(self, rule: Life_Like_Rule):
+        if rule != self.rule:
+            self.rule = rule
+            self.set_cells(self.states)
+
+    def step(self, generations=1):
+        table = self.rule.table.ravel()
+        for _ in range(generations):
+            self.states = table.take(self.states.astype(np.intp) * 9 + self.live_neighbors())
+
+    def toggle(self, row, col):
+        """ Make a dead cell alive, and any other cell dead. """
+        self.states[row, col] = self.states[row, col] == 0
+
+
+class Life_Like_Rule:
+    """
+    An outer totalistic rule: a cell's next state depends only on its state and its number of live neighbors.
+    The rule string is in B/S notation. E.g., B3/S23 (Life), B36/S23 (HighLife), or B2/S (Seeds).
+    A dead cell with a number of live neighbors listed after the B is born. A live cell with a number
+    listed after the S survives. The letters may be in either case and either order.
+
+    A Generations rule adds the number of states, e.g., B2/S/C3 (Brian's Brain), or just B2/S/3. Cells that
+    don't survive then die gradually. They pass through the states 2, ..., nbr_states - 1 and then are dead.
+    Only state 1 counts as a live neighbor.
+
+    The rule is compiled into table, a (nbr_states, 9) array of np.uint8. The next state of a cell in state s
+    with n live neighbors is table[s, n].
+    """
+
+    def __init__(self, rule_string: str):
+        (self.births, self.survivals, self.nbr_states) = self.parse(rule_string)
+        self.table = self.compile()
+
+    def __eq__(self, other):
+        return isinstance(other, Life_Like_Rule) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        return f"Life_Like_Rule('{self}')"
+
+    def __str__(self):
+        rule_string = 'B' + ''.join(map(str, self.births)) + '/S' + ''.join(map(str, self.survivals))
+        return rule_string if self.nbr_states == 2 else f'{rule_string}/C{self.nbr_states}'
+
+    def compile(self) -> np.ndarray:
+        live_neighbors = np.arange(9)
+        table = np.zeros((self.nbr_states, 9), dtype=np.uint8)
+        table[0] = np.isin(live_neighbors, self.births)
+        # A live cell that doesn't survive starts dying, unless there are only two states.
+        table[1] = np.where(np.isin(live_neighbors, self.survivals), 1, 2 % self.nbr_states)
+        table[2:] = (np.arange(3, self.nbr_states + 1) % self.nbr_states).reshape(-1, 1)
+        return table
+
+    @staticmethod
+    def parse(rule_string: str) -> Tuple[Tuple[int, ...], Tuple[int, ...], int]:
+        """ The births, survivals, and number of states of rule_string. Raises ValueError if it isn't a rule. """
+        parts = {}
+        for part in rule_string.replace(' ', '').upper().split('/'):
+            (letter, digits) = ('C', part) if part.isdigit() and len(parts) == 2 else (part[:1], part[1:])
+            if letter not in 'BSC' or not letter or letter in parts or not digits.isdigit() and digits != '':
+                raise ValueError(f'Not a B/S rule: {rule_string}')
+            parts[letter] = digits
+        if 'B' not in parts or 'S' not in parts or parts.get('C') == '':
+            raise ValueError(f'Not a B/S rule: {rule_string}')
+        (births, survivals) = (tuple(sorted(set(map(int, parts[letter])))) for letter in 'BS')
+        nbr_states = int(parts.get('C', 2))
+        if not set(births + survivals) <= set(range(9)) or nbr_states < 2 or nbr_states > 256:
+            raise ValueError(f'Not a B/S rule: {rule_string}')
+        return (births, survivals, nbr_states)
+
+
+class Packed_Life:
+    """
+    A Game of Life (B3/S23) board on a torus, bit-packed into rows of np.uint64 words.
+    Cell (row, col) is bit col % 64 of word col // 64 of its row. Bits beyond the last column are 0.
+
+    A step updates 64 cells per word operation. For each cell, the three cells of its own column
+    in the rows above and below, and the two cells beside it, are added with bitwise full adders.
+    The rolls and shifts that bring those neighbors into line wrap around the edges of the board.
+
+    The board is independent of the GUI. See Life_World for how it's displayed.
+    """
+
+    def __init__(self, cells: np.ndarray):
+        (self.rows, self.cols) = cells.shape
+        self.nbr_words = -(-self.cols // WORD_BITS)
+        # The bit position of the last column in the last word of a row.
+        self.last_bit = np.uint64((self.cols - 1) % WORD_BITS)
+        self.last_word_mask = np.uint64(2**((self.cols - 1) % WORD_BITS + 1) - 1)
+        self.board: np.ndarray = self.pack(cells)
+
+    @property
+    def cells(self) -> np.ndarray:
+        """ The board as a (rows, cols) array of bool. """
+        bits = np.unpackbits(self.board.view(np.uint8), axis=1, bitorder='little')
+        return bits[:, :self.cols].view(bool)
+
+    def east_and_west(self, board) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Arrays whose cells are the cells of board to their east and to their west. Those of the first and
+        last columns wrap around. (Bits beyond the last column are garbage. step masks them out.)
+        """
+        east = (board >> ONE) | (np.roll(board, -1, axis=1) << np.uint64(WORD_BITS - 1))
+        east[:, -1] &= ~(ONE << self.last_bit)
+        east[:, -1] |= (board[:, 0] & ONE) << self.last_bit
+        west = (board << ONE) | (np.roll(board, 1, axis=1) >> np.uint64(WORD_BITS - 1))
+        west[:, 0] &= ~ONE
+        west[:, 0] |= (board[:, -1] >> self.last_bit) & ONE
+        return (east, west)
+
+    def pack(self, cells: np.ndarray) -> np.ndarray:
+        padded = np.zeros((self.rows, self.nbr_words * WORD_BITS), dtype=bool)
+        padded[:, :self.cols] = cells
+        return np.packbits(padded, axis=1, bitorder='little').view('<u8')
+
+    def population(self) -> int:
+        return int(np.unpackbits(self.board.view(np.uint8)).sum())
+
+    def set_cells(self, cells: np.ndarray):
+        self.board = self.pack(cells)
+
+    def step(self, generations=1):
+        for _ in range(generations):
+            board = self.board
+            (east, west) = self.east_and_west(board)
+            # The sum of east and west is (side_1, side_0) in binary. Adding board itself gives
+            # the sum of each cell's row of three, (row_1, row_0).
+            side_0 = east ^ west
+            side_1 = east & west
+            row_0 = side_0 ^ board
+            row_1 = side_1 | (side_0 & board)
+            # Add the rows of three above and below to the sides.
+            (up_0, down_0) = (np.roll(row_0, 1, axis=0), np.roll(row_0, -1, axis=0))
+            (up_1, down_1) = (np.roll(row_1, 1, axis=0), np.roll(row_1, -1, axis=0))
+            ud_0 = up_0 ^ down_0
+            count_0 = ud_0 ^ side_0
+            carry = (up_0 & down_0) | (ud_0 & side_0)
+            # The count is count_0 plus 2 times the number of the twos: up_1, down_1, side_1, and carry.
+            # A cell is alive in the next generation if the count is 3, or if it is 2 and the cell is alive.
+            # Either way, exactly one of the twos must be set.
+            ud_1 = up_1 ^ down_1
+            sc_1 = side_1 ^ carry
+            one_two = (ud_1 & ~(side_1 | carry)) | (sc_1 & ~(up_1 | down_1))
+            board = one_two & (count_0 | board)
+            board[:, -1] &= self.last_word_mask
+            self.board = board
+
+    def toggle(self, row, col):
+        (word, bit) = divmod(col, WORD_BITS)
+        self.board[row, word] ^= ONE << np.uint64(bit)
+
+
+if __name__ == "__main__":
+    # Run python -m core.life_engine from the PyLogo directory.
+    from time import perf_counter
+
+    rng = np.random.default_rng(0)
+
+    # Check against a straightforward NumPy version of the rules.
+    def reference_step(cells):
+        counts = sum(np.roll(np.roll(cells, dr, axis=0), dc, axis=1).astype(int)
+                     for dr in (-1, 0, 1) for dc in (-1, 0, 1) if (dr, dc) != (0, 0))
+        return (counts == 3) | cells & (counts == 2)
+
+    for shape in [(5, 3), (51, 51), (17, 64), (9, 130)]:
+        life = Packed_Life(rng.random(shape) < 0.35)
+        expected = life.cells
+        for _ in range(20):
+            expected = reference_step(expected)
+            life.step()
+            assert np.array_equal(life.cells, expected), shape
+
+    life = Life_Like(rng.random((51, 51)) < 0.35, Life_Like_Rule('S23/B3'))
+    expected = life.cells.astype(bool)
+    for _ in range(20):
+        expected = reference_step(expected)
+        life.step()
+        assert np.array_equal(life.cells, expected)
+
+    life = Packed_Life(rng.random((2000, 2000)) < 0.35)
+    nbr_generations = 200
+    start = perf_counter()
+    life.step(nbr_generations)
+    elapsed = perf_counter() - start
+    print(f'2000 x 2000: {nbr_generations/elapsed:.0f} generations/second. Population: {life.population()}.')
@@ -1,6 +1,7 @@
 from random import randint
 from typing import Tuple
 
+import numpy as np
 import PySimpleGUI as sg
 from pygame.color import Color
 
@@ -9,6 +10,9 @@ from core.sim_engine import SimEngine
 from core.utils import rgb_to_hex
 from core.world_patch_block import Patch, World
 
+# If more than this fraction of the patches have changed, draw_changes redraws the whole screen.
+DIRTY_RECT_FRACTION = 0.25
+
 
 class OnOffPatch(Patch):
 
@@ -24,10 +28,16 @@ class OnOffPatch(Patch):
         is_0_or_space = isinstance(is_on, str) and len(is_on) == 1 and is_on in ' 0'
         self.is_on = not is_0_or_space and bool(is_on)
         self.set_color(OnOffPatch.on_color if self.is_on else OnOffPatch.off_color)
+        if OnOffWorld.changed_patches is not None:
+            OnOffWorld.changed_patches.add(self)
 
 
 class OnOffWorld(World):
 
+    # The patches set since the screen was last drawn. None means that the whole screen must be drawn.
+    # See draw_changes.
+    changed_patches = None
+
     WHITE = '#ffffff'
     BLACK = '#000000'
 
@@ -37,6 +47,17 @@ class OnOffWorld(World):
     SELECT_ON_TEXT = 'Select "on" color'
     SELECT_OFF_TEXT = 'Select "off" color'
 
+    def draw_changes(self):
+        """ Draw only the changed patches, unless there are too many of them. """
+        changed_patches = OnOffWorld.changed_patches
+        OnOffWorld.changed_patches = set()
+        if changed_patches is None or len(changed_patches) > len(World.patches) * DIRTY_RECT_FRACTION or \
+                World.agents or World.links:
+            return None
+        for patch in changed_patches:
+            patch.draw()
+        return [patch.rect for patch in changed_patches]
+
     @staticmethod
     def get_color_and_update_button(button, default_color_string):
         key = button.get_text()
@@ -71,6 +92,21 @@ class OnOffWorld(World):
         patch = self.pixel_tuple_to_patch(xy)
         patch.set_on_off(not patch.is_on)
 
+    @staticmethod
+    def palette(nbr_states=2) -> np.ndarray:
+        """
+        The rgb colors of off and on patches, e.g., for gui.draw_patch_states. With more than two states,
+        as for the dying cells of a Generations rule, states 2 and up fade from the on color to the off color.
+        """
+        (off_color, on_color) = (np.array(OnOffPatch.off_color[:3]), np.array(OnOffPatch.on_color[:3]))
+        fading = np.arange(1, nbr_states - 1).reshape(-1, 1) / (nbr_states - 1)
+        fading_colors = np.rint(on_color + fading * (off_color - on_color))
+        return np.vstack([off_color, on_color, fading_colors]).astype(np.uint8)
+
+    def reset_all(self):
+        OnOffWorld.changed_patches = None
+        super().reset_all()
+
     def select_color(self, event):
         # There are two color-choosers: selecting_on and selecting_off. Determine and select the
         # desired color chooser based on the label on the button the user clicked.
@@ -98,6 +134,8 @@ class OnOffWorld(World):
                 patch.set_on_off(patch.is_on)
 
     def setup(self):
+        # Setup may change the patches without setting them on or off, e.g., by clearing them.
+        OnOffWorld.changed_patches = None
         self.get_colors()
         for patch in self.patches:
             is_on = randint(0, 100) < 10
@@ -110,7 +148,9 @@ class OnOffWorld(World):
         if isinstance(self, OnOffWorld):
             for patch in self.patches:
                 is_on = patch.is_on and randint(0, 100) < 90 or not patch.is_on and randint(0, 100) < 1
-                patch.set_on_off(is_on)
+                # Set only the patches that change so that only they are redrawn.
+                if is_on != patch.is_on:
+                    patch.set_on_off(is_on)
 
 
 # ############################################## Define GUI ############################################## #
@@ -1,40 +1,56 @@
 
 from __future__ import annotations
 
-from functools import lru_cache
-from math import copysign, hypot
+from math import copysign
+from operator import itemgetter
 from random import randint
 
+import core.geometry as geometry
 import core.gui as gui
 import core.utils as utils
-from core.sim_engine import SimEngine
+
+
+# Builds an XY (or subclass) instance directly from a tuple. Much faster than cls(tuple),
+# which goes through type.__call__. Used throughout for the hot paths.
+_new_xy = tuple.__new__
 
 
 class XY(tuple):
+    """
+    A pair of numbers. XY objects are tuples, but they have no __dict__ (__slots__ is empty)
+    and the arithmetic operations build their results directly from the numbers.
+
+    Tuples are immutable, so there are no truly in-place operations. The *_xy methods are the
+    next best thing: they take plain numbers and build a single new object, with no intermediate
+    XY objects along the way.
+    """
+
+    __slots__ = ()
 
     def __add__(self, xy: XY):
-        sum = (self.x + xy.x, self.y + xy.y)
-        return self.restore_type(sum)
+        return _new_xy(type(self), (self[0] + xy[0], self[1] + xy[1]))
 
     def __truediv__(self, scalar):
-        quot = (float('inf'), float('inf')) if scalar == 0 else self * (1/scalar)
-        return self.restore_type(quot)
+        quot = (float('inf'), float('inf')) if scalar == 0 else (self[0]/scalar, self[1]/scalar)
+        return _new_xy(type(self), quot)
 
     def __mul__(self, scalar):
-        prod = (self.x * scalar, self.y * scalar)
-        return self.restore_type(prod)
+        return _new_xy(type(self), (self[0] * scalar, self[1] * scalar))
 
     def __str__(self):
         clas_string = utils.extract_class_name(self.__class__)
         return f'{clas_string}{(self.x, self.y)}'
 
     def __sub__(self, xy: XY):
-        diff = (self.x - xy.x, self.y - xy.y)
-        return self.restore_type(diff)
+        return _new_xy(type(self), (self[0] - xy[0], self[1] - xy[1]))
+
+    def add_xy(self, dx, dy):
+        """ self + (dx, dy) without building an XY for (dx, dy). """
+        return _new_xy(type(self), (self[0] + dx, self[1] + dy))
 
     def as_int(self):
-        int_tuple = (int(self.x), int(self.y))
-        return self.restore_type(int_tuple)
+        int_tuple = (int(self[0]), int(self[1]))
+        return _new_xy(type(self), int_tuple)
 
     def as_tuple(self):
         return (self.x, self.y)
@@ -45,34 +61,28 @@ class XY(tuple):
         return self.restore_type((new_x, new_y))
 
     def restore_type(self, tuple):
-        cls = type(self)
-        return cls(tuple)
+        return _new_xy(type(self), tuple)
 
     def round(self, prec=0):
-        # rounded_tuple = (round(self.x, prec), round(self.y, prec))
-        # return self.restore_type(rounded)
-        return self.restore_type( (round(self.x, prec), round(self.y, prec)) )
-        # clas = type(self)
-        # return clas((round(self.x, prec), round(self.y, prec)))
+        return _new_xy(type(self), (round(self[0], prec), round(self[1], prec)))
 
     def wrap3(self, x_limit, y_limit):
-        wrapped_tuple = (self.x % x_limit, self.y % y_limit)
-        return self.restore_type(wrapped_tuple)
-        # xx = self.x % x_limit
-        # yy = self.y % y_limit
-        # return self.restore_type((xx, yy))
+        wrapped_tuple = (self[0] % x_limit, self[1] % y_limit)
+        return _new_xy(type(self), wrapped_tuple)
 
-    @property
-    def x(self):
-        return self[0]
+    def wrap3_xy(self, dx, dy, x_limit, y_limit):
+        """ (self + (dx, dy)).wrap3(x_limit, y_limit) with a single new object. """
+        return _new_xy(type(self), ((self[0] + dx) % x_limit, (self[1] + dy) % y_limit))
 
-    @property
-    def y(self):
-        return self[1]
+    # itemgetter properties are much faster than properties defined by functions.
+    x = property(itemgetter(0))
+    y = property(itemgetter(1))
 
 
 class Pixel_xy(XY):
 
+    __slots__ = ()
+
     # Will be set to Pixel_xy(0, 0) after the Pixel_xy class is defined.
     pixel_xy_00 = None
 
@@ -83,24 +93,9 @@ class Pixel_xy(XY):
         closest = min(blocks, key=lambda block: self.distance_to(block.center_pixel))
         return closest
 
-    def distance_to(self, other):
-        # Try all ways to get there possibly including wrapping around.
-        bounce = SimEngine.gui_get('Bounce?')
-        wrap = bounce is not None and not bounce
-
-        # Can't do this directly since importing World would be circular
-        end_pts = [(self, other)]
-        if wrap:
-            screen_width = gui.SCREEN_PIXEL_WIDTH()
-            screen_height = gui.SCREEN_PIXEL_HEIGHT()
-            wrapped_end_pts = [((self+a+b).wrap3(screen_width, screen_height),
-                                (other+a+b).wrap3(screen_width, screen_height))
-                               for a in [Pixel_xy.pixel_xy_00, Pixel_xy((screen_width/2, 0))]
-                               for b in [Pixel_xy.pixel_xy_00, Pixel_xy((0, screen_height/2))]
-                               ]
-            end_pts += wrapped_end_pts
-        dist = min(hypot(start.x - end.x, start.y - end.y) for (start, end) in end_pts)
-        return dist
+    def distance_to(self, other, wrap=None):
+        """ The distance to other, wrapping around the screen if the world does. See core.geometry. """
+        return geometry.distance(self[0], self[1], other[0], other[1], wrap)
 
     def heading_toward(self, to_pixel: Pixel_xy):
         """ The heading to face from the from_pixel to the to_pixel """
@@ -116,9 +111,8 @@ class Pixel_xy(XY):
         """
         Get the patch RowCol for this pixel
        """
-        row = self.y // gui.BLOCK_SPACING()
-        col = self.x // gui.BLOCK_SPACING()
-        return RowCol((int(row), int(col)))
+        block_spacing = gui.BLOCK_SPACING()
+        return _new_xy(RowCol, (int(self[1] // block_spacing), int(self[0] // block_spacing)))
 
     @staticmethod
     def random_pixel():
@@ -127,11 +121,20 @@ class Pixel_xy(XY):
         return Pixel_xy((x_random, y_random))
 
     def wrap(self):
-        screen_rect = gui.SCREEN.get_rect()
-        # Must wrap at screen_rect.w-1 and screen_rect.h-1 because the screen
-        # is one pixel larger than the grid of patches.
-        wrapped = self.wrap3(screen_rect.w-1, screen_rect.h-1)
-        return wrapped
+        return self.wrap_xy(0, 0)
+
+    def wrap_xy(self, dx, dy):
+        """ (self + (dx, dy)).wrap() with a single new object. """
+        (w, h) = gui.SCREEN.get_size()
+        # Must wrap at w-1 and h-1 because the screen is one pixel larger than the grid of patches.
+        x = (self[0] + dx) % (w-1)
+        y = (self[1] + dy) % (h-1)
+        # A tiny negative number modulo a limit may round to the limit itself, which is off the grid.
+        if x == w-1:
+            x = 0.0
+        if y == h-1:
+            y = 0.0
+        return _new_xy(Pixel_xy, (x, y))
 
 
 Pixel_xy.pixel_xy_00 = Pixel_xy((0, 0))
@@ -139,16 +142,18 @@ Pixel_xy.pixel_xy_00 = Pixel_xy((0, 0))
 
 class RowCol(XY):
 
+    __slots__ = ()
+
     def __str__(self):
         return f'RowCol{self.row, self.col}'
 
     @property
     def col(self):
-        return int(self.y)
+        return int(self[1])
 
     @property
     def row(self):
-        return int(self.x)
+        return int(self[0])
 
     def patch_to_center_pixel(self) -> Pixel_xy:
         """
@@ -166,6 +171,8 @@ class RowCol(XY):
 
 class Velocity(XY):
 
+    __slots__ = ()
+
     velocity_00 = None
 
     def __str__(self):
@@ -174,13 +181,8 @@ class Velocity(XY):
     # The @property decorator allows you to call the function without parentheses:
     # v = Velocity(3, 4)
     # v.dx => 3
-    @property
-    def dx(self):
-        return self.x
-
-    @property
-    def dy(self):
-        return self.y
+    dx = property(itemgetter(0))
+    dy = property(itemgetter(1))
 
 
 Velocity.velocity_00 = Velocity((0, 0))
@@ -193,20 +195,17 @@ def center_pixel():
 
 
 def heading_and_speed_to_velocity(heading, speed) -> Velocity:
-    unit_dxdy = heading_to_unit_dxdy(heading)
-    velocity = unit_dxdy * speed
-    return velocity
+    (dx, dy) = heading_to_unit_dxdy(heading)
+    return _new_xy(Velocity, (dx * speed, dy * speed))
 
 
-@lru_cache(maxsize=512)
 def heading_to_unit_dxdy(heading) -> Velocity:
     """ Convert a heading to a (dx, dy) pair as a unit velocity """
-    angle = utils.heading_to_angle(heading)
-    dx = utils.cos(angle)
-    # The -1 accounts for the y-axis being inverted.
-    dy = (-1) * utils.sin(angle)
-    vel = Velocity((dx, dy))
-    return vel
+    return _unit_dxdys[heading % 360] if type(heading) is int else _unit_dxdys[utils.normalize_360(heading)]
+
+
+# The unit velocities, indexed by heading. utils.dy accounts for the y-axis being inverted.
+_unit_dxdys = [Velocity((utils.dx(heading), utils.dy(heading))) for heading in range(360)]
 
 
 if __name__ == "__main__":
@@ -275,3 +274,27 @@ if __name__ == "__main__":
     # v30 = (v1 - v20).wrap3(screen_width, screen_height)
     # print(v1.distance_to(v30, True))
     # print(v1.distance_to(v30, False))
+
+    print('\n-----Agent.forward() timing-----')
+    # Run python -m core.pairs from the PyLogo directory. Uses a headless screen: no window opens.
+    import os
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    from random import randint
+    from timeit import timeit
+
+    import pygame as pg
+
+    from core.agent import Agent
+    from core.sim_engine import SimEngine
+    from core.world_patch_block import Patch, World
+
+    pg.init()
+    gui.SCREEN = pg.display.set_mode((gui.SCREEN_PIXEL_WIDTH(), gui.SCREEN_PIXEL_HEIGHT()))
+    World(Patch, Agent)
+    agents = [Agent() for _ in range(200)]
+    for agent in agents:
+        agent.set_heading(randint(0, 359))
+    for bounce in [True, False]:
+        SimEngine.values = {'Bounce?': bounce}
+        secs = timeit(lambda: [agent.forward(3) for agent in agents], number=100)
+        print(f'Bounce? {bounce}: {round(1_000_000 * secs / (100 * len(agents)), 2)} microseconds per forward()')
@@ -35,10 +35,17 @@ class SimEngine:
         self.graph_point = None
 
     def draw_world(self):
-        """ Fill the screen with the background color, draw the world, and update the display. """
-        self.simple_gui.fill_screen()
-        self.world.draw()
-        pg.display.update()
+        """
+        Fill the screen with the background color, draw the world, and update the display.
+        If the world can draw just what has changed (see World.draw_changes), update only those rects.
+        """
+        dirty_rects = self.world.draw_changes()
+        if dirty_rects is None:
+            self.simple_gui.fill_screen()
+            self.world.draw()
+            pg.display.update()
+        else:
+            pg.display.update(dirty_rects)
 
     @staticmethod
     def gui_get(key):
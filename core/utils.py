@@ -1,50 +1,34 @@
 
 from __future__ import annotations
 
-# We also cache calls to trig functions
 import math
-from functools import lru_cache
 from math import copysign
 from random import randint
 
 from pygame.color import Color
 
-# noinspection PyUnresolvedReferences
-import core.utils as utils
-
 
 # ###################### Start trig functions in degrees ###################### #
 # import Python's trig functions, which are in radians. pi radians == 180 degrees
 # These functions expect their arguments in degrees.
 
-
-def atan2(y, x):
-    xy_max = max(abs(x), abs(y))
-    (y_n, x_n) = (int(round(100*y/xy_max)), int(round(100*x/xy_max)))
-    return atan2_normalized(y_n, x_n)
+# Angles and headings are integers in range(360). So rather than compute (or cache) trig values
+# as needed, look them up in tables indexed by angle or heading.
+# (Indexing a list is faster than indexing an np.ndarray and produces a Python float.)
+_COS = [math.cos(math.radians(degrees)) for degrees in range(360)]
+_SIN = [math.sin(math.radians(degrees)) for degrees in range(360)]
 
 
-@lru_cache(maxsize=1024)
-def atan2_normalized(y, x):
+def atan2(y, x):
     return math.degrees(math.atan2(y, x))
 
 
 def cos(degrees):
-    return _cos(normalize_360(degrees))
-
-
-@lru_cache(maxsize=512)
-def _cos(degrees):
-    return math.cos(math.radians(degrees))
+    return _COS[degrees % 360] if type(degrees) is int else _COS[normalize_360(degrees)]
 
 
 def sin(degrees):
-    return _sin(normalize_360(degrees))
-
-
-@lru_cache(maxsize=512)
-def _sin(degrees):
-    return math.sin(math.radians(degrees))
+    return _SIN[degrees % 360] if type(degrees) is int else _SIN[normalize_360(degrees)]
 
 
 # ###################### End trig functions in degrees ###################### #
@@ -73,33 +57,24 @@ def dxdy_to_heading(dx, dy, default_heading=None):
     if dx == 0 == dy:
         return default_heading
     else:
-        # (-1) to compensate for inverted y-axis.
-        angle = utils.atan2((-1) * dy, dx)
-        new_heading = angle_to_heading(angle)
-        return new_heading
+        # Headings are measured clockwise from straight up. Since the y-axis is inverted, up is -dy.
+        # So the heading is the angle from (0, -1) to (dx, dy), which atan2 finds exactly.
+        return int(round(math.degrees(math.atan2(dx, -dy)))) % 360
 
 
-def dx(heading):
-    return _dx(heading)
+# The (dx, dy) of moving one unit in the heading direction. Indexed by heading.
+# dy is made negative to account for the inverted y axis.
+# (90 - heading) % 360 is heading_to_angle(heading), which isn't defined yet.
+_DX = [_COS[(90 - heading) % 360] for heading in range(360)]
+_DY = [(-1)*_SIN[(90 - heading) % 360] for heading in range(360)]
 
 
-@lru_cache(maxsize=512)
-def _dx(heading):
-    angle = heading_to_angle(heading)
-    delta_x = utils.cos(angle)
-    return delta_x
+def dx(heading):
+    return _DX[heading % 360] if type(heading) is int else _DX[normalize_360(heading)]
 
 
 def dy(heading):
-    return _dy(heading)
-
-
-@lru_cache(maxsize=512)
-def _dy(heading):
-    angle = heading_to_angle(heading)
-    delta_y = utils.sin(angle)
-    # make it negative to account for inverted y axis
-    return (-1)*delta_y
+    return _DY[heading % 360] if type(heading) is int else _DY[normalize_360(heading)]
 
 
 def extract_class_name(full_class_name: type):
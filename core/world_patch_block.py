@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 from math import sqrt
-from typing import Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 from pygame.color import Color
@@ -15,6 +15,7 @@ import core.gui as gui
 # noinspection PyUnresolvedReferences
 import core.world_patch_block as world
 from core.gui import SHAPES
+from core.indexed_set import Indexed_Set
 from core.pairs import center_pixel, Pixel_xy, RowCol
 from core.utils import get_class_name
 
@@ -141,12 +142,11 @@ class Patch(Block):
     def neighbors(self, deltas):
         """
         The neighbors of this patch determined by the deltas.
-        Note the addition of two RowCol objects to produce a new RowCol object: self.row_col + utils.RowCol(r, c).
-        Wrap around is handled by RowCol. We then use the RowCol object as a tuple to access the np.ndarray
+        Wrap around is done directly on the row and col numbers, which then index the np.ndarray.
         """
-        # noinspection PyUnresolvedReferences
-        neighbors = [World.patches_array[(self.row_col + RowCol((r, c))).wrap().as_int()]
-                     for (r, c) in deltas]
+        (row, col) = self.row_col.as_int()
+        (rows, cols) = (gui.PATCH_ROWS, gui.PATCH_COLS)
+        neighbors = [World.patches_array[(row + r) % rows, (col + c) % cols] for (r, c) in deltas]
         return neighbors
 
     def remove_agent(self, agent):
@@ -176,7 +176,8 @@ class World:
 
     @staticmethod
     def clear_all():
-        World.agents = set()
+        # An Indexed_Set, so models can choose or sample random agents quickly, e.g., World.agents.choice().
+        World.agents = Indexed_Set()
         World.links = set()
         for patch in World.patches:
             patch.clear()
@@ -228,6 +229,13 @@ class World:
         for agent in World.agents:
             agent.draw()
 
+    def draw_changes(self) -> Optional[List[Rect]]:
+        """
+        Draw only what has changed since the screen was last drawn and return the rects drawn.
+        The default returns None, which means that nothing was drawn: redraw the whole screen. See draw.
+        """
+        return None
+
     def final_thoughts(self):
         """ Add any final tests, data gathering, summarization, etc. here. """
         pass